@@ -1,22 +1,72 @@
-def assemble(instructions):
-    address = 0
-    labels = {}
+#the operations whose srcb is a label
+jumps = set([
+    "goto", "jump if false", "jump and link",
+    "beq", "bne", "blt", "bgt", "ble", "bge",
+])
 
-    new_instructions = []
-    for instruction in instructions:
-        operation, dest, srca, srcb = instruction
-        if operation == "label":
-            labels[dest] = address
+#"label address" loads the address of the label in srcb, it is assembled as
+#a literal
+addresses = set(["label address"])
+
+#the directives which lay out the data segment, "word" places the value in
+#srcb, "zero" places srcb zeros. If dest is not 0, it is a label given the
+#address of the data
+data = set(["word", "zero"])
+
+class AssemblerError(Exception):
+    def __init__(self, message):
+        Exception.__init__(self, message)
+
+class Assembler:
+
+    """Assemble instructions as they are appended. Jumps are resolved once
+    the last instruction has been appended, when every label is known, and
+    a label that was never defined is an AssemblerError.
+
+    The data segment is laid out from address 0, in the order the directives
+    are appended, and follows the code in the assembled instructions, with
+    the address of each directive in dest."""
+
+    def __init__(self):
+        self.instructions = []
+        self.labels = {}
+        self.references = [] #the index of each jump
+        self.data = [] #the directives of the data segment
+        self.size = 0 #the words in the data segment
+
+    def append(self, instruction):
+        operation = instruction[0]
+        if operation in data:
+            if instruction[1]:
+                self.labels[instruction[1]] = self.size
+            self.data.append((operation, self.size, 0, instruction[3]))
+            self.size += 1 if operation == "word" else instruction[3]
+        elif operation == "label":
+            self.labels[instruction[1]] = len(self.instructions)
         else:
-            new_instructions.append(instruction)
-            address += 1
-    
-    instructions = new_instructions
-    new_instructions = []
-    for instruction in instructions:
-        operation, dest, srca, srcb = instruction
-        if srcb in labels:
-            srcb = labels[srcb]
-        new_instructions.append((operation, dest, srca, srcb))
+            if operation in jumps or operation in addresses:
+                self.references.append(len(self.instructions))
+            self.instructions.append(instruction)
+
+    def finish(self):
+
+        """Return the assembled instructions."""
 
-    return new_instructions
+        instructions = self.instructions
+        labels = self.labels
+        for index in self.references:
+            operation, dest, srca, srcb = instructions[index]
+            if operation in addresses:
+                operation = "literal"
+            if srcb not in labels:
+                raise AssemblerError(
+                    "Label {0} is used but never defined".format(srcb))
+            instructions[index] = (operation, dest, srca, labels[srcb])
+        self.references = []
+        return instructions + self.data
+
+def assemble(instructions):
+    assembler = Assembler()
+    for instruction in instructions:
+        assembler.append(instruction)
+    return assembler.finish()
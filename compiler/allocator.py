@@ -0,0 +1,250 @@
+"""
+
+allocator
+=========
+
+The register allocator keeps the local variables of each function in general
+purpose registers, using linear scan allocation over live intervals.
+
+The nodes of a function are numbered in the order they are evaluated,
+children first. The live interval of a local variable runs from its
+initialisation (the entry of the function, for an argument, or its first use
+if it is declared without an initial value) to its last use. A variable used
+within a loop, but declared outside it, is live throughout the loop. If a
+function contains labels, its variables are live throughout the function.
+
+Intervals are allocated registers in order of their start. When no register
+is free, the least used of the competing intervals is spilled, and its
+variable is kept in its stack slot. Variables whose address is taken are
+always kept in their stack slots.
+
+Variables are allocated registers from the highest down, the registers below
+are left for expression temporaries. At least min_temporaries registers are
+always left for temporaries. The registers of variables which are live across
+a function call are saved on the stack around the call. A register is not
+saved at a call before the variable is first defined, unless the call can be
+reached again after the definition, by a loop or a goto. The function then
+clears the register on entry, so that it is never saved before it is set.
+
+Before code is generated, each expression is labelled with the number of
+registers needed to evaluate it in registers (its Sethi-Ullman number), so
+that the code generator can choose between register and stack evaluation
+once for each node.
+
+"""
+
+import registers
+import tree
+
+#the registers available to local variables
+min_temporaries = 8
+local_registers = range(registers.maxgpr, min_temporaries - 1, -1)
+
+class Interval:
+
+    """The live interval of a local variable"""
+
+    def __init__(self, declarator, declared, start):
+        self.declarator = declarator
+        self.declared = declared
+        self.defined = start #the first definition
+        self.start = start
+        self.end = start
+        self.uses = 0
+        self.register = None
+
+
+class Allocation:
+
+    """The registers allocated to the local variables of a function"""
+
+    def __init__(self, name):
+        self.name = name
+        self.registers = {} #the register of each declarator kept in one
+        self.saved = {} #the registers to save around each function call
+        self.cleared = [] #the registers to clear on entry to the function
+        self.spills = 0 #variables that could have been kept in a register
+        self.maxgpr = registers.maxgpr #the last register left for temporaries
+        self.frame = 0 #the stack slots of the arguments and variables
+        self.escapes = False #the address of a variable in the frame is taken
+
+    def report(self):
+        return "{0}: {1} in registers, {2} spilled".format(
+            self.name, len(self.registers), self.spills)
+
+
+def allocate(function):
+
+    """Return the Allocation for a DeclareFunction node."""
+
+    symbol = getattr(function, "symbol", None)
+    allocation = Allocation(symbol.name if symbol else "function")
+
+    intervals = {}
+    address_taken = set()
+    loops = []
+    calls = []
+    labels = False
+    starts = {} #the first position in the subtree of each node
+
+    arguments = set(function.args)
+    position = 0
+    for node in tree.walk(function):
+        position += 1
+        children = tree.child_nodes(node)
+        starts[node] = min([starts[child] for child in children] or [position])
+        kind = node.__class__
+
+        if kind is tree.Declarator:
+            allocation.frame = max(allocation.frame, node.offset + 1)
+            if node in arguments:
+                intervals[node] = Interval(node, 0, 0)
+            elif node.expression is not None:
+                intervals[node] = Interval(node, position, position)
+            else:
+                #live from the first use, rather than the declaration
+                intervals[node] = Interval(node, position, None)
+        elif kind is tree.Variable:
+            interval = intervals.get(node.declarator)
+            if interval is not None:
+                if interval.start is None:
+                    interval.start = interval.end = position
+                interval.start = min(interval.start, position)
+                interval.end = max(interval.end, position)
+                interval.uses += 1
+        elif kind is tree.Assignment:
+            #the assignment follows its value, the variable assigned to
+            #precedes it
+            if node.left.__class__ is tree.Variable:
+                interval = intervals.get(node.left.declarator)
+                if interval is not None and interval.defined is None:
+                    interval.defined = position
+        elif kind is tree.Address:
+            if (node.expression.__class__ is tree.Variable and
+                node.expression.declarator in intervals):
+                address_taken.add(node.expression.declarator)
+        elif kind is tree.While or kind is tree.DoWhile:
+            loops.append((starts[node], position))
+        elif kind is tree.FunctionCall:
+            calls.append((position, node))
+        elif kind is tree.Label or kind is tree.Goto:
+            labels = True
+
+    #a variable that is never assigned is never defined
+    for interval in intervals.values():
+        if interval.defined is None:
+            interval.defined = position + 1
+
+    #Extend the intervals to cover the loops they are live around. An
+    #extended interval may overlap further loops, so the loops are scanned
+    #again until no interval changes.
+    for interval in intervals.values():
+        if interval.start is None:
+            continue
+        if labels:
+            interval.start, interval.end = 0, position
+            continue
+        extended = True
+        while extended:
+            extended = False
+            for loop_start, loop_end in loops:
+                if (interval.declared < loop_start <= interval.end and
+                    interval.start <= loop_end and
+                    (loop_start < interval.start or loop_end > interval.end)):
+                    interval.start = min(interval.start, loop_start)
+                    interval.end = max(interval.end, loop_end)
+                    extended = True
+
+    candidates = [
+        interval for interval in intervals.values()
+        if interval.declarator not in address_taken and
+        interval.start is not None
+    ]
+    candidates.sort(key=lambda interval:interval.start)
+
+    free = list(local_registers)
+    active = []
+    for interval in candidates:
+        for expired in [i for i in active if i.end < interval.start]:
+            active.remove(expired)
+            free.append(expired.register)
+
+        if free:
+            interval.register = max(free)
+            free.remove(interval.register)
+            active.append(interval)
+        else:
+            spilled = min(active + [interval], key=lambda i:i.uses)
+            if spilled is not interval:
+                interval.register = spilled.register
+                spilled.register = None
+                active.remove(spilled)
+                active.append(interval)
+            allocation.spills += 1
+
+    allocation.escapes = bool(address_taken)
+    for interval in candidates:
+        if interval.register is not None:
+            allocation.registers[interval.declarator] = interval.register
+    if allocation.registers:
+        allocation.maxgpr = min(allocation.registers.values()) - 1
+
+    def repeated(first, second):
+
+        """Return True if the node at position first can be reached again
+        after the node at position second."""
+
+        return labels or any(
+            loop_start <= first and second <= loop_end
+            for loop_start, loop_end in loops)
+
+    cleared = set()
+    for position, call in calls:
+        saved = []
+        for interval in candidates:
+            if (interval.register is None or
+                not interval.start < position < interval.end):
+                continue
+            if position < interval.defined:
+                if not repeated(position, interval.defined):
+                    continue
+                cleared.add(interval.register)
+            saved.append(interval.register)
+        allocation.saved[call] = sorted(saved)
+    allocation.cleared = sorted(cleared)
+
+    return allocation
+
+
+def register_needs(root):
+
+    """
+
+    Return the number of registers needed to evaluate each expression below
+    root, keyed by node. Expressions which must be evaluated on the stack,
+    such as function calls, and those containing them, are left out.
+
+    The operand needing more registers is evaluated first, which is always
+    possible, because the expressions evaluated in registers have no side
+    effects.
+
+    """
+
+    needs = {}
+    for node in tree.walk(root):
+        kind = node.__class__
+        if (kind is tree.Constant or kind is tree.Variable or
+            kind is tree.String):
+            needs[node] = 1
+        elif kind is tree.Convert:
+            if node.expression in needs:
+                needs[node] = needs[node.expression]
+        elif kind is tree.Binary:
+            left = needs.get(node.left)
+            right = needs.get(node.right)
+            if left is not None and right is not None:
+                if left == right:
+                    needs[node] = left + 1
+                else:
+                    needs[node] = max(left, right)
+    return needs
@@ -0,0 +1,287 @@
+"""
+
+cache
+=====
+
+Assembled programs are cached on disk, so that an unchanged program is not
+compiled again.
+
+The cache is content addressed. An entry is named by the SHA-1 of the
+source text, the compiler's own source files and the directories searched
+for included files. An entry also records each header the program included,
+and is used only while those headers are unchanged.
+
+An entry holds the instruction list in a compact binary form: the operation
+of each instruction is stored as a byte indexing a table of operation names,
+followed by a flat tuple of the operands.
+
+When the entries exceed the size limit, the least recently used are removed.
+
+"""
+
+import os
+import mmap
+import marshal
+import hashlib
+import tempfile
+from array import array
+
+import parser
+import inline
+import loops
+import simplify
+import optimizer
+import assembler.assembler as assembler
+
+#version of the cache entry format
+cache_format = 1
+
+default_directory = os.environ.get(
+    "SIMPLE_C_CACHE",
+    os.path.join(os.path.expanduser("~"), ".cache", "simple_c"))
+
+default_limit = 16 * 1024 * 1024 #bytes
+
+suffix = ".bin"
+
+#the digest of the compiler's source, calculated when first needed
+version = None
+
+def compiler_version():
+
+    """Return the SHA-1 of the source files of the compiler and assembler."""
+
+    global version
+    if version is None:
+        digest = hashlib.sha1()
+        for module in [parser, assembler]:
+            directory = os.path.dirname(os.path.abspath(module.__file__))
+            for name in sorted(os.listdir(directory)):
+                if name.endswith(".py"):
+                    digest.update(name)
+                    digest.update(open(os.path.join(directory, name)).read())
+        version = digest.hexdigest()
+    return version
+
+def source_digest(source):
+
+    """Return the SHA-1 of *source*, a string or a file."""
+
+    if isinstance(source, basestring):
+        return hashlib.sha1(source).hexdigest()
+    if not os.fstat(source.fileno()).st_size:
+        return hashlib.sha1("").hexdigest()
+    mapped = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+    digest = hashlib.sha1(mapped).hexdigest()
+    mapped.close()
+    return digest
+
+def file_digest(path):
+    return hashlib.sha1(open(path, "rb").read()).hexdigest()
+
+def encode(instructions, dependencies):
+
+    """Return the binary form of a cache entry."""
+
+    names = sorted(set(instruction[0] for instruction in instructions))
+    codes = dict((name, code) for code, name in enumerate(names))
+    operations = array("B", [codes[instruction[0]] for instruction in instructions])
+    operands = []
+    for operation, dest, srca, srcb in instructions:
+        operands.extend((dest, srca, srcb))
+    return marshal.dumps((
+        cache_format, dependencies, names, operations.tostring(), tuple(operands)
+    ))
+
+def decode(data):
+
+    """Return the (instructions, dependencies) of a cache entry, or None if
+    the entry was written in another format."""
+
+    entry = marshal.loads(data)
+    if entry[0] != cache_format:
+        return None
+    version, dependencies, names, operations, operands = entry
+    instructions = []
+    index = 0
+    for code in array("B", operations):
+        instructions.append((names[code],) + operands[index:index+3])
+        index += 3
+    return instructions, dependencies
+
+
+class CompileCache:
+
+    """
+
+    A directory of assembled programs
+
+    *limit* is the total size, in bytes, the entries may occupy.
+
+    """
+
+    def __init__(self, directory=default_directory, limit=default_limit):
+        self.directory = directory
+        self.limit = limit
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, source, filename=None, include_path=None):
+
+        """Return the key of the entry for *source*."""
+
+        digest = hashlib.sha1(compiler_version())
+        digest.update(source_digest(source))
+        if filename is not None:
+            digest.update(os.path.dirname(os.path.abspath(filename)))
+        for directory in include_path or ["."]:
+            digest.update("\0" + os.path.abspath(directory))
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + suffix)
+
+    def get(self, key):
+
+        """Return the cached instructions for *key*, or None."""
+
+        path = self.path(key)
+        try:
+            entry = decode(open(path, "rb").read())
+        except (IOError, EOFError, ValueError, TypeError):
+            entry = None
+        if entry is None or not self.valid(entry[1]):
+            self.misses += 1
+            return None
+
+        try:
+            os.utime(path, None) #mark the entry as recently used
+        except OSError:
+            pass
+        self.hits += 1
+        return entry[0]
+
+    def valid(self, dependencies):
+
+        """Return True if the headers in *dependencies* are unchanged."""
+
+        for path, mtime, size, digest in dependencies:
+            try:
+                status = os.stat(path)
+                if (status.st_mtime, status.st_size) == (mtime, size):
+                    continue
+                if file_digest(path) != digest:
+                    return False
+            except (IOError, OSError):
+                return False
+        return True
+
+    def put(self, key, instructions, dependencies):
+
+        """Store *instructions* under *key*, with the (path, mtime, size,
+        digest) of each header they depend on."""
+
+        #The entry is written to a temporary file, and renamed into place, so
+        #that other processes never see a partial entry. The cache is only an
+        #optimisation, so a failure to write it is ignored.
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            handle, temporary = tempfile.mkstemp(suffix, dir=self.directory)
+            os.write(handle, encode(instructions, dependencies))
+            os.close(handle)
+            os.rename(temporary, self.path(key))
+            self.evict()
+        except (IOError, OSError):
+            pass
+
+    def evict(self):
+
+        """Remove the least recently used entries, until the total size is
+        within the limit."""
+
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if name.endswith(suffix):
+                path = os.path.join(self.directory, name)
+                try:
+                    status = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((status.st_mtime, status.st_size, path))
+                total += status.st_size
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.limit:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def report(self):
+        return "compile cache: {0} hits, {1} misses".format(
+            self.hits, self.misses)
+
+
+#The compile cache is shared between all programs compiled in the process.
+compile_cache = CompileCache()
+
+
+def optimise_tree(unit, inliner=None, loop_optimiser=None, simplifier=None):
+
+    """
+
+    Run the inliner, loop optimiser and simplifier over *unit*, the parse
+    tree of one translation unit, and return it. A pass that is not given is
+    created for this translation unit alone, so that its counts describe
+    this program only.
+
+    """
+
+    if inliner is None:
+        inliner = inline.Inliner()
+    if loop_optimiser is None:
+        loop_optimiser = loops.LoopOptimiser()
+    if simplifier is None:
+        simplifier = simplify.Simplifier()
+    inliner.inline(unit)
+    loop_optimiser.optimise(unit)
+    simplifier.simplify(unit)
+    return unit
+
+
+def compile_source(source, filename=None, cache=compile_cache):
+
+    """
+
+    Compile and assemble *source*, a string or a file, returning the
+    instruction list. The passes over the tree and the instructions are
+    created afresh for each compilation. *cache* is the CompileCache to use,
+    or None to always compile.
+
+    """
+
+    if filename is None:
+        filename = getattr(source, "name", None)
+    if cache is not None:
+        key = cache.key(source, filename)
+        instructions = cache.get(key)
+        if instructions is not None:
+            return instructions
+
+    theparser = parser.Parser()
+    unit = optimise_tree(theparser.parse(source, filename))
+    instructions = unit.generate_code()
+    instructions = optimizer.optimize(instructions)
+    instructions = assembler.assemble(instructions)
+
+    if cache is not None:
+        dependencies = [
+            (header.path, header.mtime, header.size, header.digest)
+            for header in theparser.preprocessor.headers
+        ]
+        cache.put(key, instructions, dependencies)
+    return instructions
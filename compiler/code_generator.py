@@ -2,16 +2,34 @@
 Stack and Register Usage
 ========================
 
-A stack is implemented in memory. The start, and end of the current stack frame
-are held in general purpose registers reserved for this purpose. Local
+A stack is implemented in memory. The start, and end of the current stack
+frame are held in general purpose registers reserved for this purpose. Local
 variables are stored at the beginning of the stack frame, at a known offset
-from the start of the frame. The absolute address of a variable is calculated
-by adding the known stack offset, to the value of the start register. It is
-neccassary to calculate the address at run time, because the start of the frame
-in any particular function invokation is not know at compile time. During
-function execution, the stack is expanded to calculate intermediate values when
-evaluating expressions. After an expression is evaluated, the value of the
-expression is held at the top of the stack, pointed to by the end register.
+from the start of the frame. The slots of all the arguments and variables of
+a function are reserved when it is entered. The absolute address of a
+variable is calculated by adding the known stack offset, to the value of the
+start register. It is neccassary to calculate the address at run time,
+because the start of the frame in any particular function invokation is not
+know at compile time. During function execution, the stack is expanded to
+calculate intermediate values when evaluating expressions. After an
+expression is evaluated, the value of the expression is held at the top of
+the stack, pointed to by the end register.
+
+Local variables are kept in general purpose registers where possible, the
+registers are allocated to each function by the allocator module. Each
+variable still has a slot reserved in the stack frame, used when it has to be
+spilled, or when its address is taken. The registers below those allocated to
+variables are used to hold intermediate values.
+
+Functions of int and pointer values, without goto, switch or variables whose
+address is taken, are generated from their SSA form by the ssa module
+instead. Their values are all kept in registers, and their frames hold only
+arguments passed on the stack and the return address.
+
+Global variables and string literals are kept in a data segment, laid out by
+the assembler from address 0 and loaded into memory before the program
+starts. They are referred to by their absolute address, given by a label.
+The stack starts at the end of the data segment.
 
 Calling Conventions
 ===================
@@ -19,25 +37,55 @@ Calling Conventions
 Functions are called using the "jump and link" instruction. The jump and link
 instruction saves the return address in a general purpose register, by
 convention, the return_address register is always used. A function returns
-using the "goto register" instruction. It is the reponsibility of the function
-caller to save the return_address and start registers using the stack. The
-caller uses the new register to mark the start of the new frame. Arguments are
-then evaluated, allowing variables addresses to be calculated using the
-unmodified start value. Once arguments have been place on the stack, the start
-register is then set to point to the start of the new frame. Execution then
-passes to the callee function. The callee function can access the arguments by
-calculating their offset from the start of the frame in the same way as local
-variables.  The callee can return a value using the return_value register. When
-execution of the callee function completes, control then returns to the caller
-function. The caller then removes all items from the stack by setting the end
-register to the value of the start register. The start and return_address are
-then popped from the stack, therby resoring the state prior to the function
-call. The return_value register is then be placed on top of the stack.
+using the "goto register" instruction. A function that calls other functions
+saves the return_address register in the slot after its variables when it is
+entered, and reloads it before it returns. A leaf function, one that calls
+nothing, leaves the return_address register alone.
+
+It is the reponsibility of the function caller to save the start register
+using the stack. Arguments are then evaluated, allowing variables addresses
+to be calculated using the unmodified start value. How the arguments are
+passed depends on the convention of the callee, chosen for each function.
+
+With the stack convention, the arguments are placed on the stack, and the
+start register is then set to point to the start of the new frame, the
+first argument. The new frame is found from the end register, so that calls
+made while evaluating the arguments do not disturb it. The callee function
+can access the arguments by calculating their offset from the start of the
+frame in the same way as local variables.
+
+With the register convention, used by functions with no more than
+argument_registers arguments, the arguments are passed in registers 0, 1, 2
+and so on, and the new frame starts at the end register. The callee moves
+each argument into the register allocated to it, or stores it in its slot
+in the frame.
+
+Execution then passes to the callee function. The callee returns a value in
+the return_value register. When execution of the callee function completes,
+control then returns to the caller function. The caller then removes all
+items from the stack by setting the end register to the value of the start
+register. The start register is then popped from the stack, therby resoring
+the state prior to the function call. The return_value register is then be
+placed on top of the stack. Registers holding variables of the caller that
+are needed after the call are pushed before the start register, and popped
+after it.
+
+A call whose value is returned straight away is a tail call. Nothing of the
+caller is needed after it, so the arguments are moved down to the start of
+the caller's frame, and the callee is entered with a goto, leaving the start
+register as it is, and the return_address register as it was on entry. The
+callee then returns directly to the caller's caller. A function that takes the
+address of one of its variables does not make tail calls, as its frame must
+outlive the call.
 
 """
 
 from exceptions import CConstantError, CTypeError, CSyntaxError
 from common import c_style_division, c_style_modulo, value, constant_fold
+from allocator import allocate, register_needs
+from emitter import Emitter
+import tree
+import ssa
 
 # registers 0-23 are general purpose
 maxgpr = 23
@@ -103,198 +151,424 @@ binary_operations = {
             ">" : "gt",
     },
 }
+#the branch taken when a comparison is true, and when it is false
+branch_if_true = {
+    "==" : "beq",
+    "!=" : "bne",
+    "<" : "blt",
+    ">" : "bgt",
+    "<=" : "ble",
+    ">=" : "bge",
+}
+branch_if_false = {
+    "==" : "bne",
+    "!=" : "beq",
+    "<" : "bge",
+    ">" : "ble",
+    "<=" : "bgt",
+    ">=" : "blt",
+}
+
 unary_operations = {
     "!" : "not", 
     "~" : "invert", 
     "-" : "negate"}
 
+#the change made by each increment and decrement, by the name of its node
+increments = {
+    "PostIncrement" : 1,
+    "PreIncrement" : 1,
+    "PostDecrement" : -1,
+    "PreDecrement" : -1,
+}
+
 
 class CodeGenerator:
 
+    def __init__(self, emitter=None):
+        if emitter is None:
+            emitter = Emitter()
+        self.emitter = emitter
+        self.emit = emitter.emit
+        self.gpr = 0 #the next free register for temporaries
+        self.maxgpr = maxgpr #the last register available for temporaries
+        self.registers = {} #the register of each local variable kept in one
+        self.saved = {} #the registers saved around each function call
+        self.escapes = False #the frame of the function must outlive calls
+        self.link = None #the frame slot of the return address, if it is saved
+        self.allocations = [] #the Allocation of each function
+        self.needs = {} #the registers needed to evaluate each expression
+        self.targets = {} #the (continue, break) labels of each statement
+        self.strings = {} #the label of each string in the data segment
+
+    def fits(self, expression):
+
+        """Return True if expression can be evaluated in the free registers."""
+
+        needed = self.needs.get(expression)
+        return needed is not None and needed <= self.maxgpr + 1 - self.gpr
+
+    def report(self):
+        return "\n".join(
+            allocation.report() for allocation in self.allocations)
+
     def generate_code(self, leaf):
-        global gpr
-        stored_gpr = gpr
-        #attempt to generate code in registers
-        if hasattr(leaf, "generate_code_reg"):
-            try:
-                #generate in registers
-                instructions = leaf.generate_code_reg(self)
-                decrement_gpr()
-                #then move to the stack
-                instructions.append(("store", 0, end, gpr))
-                instructions.append(("addl", end, end, 1))
-                return instructions
-            except GPRException:
-                gpr = stored_gpr
-        #if this fails for some reason use the stack
-        return leaf.generate_code(self)
+        if self.fits(leaf):
+            #generate in registers
+            leaf.generate_code_reg(self)
+            self.gpr -= 1
+            #then move to the stack
+            self.emit("store", 0, end, self.gpr)
+            self.emit("addl", end, end, 1)
+        else:
+            #otherwise use the stack
+            leaf.generate_code(self)
 
     def generate_code_reg(self, leaf):
-        if hasattr(leaf, "generate_code_reg"):
-            return leaf.generate_code_reg(self)
+        leaf.generate_code_reg(self)
+
+    def branch(self, condition, label, when=False):
+
+        """
+
+        Jump to label when condition is true, or false if when is False,
+        leaving nothing on the stack.
+
+        A comparison of integers or pointers is lowered to a single compare
+        and branch of its operands. Return False if it cannot be, when
+        branching on a true condition, so that the caller can jump around it
+        instead.
+
+        """
+
+        branches = branch_if_true if when else branch_if_false
+        if (condition.__class__ is tree.Binary and
+            condition.function in branches and
+            condition.left._type() != "float" and
+            condition.right._type() != "float"):
+            operation = branches[condition.function]
+            if self.fits(condition):
+                if self.needs[condition.right] > self.needs[condition.left]:
+                    self.generate_code_reg(condition.right)
+                    self.generate_code_reg(condition.left)
+                    self.gpr -= 2
+                    self.emit(operation, self.gpr+1, self.gpr, label)
+                else:
+                    self.generate_code_reg(condition.left)
+                    self.generate_code_reg(condition.right)
+                    self.gpr -= 2
+                    self.emit(operation, self.gpr, self.gpr+1, label)
+            else:
+                self.generate_code(condition.left)
+                self.generate_code(condition.right)
+                self.pop(temp)
+                self.pop(temp1)
+                self.emit(operation, temp1, temp, label)
+            return True
+
+        if when:
+            return False
+        if self.fits(condition):
+            self.generate_code_reg(condition)
+            self.gpr -= 1
+            self.emit("jump if false", 0, self.gpr, label)
         else:
-            raise GPRException
+            self.generate_code(condition)
+            self.pop(temp)
+            self.emit("jump if false", 0, temp, label)
+        return True
+
+    def pop(self, register):
+        self.emit("addl", end, end, -1)
+        self.emit("load", register, end, 0)
+
+    def push(self, register):
+        self.emit("store", 0, end, register)
+        self.emit("addl", end, end, 1)
 
     def compilation_unit_generate_code(self, leaf):
-        instructions = [
-            ("literal", end, 0, leaf.start_address),
-            ("literal", start, 0, leaf.start_address),
-            ("jump and link", return_address, 0, leaf.main),
-            ("label", "end", 0, 0),
-            ("goto", 0, 0, "end"),
-        ]
+        self.needs = register_needs(leaf)
+        emit = self.emit
+        #the stack starts after the data segment
+        stack = self.emitter.new_label()
+        emit("label address", end, 0, stack)
+        emit("label address", start, 0, stack)
+        emit("jump and link", return_address, 0,
+            self.emitter.label_of(leaf.main))
+        halt = self.emitter.new_label()
+        self.emitter.place(halt)
+        emit("goto", 0, 0, halt)
         for declaration in leaf.declarations:
-            instructions.extend(declaration.generate_code(self))
+            if declaration.__class__ is tree.DeclareFunction:
+                declaration.generate_code(self)
 
-        return instructions
+        #the data segment holds the global variables, then the strings
+        for declaration in leaf.declarations:
+            if declaration.__class__ is tree.Declare:
+                declaration.generate_code(self)
+        for label, constant in sorted(
+                (label, constant) for constant, label in self.strings.items()):
+            for index, char in enumerate(constant):
+                emit("word", 0 if index else label, 0, ord(char))
+        emit("zero", stack, 0, 0)
 
-    def string_generate_code(self, leaf):
-	instructions = [
-	    ("literal", offset, 0, leaf.reserved),
-            ("store", 0, end, offset),
-            ("addl", end, end, 1),
-	]
+        return self.emitter.sink
+
+    def string_label(self, leaf):
 
-	for char in leaf.constant:
-            instructions.extend([
-                ("literal", temp, 0, ord(char)),
-                ("store", 0, offset, temp),
-	        ("addl", offset, offset, 1),
-            ])
+        """Return the label of a string in the data segment, the same for
+        every string with the same characters."""
 
-        return instructions
+        label = self.strings.get(leaf.constant)
+        if label is None:
+            label = self.strings[leaf.constant] = self.emitter.new_label()
+        return label
+
+    def string_generate_code(self, leaf):
+        self.emit("label address", temp, 0, self.string_label(leaf))
+        self.push(temp)
+
+    def string_generate_code_reg(self, leaf):
+        self.emit("label address", self.gpr, 0, self.string_label(leaf))
+        self.gpr += 1
 
     def constant_generate_code(self, leaf):
-        return [
-            ("literal", temp, 0, leaf.constant),
-            ("store", 0, end, temp),
-            ("addl", end, end, 1),
-        ]
+        self.emit("literal", temp, 0, leaf.constant)
+        self.push(temp)
 
     def constant_generate_code_reg(self, leaf):
-        instructions = [("literal", get_gpr(), 0, leaf.constant)]
-        increment_gpr()
-        return instructions
+        self.emit("literal", self.gpr, 0, leaf.constant)
+        self.gpr += 1
 
     def variable_generate_code(self, leaf):
-        return [
+        register = self.registers.get(leaf.declarator)
+        if register is None:
             #load
-            ("addl", offset, start, leaf.declarator.offset),
-            ("load", temp, offset, 0),
-            #push
-            ("store", 0, end, temp),
-            ("addl", end, end, 1),
-        ]
+            self.address(leaf.declarator, offset)
+            self.emit("load", temp, offset, 0)
+            register = temp
+        self.push(register)
 
     def variable_generate_code_reg(self, leaf):
-        instructions = [
-            ("addl", offset, start, leaf.declarator.offset),
-            ("load", get_gpr(), offset, 0),
-        ]
-        increment_gpr()
-        return instructions
+        register = self.registers.get(leaf.declarator)
+        if register is not None:
+            self.emit("addl", self.gpr, register, 0)
+        else:
+            self.address(leaf.declarator, offset)
+            self.emit("load", self.gpr, offset, 0)
+        self.gpr += 1
 
     def variable_generate_code_write(self, leaf):
-        return [
-            #pop
-            ("addl", end, end, -1),
-            ("load", temp, end, 0),
-            #push
-            ("addl", end, end, 1),
+        register = self.registers.get(leaf.declarator)
+        if register is not None:
+            #peek
+            self.pop(register)
+            self.emit("addl", end, end, 1)
+        else:
+            #peek
+            self.pop(temp)
+            self.emit("addl", end, end, 1)
             #store
-            ("addl", offset, start, leaf.declarator.offset),
-            ("store", 0, offset, temp)
-        ]
+            self.address(leaf.declarator, offset)
+            self.emit("store", 0, offset, temp)
 
     def variable_generate_code_address(self, leaf):
-        return [
-            ("addl", temp, start, leaf.declarator.offset),
-            ("store", 0, end, temp),
-            ("addl", end, end, 1),
-        ]
+        self.address(leaf.declarator, temp)
+        self.push(temp)
+
+    def address(self, declarator, register):
+
+        """Load the address of a variable into register, a global variable
+        is at a fixed address in the data segment."""
+
+        if declarator.offset is None:
+            self.emit("label address", register, 0,
+                self.emitter.label_of(declarator))
+        else:
+            self.emit("addl", register, start, declarator.offset)
 
     def declare_generate_code(self, leaf):
-        instructions = []
         for declarator in leaf.declarators:
-            instructions.extend(declarator.generate_code(self))
-        return instructions
+            declarator.generate_code(self)
 
     def declarator_generate_code(self, leaf):
-        global gpr
-        instructions = [("addl", end, end, sizes[leaf._type]//4)]
-        if leaf.expression:
-            stored_gpr = gpr
-            try:
-                instructions.extend(self.generate_code_reg(leaf.expression))
-                decrement_gpr()
-                instructions.append(("addl", offset, start, leaf.offset))
-                instructions.append(("store", 0, offset, gpr))
-            except GPRException:
-                gpr = stored_gpr
-                instructions.extend(self.generate_code(leaf.expression))
-                instructions.append(("addl", end, end, -1))
-                instructions.append(("load", temp, end, 0))
-                instructions.append(("addl", offset, start, leaf.offset))
-                instructions.append(("store", 0, offset, temp))
-        return instructions
+        emit = self.emit
+        if leaf.offset is None:
+            #a global variable is laid out in the data segment
+            label = self.emitter.label_of(leaf)
+            if leaf.expression is None:
+                emit("zero", label, 0, 1)
+            elif leaf._type == "float":
+                emit("word", label, 0, float(value(leaf.expression)))
+            else:
+                emit("word", label, 0, int(value(leaf.expression)))
+            return
+        register = self.registers.get(leaf)
+        if leaf.expression and self.fits(leaf.expression):
+            self.generate_code_reg(leaf.expression)
+            self.gpr -= 1
+            if register is not None:
+                emit("addl", register, self.gpr, 0)
+            else:
+                emit("addl", offset, start, leaf.offset)
+                emit("store", 0, offset, self.gpr)
+        elif leaf.expression:
+            self.generate_code(leaf.expression)
+            if register is not None:
+                self.pop(register)
+            else:
+                self.pop(temp)
+                emit("addl", offset, start, leaf.offset)
+                emit("store", 0, offset, temp)
 
     def declare_function_generate_code(self, leaf):
-        instructions = [("label", str(id(leaf)), 0, 0)] 
-        instructions.extend(leaf.statement.generate_code(self))
-        instructions.append(("goto register", 0, return_address, 0))
-        return instructions
+        if ssa_functions and ssa.translator.translate(leaf, self):
+            return
+        allocation = allocate(leaf)
+        self.allocations.append(allocation)
+        self.registers = allocation.registers
+        self.saved = allocation.saved
+        self.escapes = allocation.escapes
+        self.maxgpr = allocation.maxgpr
+        self.gpr = 0
+
+        #only a function making calls, other than tail calls, needs to save
+        #the return address
+        returned = set()
+        if tail_calls and not self.escapes:
+            returned = set(node.expression for node in tree.walk(leaf)
+                if node.__class__ is tree.Return)
+        self.link = None
+        frame = allocation.frame
+        if any(call not in returned for call in self.saved):
+            self.link = frame
+            frame += 1
+
+        self.emitter.place(self.emitter.label_of(leaf))
+        #the frame is reserved on entry, a slot for every argument and
+        #variable, the caller has already pushed any arguments on the stack
+        registers = convention(leaf) == "registers"
+        if frame > (0 if registers else len(leaf.args)):
+            self.emit("addl", end, start, frame)
+        if self.link is not None:
+            self.emit("addl", offset, start, self.link)
+            self.emit("store", 0, offset, return_address)
+        #registers saved at a call before their variable is set are cleared
+        for register in allocation.cleared:
+            self.emit("literal", register, 0, 0)
+        for index, argument in enumerate(leaf.args):
+            register = self.registers.get(argument)
+            if registers and register is not None:
+                #arguments passed in registers are moved to their own
+                self.emit("addl", register, index, 0)
+            elif registers:
+                #or stored in their slots
+                self.emit("addl", offset, start, argument.offset)
+                self.emit("store", 0, offset, index)
+            elif register is not None:
+                #arguments kept in registers are loaded from the stack
+                self.emit("addl", offset, start, argument.offset)
+                self.emit("load", register, offset, 0)
+        leaf.statement.generate_code(self)
+        self.restore_link()
+        self.emit("goto register", 0, return_address, 0)
+
+    def restore_link(self):
+
+        """Reload the return address, if the function saved it on entry."""
+
+        if self.link is not None:
+            self.emit("addl", offset, start, self.link)
+            self.emit("load", return_address, offset, 0)
 
     def if_generate_code(self, leaf):
         try:
             if value(leaf.expression == 0):
                 if leaf.false:
-                    return self.generate_code(leaf.false)
-                else:
-                    return []
+                    self.generate_code(leaf.false)
             else:
-                return self.generate_code(leaf.true)
+                self.generate_code(leaf.true)
         except CConstantError:
-            instructions = self.generate_code(leaf.expression)
-            instructions.extend([
-                ("addl", end, end, -1),
-                ("load", temp, end, 0),
-                ("jump if false", 0, temp, str(id(leaf)))
-            ])
-            instructions.extend(leaf.true.generate_code(self))
-            instructions.append(("goto", 0, 0, str(id(leaf))+"end"))
-            instructions.append(("label", str(id(leaf)), 0, 0))
+            false = self.emitter.new_label()
+            done = self.emitter.new_label()
+            self.branch(leaf.expression, false)
+            leaf.true.generate_code(self)
+            self.emit("goto", 0, 0, done)
+            self.emitter.place(false)
             if leaf.false:
-                instructions.extend(leaf.false.generate_code(self))
-            instructions.append(("label", str(id(leaf))+"end", 0, 0))
-            return instructions
+                leaf.false.generate_code(self)
+            self.emitter.place(done)
 
     def switch_generate_code(self, leaf):
-        instructions = self.generate_code(leaf.expression)
-        instructions.extend([
-            ("addl", end, end, -1),
-            ("load", temp, end, 0),
-        ])
-        for case_value, case in leaf.cases.iteritems():
-            instructions.extend([
-                ("literal", temp1, 0, case_value),
-                ("ne", temp1, temp, temp1),
-                ("jump if false", 0, temp1, str(id(case)))
-            ])
+        done = self.emitter.new_label()
+        self.targets[leaf] = (None, done)
         if hasattr(leaf, "default"):
-            instructions.extend([("goto", 0, 0, str(id(leaf.default)))])
-        instructions.extend([("goto", 0, 0, str(id(leaf))+"end")])
-        instructions.extend(leaf.statement.generate_code(self))
-        instructions.extend([("label", str(id(leaf)) + "end", 0, 0)])
-        return instructions
+            default = self.emitter.label_of(leaf.default)
+        else:
+            default = done
+        values = sorted(leaf.cases)
+        self.generate_code(leaf.expression)
+        self.pop(temp)
+        if values and dense(values):
+            self.jump_table(leaf, values, default)
+        else:
+            self.binary_search(leaf, values, default)
+        leaf.statement.generate_code(self)
+        self.emitter.place(done)
+
+    def jump_table(self, leaf, values, default):
+
+        """Jump to the case matching temp, through a table of gotos indexed
+        by the value less the lowest case."""
+
+        emit = self.emit
+        low, high = values[0], values[-1]
+        table = self.emitter.new_label()
+        emit("literal", temp1, 0, low)
+        emit("blt", temp, temp1, default)
+        emit("literal", temp1, 0, high)
+        emit("bgt", temp, temp1, default)
+        emit("addl", temp, temp, -low)
+        emit("label address", temp1, 0, table)
+        emit("add", temp, temp, temp1)
+        emit("goto register", 0, temp, 0)
+        self.emitter.place(table)
+        for case_value in range(low, high + 1):
+            case = leaf.cases.get(case_value)
+            if case is None:
+                emit("goto", 0, 0, default)
+            else:
+                emit("goto", 0, 0, self.emitter.label_of(case))
+
+    def binary_search(self, leaf, values, default):
+
+        """Jump to the case matching temp, halving the sorted case values
+        with each comparison, and comparing the last few in turn."""
+
+        emit = self.emit
+        if len(values) <= linear_cases:
+            for case_value in values:
+                emit("literal", temp1, 0, case_value)
+                emit("beq", temp, temp1,
+                    self.emitter.label_of(leaf.cases[case_value]))
+            emit("goto", 0, 0, default)
+        else:
+            middle = len(values) // 2
+            lower = self.emitter.new_label()
+            emit("literal", temp1, 0, values[middle])
+            emit("blt", temp, temp1, lower)
+            self.binary_search(leaf, values[middle:], default)
+            self.emitter.place(lower)
+            self.binary_search(leaf, values[:middle], default)
 
     def case_generate_code(self, leaf):
-        return [("label", str(id(leaf)), 0, 0)]
+        self.emitter.place(self.emitter.label_of(leaf))
 
     def default_generate_code(self, leaf):
-        return [("label", str(id(leaf)), 0, 0)]
+        self.emitter.place(self.emitter.label_of(leaf))
 
     def label_generate_code(self, leaf):
-        return [("label", str(id(leaf)), 0, 0)]
+        self.emitter.place(self.emitter.label_of(leaf))
 
     def goto_generate_code(self, leaf):
         try:
@@ -302,305 +576,342 @@ class CodeGenerator:
         except KeyError:
             raise CSyntaxError("Unknown Label")
             
-        return [("goto", 0, 0, label)]
+        self.emit("goto", 0, 0, self.emitter.label_of(label))
 
     def while_generate_code(self, leaf):
+        begin = self.emitter.new_label()
+        done = self.emitter.new_label()
+        self.targets[leaf] = (begin, done)
         try:
             if value(leaf.expression):
-                instructions = [("label", str(id(leaf))+"start", 0, 0)]
-                instructions.extend(leaf.statement.generate_code(self))
-                instructions.append(("goto", 0, 0, str(id(leaf)) + "start"))
-                instructions.append(("label", str(id(leaf))+"end", 0, 0))
+                self.emitter.place(begin)
+                leaf.statement.generate_code(self)
+                self.emit("goto", 0, 0, begin)
+                self.emitter.place(done)
             else:
-                instructions = [("label", str(id(leaf))+"start", 0, 0)]
-                instructions.append(("label", str(id(leaf))+"end", 0, 0))
+                self.emitter.place(begin)
+                self.emitter.place(done)
         except CConstantError:
-            instructions = [("label", str(id(leaf))+"start", 0, 0)]
-            instructions.extend(self.generate_code(leaf.expression))
-            instructions.extend([
-                ("addl", end, end, -1),
-                ("load", temp, end, 0),
-                ("jump if false", 0, temp, str(id(leaf)) + "end")
-            ])
-            instructions.extend(leaf.statement.generate_code(self))
-            instructions.extend([
-                ("goto", 0, 0, str(id(leaf)) + "start"),
-                ("label", str(id(leaf)) + "end", 0, 0)
-            ])
-        return instructions
+            self.emitter.place(begin)
+            self.branch(leaf.expression, done)
+            leaf.statement.generate_code(self)
+            self.emit("goto", 0, 0, begin)
+            self.emitter.place(done)
 
     def do_while_generate_code(self, leaf):
+        begin = self.emitter.new_label()
+        test = self.emitter.new_label()
+        done = self.emitter.new_label()
+        self.targets[leaf] = (test, done)
+        self.emitter.place(begin)
+        leaf.statement.generate_code(self)
+        self.emitter.place(test)
         try:
-            if value(expression.generate_code(self)):
-                instructions = [("label", str(id(leaf))+"start", 0, 0)]
-                instructions.extend(leaf.statement.generate_code(self))
-                instructions.append(("goto", 0, 0, str(id(leaf)) + "start"))
-                instructions.append(("label", str(id(leaf))+"end", 0, 0))
-            else:
-                instructions = [("label", str(id(leaf))+"start", 0, 0)]
-                instructions.extend(leaf.statement.generate_code(self))
-                instructions.append(("label", str(id(leaf))+"end", 0, 0))
+            if value(leaf.expression):
+                self.emit("goto", 0, 0, begin)
         except CConstantError:
-            instructions = [("label", str(id(leaf))+"start", 0, 0)]
-            instructions.extend(leaf.statement.generate_code(self))
-            instructions.extend(self.generate_code(leaf.expression))
-            instructions.extend([
-                ("addl", end, end, -1),
-                ("load", temp, end, 0),
-                ("jump if false", 0, temp, str(id(leaf)) + "end")
-                ("goto", 0, 0, str(id(leaf)) + "start"),
-                ("label", str(id(leaf))+"end", 0, 0)
-            ])
+            if not self.branch(leaf.expression, begin, True):
+                self.branch(leaf.expression, done)
+                self.emit("goto", 0, 0, begin)
+        self.emitter.place(done)
 
     def return_generate_code(self, leaf):
-        instructions = self.generate_code(leaf.expression)
-        instructions.append(("addl", end, end, -1))
-        instructions.append(("load", return_value, end, 0))
-        instructions.append(("goto register", 0, return_address, 0))
-        return instructions
+        if (tail_calls and leaf.expression.__class__ is tree.FunctionCall and
+            not self.escapes):
+            self.tail_call(leaf.expression)
+            return
+        if self.fits(leaf.expression):
+            #the value is returned in a register
+            self.generate_code_reg(leaf.expression)
+            self.gpr -= 1
+            self.emit("addl", return_value, self.gpr, 0)
+        else:
+            self.generate_code(leaf.expression)
+            self.pop(return_value)
+        self.restore_link()
+        self.emit("goto register", 0, return_address, 0)
 
     def function_call_generate_code(self, leaf):
-        instructions = [
-          ("store", 0, end, start),
-          ("addl", end, end, 1),
-          ("store", 0, end, return_address),
-          ("addl", end, end, 1),
-          ("addl", new, end, 0),
-        ]
+        emit = self.emit
+        #registers holding variables live after the call are saved first
+        saved = self.saved.get(leaf, [])
+        for register in saved:
+            self.push(register)
+        self.push(start)
+        if convention(leaf.declaration) == "registers":
+            self.arguments(leaf)
+            #the new frame starts at the end of the stack
+            emit("addl", start, end, 0)
+        else:
+            for arg in leaf.args:
+                self.generate_code(arg)
+            #the new frame starts with the arguments
+            emit("addl", start, end, -len(leaf.args))
+        emit("jump and link", return_address, 0,
+            self.emitter.label_of(leaf.declaration))
+        emit("addl", end, start, 0)
+        self.pop(start)
+        for register in reversed(saved):
+            self.pop(register)
+        self.push(return_value)
+
+    def tail_call(self, leaf):
+
+        """
+
+        Call a function whose value is returned by the caller, in the frame of
+        the caller.
+
+        The arguments are evaluated above the frame, then moved down to its
+        start, or into the argument registers, and the callee is entered with
+        a goto. The start register is left unchanged, and the return_address
+        register is restored, so the callee returns directly to the caller of
+        the caller, and the stack does not grow however deep the calls go.
+
+        """
+
+        emit = self.emit
+        if convention(leaf.declaration) == "registers":
+            self.arguments(leaf)
+            self.restore_link()
+            emit("addl", end, start, 0)
+        else:
+            for arg in leaf.args:
+                self.generate_code(arg)
+            self.restore_link()
+            for argument in reversed(range(len(leaf.args))):
+                self.pop(temp)
+                emit("addl", offset, start, argument)
+                emit("store", 0, offset, temp)
+            emit("addl", end, start, len(leaf.args))
+        emit("goto", 0, 0, self.emitter.label_of(leaf.declaration))
+
+    def arguments(self, leaf):
+
+        """Evaluate the arguments of a call into registers 0, 1, 2..."""
+
+        #argument i is evaluated with i registers in use, if every argument
+        #fits then each is left in its own register
+        if self.gpr == 0 and all(
+                self.needs.get(arg) is not None and
+                self.needs[arg] <= self.maxgpr + 1 - register
+                for register, arg in enumerate(leaf.args)):
+            for arg in leaf.args:
+                self.generate_code_reg(arg)
+            self.gpr = 0
+            return
+        #otherwise they are evaluated on the stack, then popped
         for arg in leaf.args:
-            instructions.extend(self.generate_code(arg))
-        instructions.extend([
-          ("addl", start, new, 0),
-          ("jump and link", return_address, 0, str(id(leaf.declaration))),
-          ("addl", end, start, 0),
-          ("addl", end, end, -1),
-          ("load", return_address, end, 0),
-          ("addl", end, end, -1),
-          ("load", start, end, 0),
-          ("store", 0, end, return_value),
-          ("addl", end, end, 1),
-        ])
-        return instructions
+            self.generate_code(arg)
+        for register in reversed(range(len(leaf.args))):
+            self.pop(register)
 
     def convert_generate_code(self, leaf):
-        instructions = self.generate_code(leaf.expression)
+        self.generate_code(leaf.expression)
         if leaf._type_ != leaf.expression._type():
-            instructions.append(("addl", end, end, -1))
-            instructions.append(("load", temp, end, 0))
-            instructions.append(("to_"+leaf._type_, 0, end, temp))
-            instructions.append(("store", 0, end, temp))
-            instructions.append(("addl", end, end, 1))
-        return instructions
+            self.pop(temp)
+            self.emit("to_"+leaf._type_, 0, end, temp)
+            self.push(temp)
 
     def convert_generate_code_reg(self, leaf):
-        instructions = self.generate_code_reg(leaf.expression)
+        self.generate_code_reg(leaf.expression)
         if leaf._type_ != leaf.expression._type():
-            instructions.append(("to_"+leaf._type_, 0, gpr, gpr))
-        return instructions
+            self.emit("to_"+leaf._type_, 0, self.gpr-1, self.gpr-1)
 
     def ternary_generate_code(self, leaf):
         try:
             if value(leaf.expression):
-                return self.generate_code(leaf.true_expression)
+                self.generate_code(leaf.true_expression)
             else:
-                return self.generate_code(leaf.false_expression)
+                self.generate_code(leaf.false_expression)
         except CConstantError:
-            instructions = self.generate_code(leaf.expression)
-            instructions.append(("addl", end, end, -1))
-            instructions.append(("load", temp, end, 0))
-            instructions.append(("jump if false", 0, temp, str(id(leaf))+"false"))
-            instructions.extend(leaf.true_expression.generate_code(self))
-            instructions.append(("goto", 0, 0, str(id(leaf))+"end"))
-            instructions.append(("label", str(id(leaf))+"false", 0, 0))
-            instructions.extend(leaf.false_expression.generate_code(self))
-            instructions.append(("label", str(id(leaf))+"end", 0, 0))
-            return instructions
+            false = self.emitter.new_label()
+            done = self.emitter.new_label()
+            self.branch(leaf.expression, false)
+            self.generate_code(leaf.true_expression)
+            self.emit("goto", 0, 0, done)
+            self.emitter.place(false)
+            self.generate_code(leaf.false_expression)
+            self.emitter.place(done)
 
     def binary_generate_code_reg(self, leaf):
         operation = binary_operations[leaf._type()][leaf.function]
-        instructions = self.generate_code_reg(leaf.left)
-        instructions.extend(self.generate_code_reg(leaf.right))
-        decrement_gpr()
-        instructions.append((operation, gpr-1, gpr-1, gpr))
-        return instructions
+        if self.needs[leaf.right] > self.needs[leaf.left]:
+            #the operand needing more registers is evaluated first
+            self.generate_code_reg(leaf.right)
+            self.generate_code_reg(leaf.left)
+            self.gpr -= 1
+            self.emit(operation, self.gpr-1, self.gpr, self.gpr-1)
+        else:
+            self.generate_code_reg(leaf.left)
+            self.generate_code_reg(leaf.right)
+            self.gpr -= 1
+            self.emit(operation, self.gpr-1, self.gpr-1, self.gpr)
 
     def binary_generate_code(self, leaf):
         operation = binary_operations[leaf._type()][leaf.function]
-        instructions = leaf.left.generate_code(self)
-        instructions.extend(leaf.right.generate_code(self))
-        instructions.append(("addl", end, end, -1))
-        instructions.append(("load", temp, end, 0))
-        instructions.append(("addl", end, end, -1))
-        instructions.append(("load", temp1, end, 0))
-        instructions.append((operation, temp, temp1, temp))
-        instructions.append(("store", 0, end, temp))
-        instructions.append(("addl", end, end, 1))
-        return instructions
+        self.generate_code(leaf.left)
+        self.generate_code(leaf.right)
+        self.pop(temp)
+        self.pop(temp1)
+        self.emit(operation, temp, temp1, temp)
+        self.push(temp)
 
     def unary_generate_code(self, leaf):
-        instructions = self.generate_code(leaf.expression)
+        self.generate_code(leaf.expression)
         if leaf.function != "+":
-            instructions.extend([
-                ("addl", end, end, -1),
-                ("load", temp, end, 0),
-                (unary_operations[leaf.function], temp, end, 0),
-                ("store", end, temp, 0),
-                ("addl", end, end, 1),
-            ])
-        return instructions
+            self.pop(temp)
+            self.emit(unary_operations[leaf.function], temp, temp, 0)
+            self.push(temp)
 
     def post_increment_generate_code(self, leaf):
-        instructions = self.generate_code(leaf.expression)
-        instructions.extend([
-            ("addl", end, end, -1),
-            ("load", temp, end, 0),
-            ("store", 0, end, temp),
-            ("addl", end, end, 1),
-            ("addl", temp, temp, 1),
-            ("store", 0, end, temp),
-            ("addl", end, end, 1),
-        ])
-        instructions.extend(leaf.expression.generate_code_write(self))
-        instructions.append(("addl", end, end, -1))
-        return instructions
+        self.generate_code(leaf.expression)
+        self.pop(temp)
+        self.push(temp)
+        self.emit("addl", temp, temp, 1)
+        self.push(temp)
+        leaf.expression.generate_code_write(self)
+        self.emit("addl", end, end, -1)
 
     def post_decrement_generate_code(self, leaf):
-        instructions = self.generate_code(leaf.expression)
-        instructions.extend([
-            ("addl", end, end, -1),
-            ("load", temp, end, 0),
-            ("store", 0, end, temp),
-            ("addl", end, end, 1),
-            ("addl", temp, temp, -1),
-            ("store", 0, end, temp),
-            ("addl", end, end, 1),
-        ])
-        instructions.extend(leaf.expression.generate_code_write(self))
-        instructions.append(("addl", end, end, -1))
-        return instructions
+        self.generate_code(leaf.expression)
+        self.pop(temp)
+        self.push(temp)
+        self.emit("addl", temp, temp, -1)
+        self.push(temp)
+        leaf.expression.generate_code_write(self)
+        self.emit("addl", end, end, -1)
 
     def pre_increment_generate_code(self, leaf):
-        instructions = leaf.expression.generate_code(self)
-        instructions.extend([
-            ("addl", end, end, -1),
-            ("load", temp, end, 0),
-            ("addl", temp, temp, 1),
-            ("store", 0, end, temp),
-            ("addl", end, end, 1),
-        ])
-        instructions.extend(leaf.expression.generate_code_write(self))
-        return instructions
+        leaf.expression.generate_code(self)
+        self.pop(temp)
+        self.emit("addl", temp, temp, 1)
+        self.push(temp)
+        leaf.expression.generate_code_write(self)
 
     def pre_decrement_generate_code(self, leaf):
-        instructions = leaf.expression.generate_code(self)
-        instructions.extend([
-            ("addl", end, end, -1),
-            ("load", temp, end, 0),
-            ("addl", temp, temp, -1),
-            ("store", 0, end, temp),
-            ("addl", end, end, 1),
-        ])
-        instructions.extend(leaf.expression.generate_code_write(self))
-        return instructions
+        leaf.expression.generate_code(self)
+        self.pop(temp)
+        self.emit("addl", temp, temp, -1)
+        self.push(temp)
+        leaf.expression.generate_code_write(self)
 
     def block_generate_code(self, leaf):
-        instructions = []
         for declaration in leaf.declarations:
-            instructions.extend(declaration.generate_code(self))
+            declaration.generate_code(self)
         for statement in leaf.statements:
-            instructions.extend(statement.generate_code(self))
-        return instructions
+            statement.generate_code(self)
 
     def break_generate_code(self, leaf):
-        return [("goto", 0, 0, str(id(leaf.surrounding_statement))+"end")]
+        self.emit("goto", 0, 0, self.targets[leaf.surrounding_statement][1])
 
     def continue_generate_code(self, leaf):
-        return [("goto", 0, 0, str(id(leaf.surrounding_statement))+"start")]
+        self.emit("goto", 0, 0, self.targets[leaf.surrounding_statement][0])
 
     def discard_generate_code(self, leaf):
-        instructions = leaf.expression.generate_code(self)
-        instructions.append(("addl", end, end, -1))
-        return instructions
+        expression = leaf.expression
+        kind = expression.__class__.__name__
+        #a variable kept in a register is changed in place
+        if kind in increments:
+            register = self.registers.get(
+                getattr(expression.expression, "declarator", None))
+            if register is not None:
+                self.emit("addl", register, register, increments[kind])
+                return
+        elif kind == "Assignment":
+            register = self.registers.get(
+                getattr(expression.left, "declarator", None))
+            right = expression.right
+            if (right.__class__ is tree.Convert and
+                right.expression._type() == right._type()):
+                right = right.expression
+            if register is not None and right.__class__ is tree.Binary and (
+                right.function in ["+", "-"] and
+                right.left.__class__ is tree.Variable and
+                right.left.declarator is expression.left.declarator and
+                right.right.__class__ is tree.Constant and
+                type(right.right.constant) is int and
+                right.left._type() != "float"):
+                constant = right.right.constant
+                if right.function == "-":
+                    constant = -constant
+                self.emit("addl", register, register, constant)
+                return
+            if register is not None and self.fits(right):
+                self.generate_code_reg(right)
+                self.gpr -= 1
+                self.emit("addl", register, self.gpr, 0)
+                return
+        self.generate_code(expression)
+        self.emit("addl", end, end, -1)
 
     def compound_expression_generate_code(self, leaf):
-        instructions = leaf.right.generate_code(self)
-        instructions.append(("addl", end, end, -1))
-        instructions = leaf.left.generate_code(self)
-        return instructions
+        self.generate_code(leaf.left)
+        self.emit("addl", end, end, -1)
+        self.generate_code(leaf.right)
 
     def assignment_generate_code(self, leaf):
-        instructions = self.generate_code(leaf.right)
-        instructions.extend(leaf.left.generate_code_write(self))
-        return instructions
+        self.generate_code(leaf.right)
+        leaf.left.generate_code_write(self)
 
     def sizeof_generate_code(self, leaf):
-        return leaf.expression.generate_code(self)
+        leaf.expression.generate_code(self)
 
 
     def address_generate_code(self, leaf):
-        return leaf.expression.generate_code_address(self)
+        leaf.expression.generate_code_address(self)
 
     def dereference_generate_code(self, leaf):
-        instructions = leaf.expression.generate_code(self)
-        instructions.extend([
-            #pop
-            ("addl", end, end, -1),
-            ("load", offset, end, 0),
-            #load
-            ("load", temp, offset, 0),
-            #push
-            ("store", 0, end, temp),
-            ("addl", end, end, 1),
-        ])
-        return instructions
+        self.generate_code(leaf.expression)
+        self.pop(offset)
+        #load
+        self.emit("load", temp, offset, 0)
+        self.push(temp)
 
     def dereference_generate_code_write(self, leaf):
-        instructions = leaf.expression.generate_code(self)
-        instructions.extend([
-            #pop
-            ("addl", end, end, -1),
-            ("load", offset, end, 0),
-            #pop
-            ("addl", end, end, -1),
-            ("load", temp, end, 0),
-            #push
-            ("addl", end, end, 1),
-            #store
-            ("store", 0, offset, temp)
-        ])
-        return instructions
+        self.generate_code(leaf.expression)
+        self.pop(offset)
+        #peek
+        self.pop(temp)
+        self.emit("addl", end, end, 1)
+        #store
+        self.emit("store", 0, offset, temp)
 
     def dereference_generate_code_address(self, leaf):
-        return [
-            ("addl", temp, start, leaf.declarator.offset),
-            #push
-            ("store", 0, end, temp)
-            ("addl", end, end, 1),
-        ]
-
-class GPRException(Exception):
-    pass
-
-gpr = 0
-
-def get_gpr():
-    global gpr
-    return gpr
-
-def increment_gpr():
-    global gpr
-    if gpr < maxgpr:
-        gpr += 1;
-    else:
-        raise GPRException
-
-def decrement_gpr():
-    global gpr
-    if gpr > 0:
-        gpr -= 1;
-    else:
-        raise GPRException
+        self.generate_code(leaf.expression)
+
+
+#calls in tail position reuse the frame of the caller
+tail_calls = True
+
+#functions are generated through the SSA form where it supports them
+ssa_functions = True
+
+#functions with no more than argument_registers arguments are passed them in
+#registers
+argument_registers = 4
+
+def convention(function):
+
+    """Return the calling convention of function, "registers" or "stack"."""
+
+    if len(function.args) <= argument_registers:
+        return "registers"
+    return "stack"
+
+#switch statements with no more than linear_cases cases compare each in turn
+linear_cases = 3
+
+#a switch uses a jump table if at least one in table_density of the entries
+#would be a case
+table_density = 3
+
+def dense(values):
+
+    """Return True if the sorted case values suit a jump table."""
 
+    return (len(values) > linear_cases and
+        values[-1] - values[0] < table_density * len(values))
 
 def size(expression):
     return sizes[expression._type()]
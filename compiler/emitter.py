@@ -0,0 +1,55 @@
+"""
+
+emitter
+=======
+
+The emitter collects the instructions generated for a program in a single
+buffer, in the order they are generated.
+
+Labels are numbered from a counter. A node that is jumped to from elsewhere
+in the program, such as a function or a goto label, is given its label the
+first time it is asked for, so that a jump can be generated before its
+target.
+
+The buffer is a list by default. Any object with an append method may be
+used instead, such as an assembler.Assembler, to assemble the instructions
+as they are generated.
+
+"""
+
+class Emitter:
+
+    """A buffer of generated instructions, and a counter of labels"""
+
+    def __init__(self, sink=None):
+        if sink is None:
+            sink = []
+        self.sink = sink
+        self.append = sink.append
+        self.count = 0
+        self.labels = {} #the label of each node jumped to
+
+    def emit(self, operation, dest=0, srca=0, srcb=0):
+        self.append((operation, dest, srca, srcb))
+
+    def new_label(self):
+
+        """Return a label not used before."""
+
+        self.count += 1
+        return self.count
+
+    def label_of(self, node):
+
+        """Return the label of node, the same each time it is asked for."""
+
+        label = self.labels.get(node)
+        if label is None:
+            label = self.labels[node] = self.new_label()
+        return label
+
+    def place(self, label):
+
+        """Mark the position of the next instruction with label."""
+
+        self.append(("label", label, 0, 0))
@@ -0,0 +1,157 @@
+"""
+
+inline
+======
+
+The inliner replaces calls to small functions with the body of the function.
+
+A function can be inlined if its body declares variables, then returns an
+expression, and calls no functions itself. Its size is the number of nodes
+in its body, and only functions no larger than the budget are inlined.
+
+The arguments and variables of an inlined function are renamed into new
+variables in the frame of the caller, declared at the start of the caller's
+body. A call f(a, b) to int f(int x, int y){ int t = x * y; return t + x; }
+becomes the compound expression (x' = a, y' = b, t' = x' * y', t' + x').
+
+Functions are inlined into each function in turn, in the order they are
+defined. So a function which only calls functions that have been inlined
+into it, can itself be inlined into the functions defined after it.
+
+"""
+
+from tree import *
+
+def size(function):
+
+    """Return the number of nodes in the body of function."""
+
+    return sum(1 for node in walk(function.statement))
+
+def inlinable(function):
+
+    """Return True if the body of function can be written as an expression."""
+
+    body = getattr(function, "statement", None)
+    if body.__class__ is not Block or len(body.statements) != 1:
+        return False
+    if body.statements[0].__class__ is not Return:
+        return False
+    for node in walk(body):
+        if node.__class__ in [FunctionCall, String, Label, Goto]:
+            return False
+    return body.statements[0].expression._type() == function._type
+
+def copy(node, variables):
+
+    """Return a copy of the expression node, in which each Variable refers
+    to the declarator it maps to in variables."""
+
+    if node.__class__ is Variable:
+        return Variable(variables.get(node.declarator, node.declarator), node.name)
+    duplicate = object.__new__(node.__class__)
+    for kind in node.__class__.__mro__:
+        for name in getattr(kind, "__slots__", ()):
+            if name == "cached_type" or not hasattr(node, name):
+                continue
+            value = getattr(node, name)
+            if name in node.children and isinstance(value, list):
+                value = [copy(item, variables) for item in value]
+            elif name in node.children and value is not None:
+                value = copy(value, variables)
+            setattr(duplicate, name, value)
+    return duplicate
+
+def function_name(function):
+    symbol = getattr(function, "symbol", None)
+    return symbol.name if symbol else "function"
+
+
+class Inliner:
+
+    """Inline calls to functions no larger than budget nodes, recording each
+    call site inlined."""
+
+    def __init__(self, budget=40):
+        self.budget = budget
+        self.inlined = [] #(caller, callee) of each call site inlined
+
+    def inline(self, root):
+
+        """Inline calls in each function of the compilation unit root."""
+
+        candidates = set()
+        for declaration in root.declarations:
+            if declaration.__class__ is not DeclareFunction:
+                continue
+            if not hasattr(declaration, "statement"):
+                continue
+            self.inline_calls(declaration, candidates)
+            if inlinable(declaration) and size(declaration) <= self.budget:
+                candidates.add(declaration)
+        return root
+
+    def inline_calls(self, function, candidates):
+
+        """Replace the calls to candidates within function."""
+
+        declared = [] #the declarators renamed into the frame of function
+        #the next free slot in the frame of function
+        frame = [max([0] + [node.offset + 1 for node in walk(function)
+            if node.__class__ is Declarator])]
+
+        def expand(call):
+            callee = call.declaration
+            body = callee.statement
+            variables = {}
+            for declarator in callee.args + [
+                    declarator for declare in body.declarations
+                    for declarator in declare.declarators]:
+                renamed = Declarator(1, None, declarator.name, frame[0],
+                    declarator._type)
+                frame[0] += 1
+                variables[declarator] = renamed
+                declared.append(renamed)
+
+            #the arguments, then the initial values, are assigned in order
+            assignments = []
+            for declarator, argument in zip(callee.args, call.args):
+                assignments.append(Assignment(
+                    Variable(variables[declarator], declarator.name), argument))
+            for declare in body.declarations:
+                for declarator in declare.declarators:
+                    if declarator.expression is not None:
+                        assignments.append(Assignment(
+                            Variable(variables[declarator], declarator.name),
+                            copy(declarator.expression, variables)))
+
+            expression = copy(body.statements[0].expression, variables)
+            for assignment in reversed(assignments):
+                expression = CompoundExpression(assignment, expression)
+            self.inlined.append((function_name(function), function_name(callee)))
+            return expression
+
+        def replace(node):
+            if node.__class__ is FunctionCall and node.declaration in candidates:
+                return expand(node)
+            return node
+
+        for node in walk(function.statement):
+            for name in node.children:
+                child = getattr(node, name, None)
+                if isinstance(child, list):
+                    child[:] = [replace(item) for item in child]
+                elif child is not None:
+                    setattr(node, name, replace(child))
+
+        if declared:
+            function.statement.declarations.insert(0, Declare(declared))
+
+    def report(self):
+        lines = ["inliner: {0} call sites inlined".format(len(self.inlined))]
+        counts = {}
+        for site in self.inlined:
+            counts[site] = counts.get(site, 0) + 1
+        for (caller, callee), count in sorted(counts.items()):
+            lines.append("  {0:20} into {1:20} {2}".format(callee, caller, count))
+        return "\n".join(lines)
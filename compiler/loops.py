@@ -0,0 +1,383 @@
+"""
+
+loops
+=====
+
+The loop optimiser moves computations out of loops, and replaces
+multiplications in loops with additions.
+
+Each While and DoWhile statement is a natural loop, with a single entry. A
+function containing labels is left alone, as a goto could enter a loop
+anywhere. Inner loops are optimised before the loops containing them, so that
+a computation can be moved out of several loops in turn.
+
+Only local variables whose address is never taken are considered, so that a
+variable can only be changed by an assignment, increment or decrement of the
+variable itself. A variable declared within a loop is changed by the loop.
+
+Strength reduction: a basic induction variable of a loop is an int variable
+changed within the loop only by statements adding or subtracting a constant,
+such as i++ or i = i + 4. A product of the induction variable and a constant,
+i * c, is replaced by a new variable, set to i * c before the loop, and
+increased by step * c after each statement that changes i.
+
+Loop invariant code motion: an expression in the loop which uses only
+constants, and variables not changed in the loop, is evaluated once before
+the loop into a new variable, which the loop uses instead. Division and
+modulo are only moved by a constant, other than 0, so that the loop is not
+made to fail when it would not have. An expression is only moved if it
+uses a variable, and does more than convert it to the same type.
+
+The assignments to the new variables form the preheader of the loop, which is
+placed before it in a Block. The new variables are declared at the start of
+the function, in new slots of its frame. The preheader runs even when the
+loop body does not, so it only reads variables assigned on every path to the
+loop: arguments, initialised declarations, and assignments made by the
+statements before the loop, outside any condition.
+
+"""
+
+from tree import *
+
+#the change made by each increment and decrement
+steps = {
+    PostIncrement : 1,
+    PreIncrement : 1,
+    PostDecrement : -1,
+    PreDecrement : -1,
+}
+
+def int_constant(node):
+    return node.__class__ is Constant and type(node.constant) is int
+
+def function_name(function):
+    symbol = getattr(function, "symbol", None)
+    return symbol.name if symbol else "function"
+
+def replace(parent, node, replacement):
+
+    """Replace the child node of parent with replacement."""
+
+    for name in parent.children:
+        child = getattr(parent, name, None)
+        if isinstance(child, list):
+            if node in child:
+                child[child.index(node)] = replacement
+                return
+        elif child is node:
+            setattr(parent, name, replacement)
+            return
+
+def parents(root):
+
+    """Return the parent of each node below root."""
+
+    found = {}
+    for node in walk(root):
+        for child in child_nodes(node):
+            found[child] = node
+    return found
+
+def changed(loop):
+
+    """Return the declarators of the variables changed within loop."""
+
+    variables = set()
+    for node in walk(loop):
+        if node.__class__ is Declarator:
+            variables.add(node)
+        elif node.__class__ is Assignment:
+            if node.left.__class__ is Variable:
+                variables.add(node.left.declarator)
+        elif node.__class__ in steps:
+            if node.expression.__class__ is Variable:
+                variables.add(node.expression.declarator)
+    return variables
+
+def assigned(node, found):
+
+    """Add the declarators of the variables always assigned by node to
+    found. Only the condition of an if, switch, loop or conditional
+    expression is always evaluated."""
+
+    kind = node.__class__
+    if kind is If or kind is Switch or kind is While or kind is Ternary:
+        assigned(node.expression, found)
+    elif kind is DoWhile:
+        return #a continue may skip the rest of the body
+    else:
+        for child in child_nodes(node):
+            assigned(child, found)
+        if kind is Assignment and node.left.__class__ is Variable:
+            found.add(node.left.declarator)
+
+def step(statement, declarator):
+
+    """Return the constant a statement adds to the variable, or None if it
+    is not such a statement."""
+
+    if statement.__class__ is not Discard:
+        return None
+    expression = statement.expression
+    if expression.__class__ in steps:
+        variable = expression.expression
+        if (variable.__class__ is Variable and
+            variable.declarator is declarator):
+            return steps[expression.__class__]
+    elif (expression.__class__ is Assignment and
+          expression.left.__class__ is Variable and
+          expression.left.declarator is declarator):
+        right = expression.right
+        if right.__class__ is Convert and right.expression._type() == right._type():
+            right = right.expression
+        if right.__class__ is not Binary or right.function not in ["+", "-"]:
+            return None
+        if (right.left.__class__ is Variable and
+            right.left.declarator is declarator and int_constant(right.right)):
+            if right.function == "+":
+                return right.right.constant
+            return -right.right.constant
+        if (right.function == "+" and int_constant(right.left) and
+            right.right.__class__ is Variable and
+            right.right.declarator is declarator):
+            return right.left.constant
+    return None
+
+def worth_hoisting(node):
+
+    """Return True if evaluating node takes more than loading a single value,
+    so that it is worth keeping in a variable."""
+
+    variables = operations = 0
+    for node in walk(node):
+        if node.__class__ is Variable:
+            variables += 1
+        elif node.__class__ is Binary or node.__class__ is Unary:
+            operations += 1
+        elif (node.__class__ is Convert and
+              node._type() != node.expression._type()):
+            operations += 1
+    return variables and operations
+
+
+class LoopOptimiser:
+
+    """Optimise the loops of each function, counting the expressions moved
+    out of loops, and the products reduced to additions. Either optimisation
+    can be turned off."""
+
+    def __init__(self, hoist=True, reduce=True):
+        self.hoisting = hoist
+        self.reducing = reduce
+        self.hoisted = {} #the expressions moved out of loops, by function
+        self.reduced = {} #the products replaced by additions, by function
+
+    def optimise(self, root):
+
+        """Optimise the loops of each function in the compilation unit."""
+
+        for declaration in root.declarations:
+            if declaration.__class__ is not DeclareFunction:
+                continue
+            if not hasattr(declaration, "statement") or declaration.labels:
+                continue
+            self.optimise_function(declaration)
+        return root
+
+    def optimise_function(self, function):
+        name = self.name = function_name(function)
+        self.hoisted.setdefault(name, 0)
+        self.reduced.setdefault(name, 0)
+
+        #variables whose address is taken may be changed through a pointer
+        self.locals = set(function.args)
+        addressed = set()
+        for node in walk(function.statement):
+            if node.__class__ is Declarator:
+                self.locals.add(node)
+            elif node.__class__ is Address and node.expression.__class__ is Variable:
+                addressed.add(node.expression.declarator)
+        self.locals -= addressed
+
+        self.declared = [] #the new variables
+        self.frame = max([0] + [node.offset + 1 for node in walk(function)
+            if node.__class__ is Declarator])
+
+        loops = [node for node in walk(function.statement)
+            if node.__class__ is While or node.__class__ is DoWhile]
+        for loop in loops:
+            if not self.single_entry(loop):
+                continue
+            self.assigned = self.assigned_before(function, loop)
+            reduced = self.reduce(loop) if self.reducing else []
+            hoisted = self.hoist(loop) if self.hoisting else []
+            self.hoisted[name] += len(hoisted)
+            preheader = reduced + hoisted
+            if preheader:
+                #the parent is found again, as an inner loop may have been
+                #placed in a new Block
+                parent = parents(function)[loop]
+                replace(parent, loop, Block([], preheader + [loop]))
+
+        if self.declared:
+            function.statement.declarations.insert(0, Declare(self.declared))
+
+    def single_entry(self, loop):
+
+        """Return False if a switch outside the loop jumps to a case in it."""
+
+        cases = set()
+        owned = set()
+        for node in walk(loop):
+            if node.__class__ is Case or node.__class__ is Default:
+                cases.add(node)
+            elif node.__class__ is Switch:
+                owned.update(node.cases.values())
+                owned.add(getattr(node, "default", None))
+        return cases <= owned
+
+    def assigned_before(self, function, loop):
+
+        """Return the declarators of the variables assigned on every path
+        into loop. The preheader reads only these, so that it does not
+        read a variable the loop would not have."""
+
+        found = set(function.args)
+        within = parents(function)
+        node = loop
+        while node is not function.statement:
+            parent = within[node]
+            if parent.__class__ is Block and node in parent.statements:
+                preceding = parent.statements[:parent.statements.index(node)]
+                #a switch may jump past the statements before a case
+                cases = [index for index, statement in enumerate(preceding)
+                    if any(child.__class__ is Case or
+                        child.__class__ is Default
+                        for child in walk(statement))]
+                if cases:
+                    preceding = preceding[cases[-1] + 1:]
+                else:
+                    for declare in parent.declarations:
+                        for declarator in declare.declarators:
+                            if declarator.expression is not None:
+                                found.add(declarator)
+                for statement in preceding:
+                    assigned(statement, found)
+            node = parent
+        return found
+
+    def new_variable(self, name, _type):
+        declarator = Declarator(1, None, name, self.frame, _type)
+        self.frame += 1
+        self.declared.append(declarator)
+        return declarator
+
+    def reduce(self, loop):
+
+        """Replace products of induction variables and constants within
+        loop, return the assignments of the preheader."""
+
+        updates = {} #the (block, statement, step) changing each variable
+        within = parents(loop)
+        for node in walk(loop):
+            variable = None
+            if node.__class__ is Assignment and node.left.__class__ is Variable:
+                variable = node.left.declarator
+            elif node.__class__ in steps and node.expression.__class__ is Variable:
+                variable = node.expression.declarator
+            elif node.__class__ is Declarator:
+                updates[node] = None
+            if variable is None or updates.get(variable, 0) is None:
+                continue
+            statement = within.get(node)
+            block = within.get(statement)
+            change = step(statement, variable) if statement else None
+            if (change is None or block.__class__ is not Block or
+                statement not in block.statements or
+                variable not in self.locals or variable._type != "int" or
+                variable not in self.assigned):
+                updates[variable] = None
+            else:
+                updates.setdefault(variable, []).append((block, statement, change))
+
+        products = {} #the new variable for each (variable, constant)
+        preheader = []
+        for node in list(walk(loop)):
+            if node.__class__ is not Binary or node.function != "*":
+                continue
+            for variable, factor in [(node.left, node.right), (node.right, node.left)]:
+                if (variable.__class__ is Variable and int_constant(factor) and
+                    updates.get(variable.declarator)):
+                    break
+            else:
+                continue
+            key = variable.declarator, factor.constant
+            if key not in products:
+                product = self.new_variable(
+                    "{0}*{1}".format(variable.name, factor.constant), "int")
+                products[key] = product
+                preheader.append(Discard(Assignment(
+                    Variable(product, product.name),
+                    Binary(Variable(variable.declarator, variable.name),
+                        Constant(factor.constant), "*"))))
+                for block, statement, change in updates[variable.declarator]:
+                    block.statements.insert(
+                        block.statements.index(statement) + 1,
+                        Discard(Assignment(
+                            Variable(product, product.name),
+                            Binary(Variable(product, product.name),
+                                Constant(change * factor.constant), "+"))))
+            replace(within[node], node, Variable(products[key], products[key].name))
+            self.reduced[self.name] += 1
+        return preheader
+
+    def invariant(self, node, variables):
+
+        """Return True if the expression node has the same value throughout
+        a loop changing variables."""
+
+        kind = node.__class__
+        if kind is Constant:
+            return True
+        if kind is Variable:
+            return (node.declarator in self.locals and
+                node.declarator in self.assigned and
+                node.declarator not in variables)
+        if kind is Unary or kind is Convert:
+            return self.invariant(node.expression, variables)
+        if kind is Binary:
+            if node.function in ["/", "%"] and not (
+                node.right.__class__ is Constant and node.right.constant):
+                return False
+            return (self.invariant(node.left, variables) and
+                self.invariant(node.right, variables))
+        return False
+
+    def hoist(self, loop):
+
+        """Move the invariant expressions out of loop, return the
+        assignments of the preheader."""
+
+        variables = changed(loop)
+        preheader = []
+        pending = [(loop, child) for child in child_nodes(loop)]
+        while pending:
+            parent, node = pending.pop()
+            if (node.__class__ in [Binary, Unary, Convert] and
+                self.invariant(node, variables) and worth_hoisting(node)):
+                hoisted = self.new_variable("invariant", node._type())
+                preheader.append(Discard(Assignment(
+                    Variable(hoisted, hoisted.name), node)))
+                replace(parent, node, Variable(hoisted, hoisted.name))
+            else:
+                pending.extend((node, child) for child in child_nodes(node))
+        return preheader
+
+    def report(self):
+        lines = ["loops: {0} expressions hoisted, {1} products reduced".format(
+            sum(self.hoisted.values()), sum(self.reduced.values()))]
+        for name in sorted(self.hoisted):
+            if self.hoisted[name] or self.reduced[name]:
+                lines.append("  {0:20} {1:6} hoisted {2:6} reduced".format(
+                    name, self.hoisted[name], self.reduced[name]))
+        return "\n".join(lines)
@@ -0,0 +1,242 @@
+"""
+
+optimizer
+=========
+
+The peephole optimiser rewrites short runs of generated instructions into
+fewer, equivalent instructions, before they are assembled.
+
+Each rule is given as (name, pattern, replacement, condition) in the rules
+table. The pattern is a list of instructions, and the replacement the list
+of instructions to put in their place, always shorter. The operation of each
+instruction is given literally. An operand given as a number must be equal,
+an operand given as a name matches any value, and every operand of the same
+name must match the same value. In a replacement, a name stands for the
+value it matched, and a function is called with the matched values, by name,
+to calculate the operand. The condition, if not None, is a function called
+with the matched values and the instructions following the match, and the
+rule is only applied if it returns True.
+
+A window slides over the instructions, and at each instruction the rules
+whose pattern starts with its operation are tried in order. When one
+matches, the instructions are replaced, and the window moves back far
+enough for the replacement to be tried with the instructions before it. The
+whole program is optimised again until no rule applies.
+
+Labels, jumps and data are never matched, so a run never spans a label or
+leaves the code part way through.
+
+A value pushed and popped straight away is moved between registers instead.
+The stack slot it was pushed to is left above the end register, but it may
+still be read: the code generator peeks at the top of the stack by popping
+it and moving the end register back up. The store is only removed when the
+slot is written again before anything could read it.
+
+"""
+
+from registers import end, return_address
+
+#the operands of each operation which name registers, for the operations
+#that carry on to the next instruction
+register_operands = {
+    "literal" : (1,),
+    "addl" : (1, 2),
+    "load" : (1, 2),
+    "store" : (2, 3),
+    "not" : (1, 2),
+    "invert" : (1, 2),
+    "negate" : (1, 2),
+}
+for operation in ["add", "sub", "mul", "div", "mod", "lt", "gt", "lshift",
+        "rshift", "le", "ge", "and", "or", "xor", "eq", "ne"]:
+    register_operands[operation] = (1, 2, 3)
+
+def slot_written(matched, following):
+
+    """
+
+    Return True if the stack slot at the end register is written by the
+    following instructions before they could read it.
+
+    Only pushes, pops and instructions that do not use the end register are
+    followed, anything else, such as a label or a jump, ends the search. A
+    return ends it too, but the slot is then dead: the caller moves the end
+    register back to the start of the callee's frame, and pushes before it
+    pops.
+
+    """
+
+    depth = 0 #how far the end register is above the slot
+    for instruction in following:
+        operation, dest, srca, srcb = instruction
+        if operation == "addl" and dest == end and srca == end:
+            depth += srcb
+        elif operation == "store" and srca == end and srcb != end:
+            if depth == 0:
+                return True
+        elif operation == "load" and srca == end and dest != end:
+            if depth == 0:
+                return False
+        elif operation == "goto register" and srca == return_address:
+            return True
+        elif operation not in register_operands or any(
+                instruction[operand] == end
+                for operand in register_operands[operation]):
+            return False
+    return False
+
+push_pop = [
+    ("store", 0, end, "a"),
+    ("addl", end, end, 1),
+    ("addl", end, end, -1),
+    ("load", "b", end, 0),
+]
+
+rules = [
+    ("push/pop pair", push_pop, [
+        ("addl", "b", "a", 0),
+    ], slot_written),
+    #the popped slot may be read again, the value is still stored
+    ("push/pop pair, slot kept", push_pop, [
+        ("store", 0, end, "a"),
+        ("addl", "b", "a", 0),
+    ], None),
+    ("adjacent addl", [
+        ("addl", "a", "b", "x"),
+        ("addl", "a", "a", "y"),
+    ], [
+        ("addl", "a", "b", lambda matched:matched["x"] + matched["y"]),
+    ], None),
+    ("self move", [
+        ("addl", "a", "a", 0),
+    ], [], None),
+]
+
+def match(pattern, instructions):
+
+    """Return the values of the names in pattern matched by instructions,
+    or None if they do not match."""
+
+    matched = {}
+    for template, instruction in zip(pattern, instructions):
+        if template[0] != instruction[0]:
+            return None
+        for expected, actual in zip(template[1:], instruction[1:]):
+            if isinstance(expected, str):
+                if matched.setdefault(expected, actual) != actual:
+                    return None
+            elif expected != actual:
+                return None
+    return matched
+
+def substitute(replacement, matched):
+
+    """Return the instructions of replacement, with the matched values."""
+
+    instructions = []
+    for template in replacement:
+        instruction = [template[0]]
+        for operand in template[1:]:
+            if isinstance(operand, str):
+                operand = matched[operand]
+            elif callable(operand):
+                operand = operand(matched)
+            instruction.append(operand)
+        instructions.append(tuple(instruction))
+    return instructions
+
+def size(instructions):
+
+    """Return the number of instructions in the code, leaving out labels and
+    data."""
+
+    return sum(1 for instruction in instructions
+        if instruction[0] not in ["label", "word", "zero"])
+
+
+class PeepholeOptimiser:
+
+    """Apply the rules to instruction lists, counting the times each rule is
+    applied, and the instructions before and after."""
+
+    def __init__(self, rules=rules):
+        self.rules = rules
+        self.names = [rule[0] for rule in rules]
+        self.counts = dict((name, 0) for name in self.names)
+        self.before = 0
+        self.after = 0
+
+        #the rules tried at each operation, and how far to move back
+        self.starting = {}
+        for rule in rules:
+            self.starting.setdefault(rule[1][0][0], []).append(rule)
+        self.longest = max([len(rule[1]) for rule in rules] + [1])
+
+    def optimise(self, instructions):
+
+        """Return the optimised instructions."""
+
+        self.before += size(instructions)
+        while True:
+            instructions, applied = self.optimise_pass(instructions)
+            if not applied:
+                break
+        self.after += size(instructions)
+        return instructions
+
+    def optimise_pass(self, instructions):
+
+        """Slide the window over instructions once, return the optimised
+        instructions and the number of rules applied."""
+
+        #The instructions still to be looked at are kept in reverse, so that
+        #the window is at the end of the list, and instructions can be put
+        #back cheaply.
+        pending = instructions[::-1]
+        done = []
+        applied = 0
+        starting = self.starting
+        while pending:
+            for name, pattern, replacement, condition in starting.get(
+                    pending[-1][0], ()):
+                length = len(pattern)
+                if length > len(pending):
+                    continue
+                matched = match(pattern, pending[:-length-1:-1])
+                if matched is None:
+                    continue
+                if condition is not None:
+                    following = (pending[index]
+                        for index in xrange(len(pending) - length - 1, -1, -1))
+                    if not condition(matched, following):
+                        continue
+                del pending[-length:]
+                pending.extend(reversed(substitute(replacement, matched)))
+                back = min(len(done), self.longest - 1)
+                if back:
+                    pending.extend(reversed(done[-back:]))
+                    del done[-back:]
+                self.counts[name] += 1
+                applied += 1
+                break
+            else:
+                done.append(pending.pop())
+        return done, applied
+
+    def report(self):
+        removed = self.before - self.after
+        lines = ["peephole: {0} instructions removed, {1} to {2} ({3:.1f}%)"
+            .format(removed, self.before, self.after,
+                100.0 * removed / self.before if self.before else 0)]
+        for name in self.names:
+            if self.counts[name]:
+                lines.append("  {0:30} {1}".format(name, self.counts[name]))
+        return "\n".join(lines)
+
+
+def optimize(instructions):
+
+    """Return the optimised instructions of one program, counted by a
+    peephole optimiser of its own."""
+
+    return PeepholeOptimiser().optimise(instructions)
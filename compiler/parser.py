@@ -1,12 +1,34 @@
 import os.path
 
 import scanner
+import preprocessor
 from tree import *
-import copy
+from symbols import SymbolTable
+from typecheck import check_types
 from exceptions import CSyntaxError, CTypeError, CConstantError
 
 types = ["int", "float"]
 
+#precedence of binary operators, higher values bind more tightly
+binary_precedence = {
+    "||" : 1,
+    "&&" : 2,
+    "|" : 3,
+    "^" : 4,
+    "&" : 5,
+    "<" : 6, "<=" : 6, ">" : 6, ">=" : 6,
+    "==" : 7, "!=" : 7,
+    "<<" : 8, ">>" : 8,
+    "+" : 9, "-" : 9,
+    "*" : 10, "/" : 10, "%" : 10,
+}
+
+#operators that do not form Binary nodes
+binary_nodes = {
+    "||" : lambda left, right, function: Or(left, right),
+    "&&" : lambda left, right, function: And(left, right),
+}
+
 class Parser:
 
     """
@@ -30,22 +52,28 @@ class Parser:
             "{0}\nat line {1}, {2}".format(string, self.tokens.line(), self.tokens.char())
         )
 
-    def parse(self, string):
+    def parse(self, source, filename=None):
+
+        """Parse the input file. Return the parse tree.
 
-        """Parse the input file. Return the parse tree."""
+        *source* may be a string, or a file (or memory mapped file), which is
+        preprocessed and scanned as it is parsed. Included files are searched
+        for relative to *filename*, or the name of the file."""
 
-        self.scope = {} #A dictionary of all currently visible objects
-        self._locals = [] #A list of localy declared objects
+        self.symbols = SymbolTable() #All currently visible objects
         self.offset = 0
-        self.reserved = 0
-        self.tokens = scanner.Tokenize(string)
+        self.preprocessor = preprocessor.Preprocessor()
+        self.tokens = scanner.Tokenize(
+            source, lambda source:self.preprocessor.scan(source, filename))
 
         #try:
         global_declarations = []
         while self.tokens.peek():
             global_declarations.append(self.parse_global_declaration())
-        main = str(id(self.scope["main"]))
-        return CompilationUnit(global_declarations, main, self.reserved)
+        main = self.symbols.find("main").declaration
+        unit = CompilationUnit(global_declarations, main)
+        check_types(unit)
+        return unit
 
         #except CConstantError:
         #    self.syntax_error("Expression must be a constant")
@@ -65,8 +93,16 @@ class Parser:
             #function
             return self.parse_declare_function(_type)
         else:
-            #variable
-            return self.parse_declare(_type)
+            #variable, kept in the data segment rather than a frame
+            declare = self.parse_declare(_type)
+            for declarator in declare.declarators:
+                declarator.offset = None
+                if (declarator.expression is not None and
+                    declarator.expression.__class__ is not Constant):
+                    self.syntax_error(
+                        "Initial value of {0} must be a constant".format(
+                            declarator.name))
+            return declare
 
     def parse_declare_function(self, _type):
 
@@ -84,17 +120,22 @@ class Parser:
                 self.tokens.expect("*")
             argname = self.tokens.pop()
             declarator = Declarator(1, None, argname, self.offset, arg_type)
-            self.scope[argname] = declarator
             self.offset += 1
-            args.append(name)
+            args.append(declarator)
             if self.tokens.check(","):
                 self.tokens.expect(",")
             else:
                 break
         self.tokens.expect(")")
         node = DeclareFunction(args, _type)
-        self.scope[name] = node
+        self.symbols.define(name, node)
+
+        #The arguments are visible only within the function.
+        self.symbols.enter()
+        for declarator in args:
+            self.declare(declarator)
         node.define(self.parse_statement())
+        self.symbols.leave()
         self.offset = stored_offset
         return node
 
@@ -142,13 +183,10 @@ class Parser:
         #the surrounding scope. Outside the block, the surrounding scope is 
         #restored.
 
-        #To implement this, a copy of the scope is made. Within the block, 
-        #the scope may be modified. When the block has been parsed, the stored
-        #scope is restored.
+        #To implement this, a new scope is entered in the symbol table. When 
+        #the block has been parsed, the scope is left again.
 
-        stored_scope = copy.copy(self.scope)
-        stored_locals = copy.copy(self._locals)
-        self._locals = []
+        self.symbols.enter()
         self.tokens.expect("{")
         declarations = []
         while self.tokens.peek() in types:
@@ -158,8 +196,7 @@ class Parser:
         while not self.tokens.check("}"):
             statements.append(self.parse_statement())
         self.tokens.expect("}")
-        self.scope = stored_scope
-        self._locals = stored_locals
+        self.symbols.leave()
         return Block(declarations, statements)
 
     def parse_if(self):
@@ -315,17 +352,20 @@ class Parser:
         else:
             initialise = None
 
-        #check for redeclaration
-        if name in self._locals:
-            self.syntax_error("Redefinition of {0}".format(name))
-        else:
-            self._locals.append(name)
-
         declarator = Declarator(1, initialise, name, self.offset, _type)
-        self.scope[name] = declarator
+        self.declare(declarator)
         self.offset += 1
         return declarator
 
+    def declare(self, declarator):
+
+        """Add a declarator to the current scope."""
+
+        #check for redeclaration
+        if self.symbols.declared(declarator.name):
+            self.syntax_error("Redefinition of {0}".format(declarator.name))
+        self.symbols.define(declarator.name, declarator)
+
     def parse_constant_expression(self):
 
         """
@@ -386,188 +426,102 @@ class Parser:
         """
 
         ternary_expression ::= 
-            or_expression ( "?" expression ":" ternary_expression )?
+            binary_expression ( "?" expression ":" ternary_expression )?
 
         """
 
-        expression = self.parse_or_expression(unary)
-        if self.tokens.check("?"):
+        #a chain of conditional expressions is parsed iteratively, then
+        #assembled from the right
+        expression = self.parse_binary_expression(unary)
+        branches = []
+        while self.tokens.check("?"):
             self.tokens.expect("?")
             true_expression = self.parse_expression()
             self.tokens.expect(":")
+            branches.append((expression, true_expression))
             unary = self.parse_unary_expression()
-            false_expression = self.parse_ternary_expression(unary)
-            expression = Ternary(expression, true_expression, false_expression)
+            expression = self.parse_binary_expression(unary)
+        while branches:
+            condition, true_expression = branches.pop()
+            expression = Ternary(condition, true_expression, expression)
         return expression
 
-    def parse_or_expression(self, unary):
+    def parse_binary_expression(self, unary, groups=0):
 
         """
-       
-        or_expression ::=
-            and_expression ( "||"  and_expression )*
-        
-        """
-
-        expression = self.parse_and_expression(unary)
-        while self.tokens.peek() in ["||"]:
-            function = self.tokens.pop()
-            unary = self.parse_unary_expression()
-            expression = Or(
-                expression, self.parse_and_expression(unary))
-        return expression
 
-    def parse_and_expression(self, unary):
+        binary_expression ::=
+            unary_expression ( binary_operator unary_expression )*
 
-        """
-        
-        and_expression ::=
-            bitwise_or_expression ( "&&" bitwise_or_expression )*
-        
-        """
+        The binary operators, and their precedences are given by the 
+        binary_precedence table. All binary operators are left associative.
 
-        expression = self.parse_bitwise_or_expression(unary)
-        while self.tokens.peek() in ["&&"]:
-            function = self.tokens.pop()
-            unary = self.parse_unary_expression()
-            expression = And(
-                expression, self.parse_bitwise_or_expression(unary))
-        return expression
+        The expression is parsed by precedence climbing, using explicit
+        stacks of operands and operators. An operator is applied as soon as
+        it is followed by an operator of the same or lower precedence.
 
-    def parse_bitwise_or_expression(self, unary):
+        Parenthesised groups are pushed onto the operator stack, so that 
+        nested binary expressions are parsed without recursion. A group that
+        holds anything other than a binary expression is parsed again as a
+        primary expression. *groups* is the number of groups opened by the 
+        caller, in which case the expression ends when the last is closed, or
+        None is returned if one of them must be parsed again.
 
         """
-        
-        bitwise_or_expression ::=
-            bitwise_xor_expression ( "|" bitwise_xor_expression )*
-        
-        """
 
-        expression = self.parse_bitwise_xor_expression(unary)
-        while self.tokens.peek() in ["|"]:
-            function = self.tokens.pop()
-            unary = self.parse_unary_expression()
-            expression =  Binary(
-                expression, self.parse_bitwise_xor_expression(unary), function)
-        return expression
-
-    def parse_bitwise_xor_expression(self, unary):
-
-        """
-        
-        bitwise_xor_expression ::=
-            bitwise_and_expression ( "^" bitwise_and_expression )*
-        
-        """
-
-        expression = self.parse_bitwise_and_expression(unary)
-        while self.tokens.peek() in ["^"]:
-            function = self.tokens.pop()
-            unary = self.parse_unary_expression()
-            expression = Binary(
-                expression, self.parse_bitwise_and_expression(unary), function)
-        return expression
-
-    def parse_bitwise_and_expression(self, unary):
-
-        """
-        
-        bitwise_and_expression ::=
-            bitwise_comparison_expression ( "&" bitwise_comparison_expression )*
-        
-        """
-
-        expression = self.parse_comparison_expression(unary)
-        while self.tokens.peek() in ["&"]:
-            function = self.tokens.pop()
-            unary = self.parse_unary_expression()
-            expression =  Binary(
-                expression, self.parse_comparison_expression(unary), function)
-        return expression
-
-    def parse_comparison_expression(self, unary):
-
-        """
-        
-        comparison_expression ::=
-            equality_expression ( ("<" | "<=" | ">" | ">=") equality_expression )*
-        
-        """
-
-        expression = self.parse_equality_expression(unary)
-        while self.tokens.peek() in ["<", "<=", ">", ">="]:
-            function = self.tokens.pop()
-            unary = self.parse_unary_expression()
-            expression = Binary(
-                expression, self.parse_equality_expression(unary), function)
-        return expression
-
-    def parse_equality_expression(self, unary):
-
-        """
-        
-        equality_expression ::=
-            shift_expression ( ("==" | "!=") shift_expression )*
-        
-        """
-
-        expression = self.parse_shift_expression(unary)
-        while self.tokens.peek() in ["==", "!="]:
-            function = self.tokens.pop()
-            unary = self.parse_unary_expression()
-            expression = Binary(
-                expression, self.parse_shift_expression(unary), function)
-        return expression
-
-    def parse_shift_expression(self, unary):
-
-        """
-        
-        shift_expression ::=
-            arithmetic_expression ( ("<<" | ">>") arithmetic_expression )*
-        
-        """
-
-        expression = self.parse_arithmetic_expression(unary)
-        while self.tokens.peek() in ["<<", ">>"]:
-            function = self.tokens.pop()
-            unary = self.parse_unary_expression()
-            expression = Binary(
-                expression, self.parse_arithmetic_expression(unary), function)
-        return expression
-
-    def parse_arithmetic_expression(self, unary):
-
-        """
-        
-        arithmetic_expression ::=
-            multiplicative_expression ( ("+" | "-") multiplicative_expression )*
-        
-        """
-
-        expression = self.parse_mult_expression(unary)
-        while self.tokens.peek() in ["+", "-"]:
-            function = self.tokens.pop()
-            unary = self.parse_unary_expression()
-            expression =  Binary(
-                expression, self.parse_mult_expression(unary), function)
-        return expression
-
-    def parse_mult_expression(self, unary):
-
-        """
-        
-        multiplicative_expression ::=
-            unary_expression ( ("*" | "/" | "%") unary_expression )*
-        
-        """
-
-        expression = unary
-        while self.tokens.peek() in ["*", "/", "%"]:
-            function = self.tokens.pop()
-            expression = Binary(
-                expression, self.parse_unary_expression(), function)
-        return expression
+        operands = [unary]
+        operators = []
+        marked = None #stack sizes when the outermost group here was opened
+
+        def apply():
+            right = operands.pop()
+            function = operators.pop()
+            operands[-1] = binary_nodes.get(function, Binary)(
+                operands[-1], right, function)
+
+        while True:
+            function = self.tokens.peek()
+            precedence = binary_precedence.get(function)
+            if precedence is None:
+                if function == ")" and (marked or groups):
+                    while operators and operators[-1] != "(":
+                        apply()
+                    self.tokens.expect(")")
+                    if operators:
+                        operators.pop()
+                        if len(operators) == marked[1] - 1:
+                            self.tokens.release()
+                            marked = None
+                        continue
+                    groups -= 1
+                    if groups:
+                        continue
+                    return operands[0]
+                elif marked:
+                    self.tokens.rewind()
+                    del operands[marked[0]:]
+                    del operators[marked[1] - 1:]
+                    marked = None
+                    operands.append(self.parse_unary_expression())
+                    continue
+                elif groups:
+                    return None
+                break
+            while (operators and operators[-1] != "(" and
+                binary_precedence[operators[-1]] >= precedence):
+                apply()
+            self.tokens.pop()
+            operators.append(function)
+            while self.tokens.check("("):
+                if marked is None:
+                    self.tokens.mark()
+                    marked = (len(operands), len(operators) + 1)
+                self.tokens.expect("(")
+                operators.append("(")
+            operands.append(self.parse_unary_expression())
+        while operators:
+            apply()
+        return operands[0]
 
     def parse_unary_expression(self):
 
@@ -593,17 +547,31 @@ class Parser:
 
         """Parse a primary expression."""
 
-        if self.tokens.check("("):
-            self.tokens.expect("(")
-            expression = self.parse_expression()
-            self.tokens.expect(")")
-        elif self.tokens.peek()[0].isdigit():
-            expression = self.parse_number()
-        elif self.tokens.peek()[0].isalpha():
+        kind = self.tokens.kind()
+        if kind == scanner.IDENTIFIER:
             expression = self.parse_identifier()
-        elif self.tokens.peek().startswith("'"):
+        elif kind == scanner.NUMBER:
+            expression = self.parse_number()
+        elif self.tokens.check("("):
+            #Parenthesised binary expressions are parsed without recursion.
+            #Anything else is parsed again as a parenthesised expression.
+            self.tokens.mark()
+            groups = 0
+            while self.tokens.check("("):
+                self.tokens.expect("(")
+                groups += 1
+            unary = self.parse_unary_expression()
+            expression = self.parse_binary_expression(unary, groups)
+            if expression is None:
+                self.tokens.rewind()
+                self.tokens.expect("(")
+                expression = self.parse_expression()
+                self.tokens.expect(")")
+            else:
+                self.tokens.release()
+        elif kind == scanner.CHAR:
             expression = self.parse_char()
-        elif self.tokens.peek().startswith('"'):
+        elif kind == scanner.STRING:
             expression = self.parse_string()
         return expression
 
@@ -626,10 +594,7 @@ class Parser:
         string = eval('"{0}"'.format(string))
         #append null char
         string += '\x00'
-        #reserve some memory for the string
-        reserved = self.reserved
-        self.reserved += len(string)
-        return String(string, reserved)
+        return String(string)
 
     def parse_number(self):
 
@@ -676,7 +641,7 @@ class Parser:
             expression = self.parse_function_call(name)
         else:
             try:
-                declarator = self.scope[name]
+                declarator = self.symbols.find(name).declaration
             except KeyError:
                 self.syntax_error("unknown identifier: " + name)
             expression = Variable(declarator, name)
@@ -709,7 +674,7 @@ class Parser:
                 break
         self.tokens.expect(")")
         try:
-            function_declaration = self.scope[name]
+            function_declaration = self.symbols.find(name).declaration
         except KeyError:
             self.syntax_error("unknown identifier: " + name)
         if len(args) != len(function_declaration.args):
@@ -1,28 +1,557 @@
-def preprocess(text):
+"""
 
-    #line splice
-    spliced_line = "" 
-    new_lines = []
-    for line in text.splitlines():
+preprocessor
+============
+
+The preprocessor splices continued lines, expands #include directives,
+evaluates conditional directives, and expands macros.
+
+Lines are scanned into tokens as they are read, and macros are expanded on
+the token stream. The preprocessor generates the same (kind, token, line,
+column) stream as the scanner, so that it can be used in its place.
+
+Included files are read through a cache shared by every compilation in the
+process. A cached header is reused while its modification time and size are
+unchanged, if they have changed, the contents are hashed and reused if the
+hash still matches. Headers are held in the cache already split into
+directives and scanned tokens. Headers that are wrapped in an include guard,
+or that contain #pragma once, are expanded only once per translation unit.
+
+The supported directives are:
+
+* #include "file" and #include <file>
+* #define name replacement
+* #define name(parameters) replacement
+* #undef name
+* #if, #ifdef, #ifndef, #elif, #else and #endif
+* #pragma once
+
+"""
+
+import os
+import re
+import hashlib
+import marshal
+from collections import deque
+
+import scanner
+import parser
+from scanner import IDENTIFIER, NUMBER
+from symbols import SymbolTable
+from common import value
+from exceptions import CSyntaxError, CConstantError, CTypeError
+
+#version of the exported macro format
+macro_format = 1
+
+#matches the name at the start of a #define directive, and its parameter list
+define_pattern = re.compile(r"\s*([A-Za-z_][A-Za-z0-9_]*)(\(([^)]*)\))?")
+
+empty = frozenset()
+
+
+class Macro:
+
+    """A macro definition, parameters is None for an object like macro"""
+
+    def __init__(self, name, parameters, body):
+        self.name = name
+        self.parameters = parameters
+        self.body = body
+
+
+class Header:
+
+    """A compiled header file, as held in the include cache"""
+
+    def __init__(self, path, mtime, size, digest, entries):
+        self.path = path
+        self.mtime = mtime
+        self.size = size
+        self.digest = digest
+        self.once = False
+        self.guard = None
+        self.entries = entries
+
+        directives = [
+            (index, directive.split())
+            for index, (lineno, directive, tokens) in enumerate(entries)
+            if directive is not None
+        ]
+
+        for index, directive in directives:
+            if directive == ["pragma", "once"]:
+                self.once = True
+
+        #An include guard is an #ifndef, immediately followed by a #define of
+        #the same name, which is closed by an #endif at the end of the file.
+        #Only blank space and comments may surround the guard. The guard
+        #directives are removed, the preprocessor defines the guard itself.
+        if len(directives) >= 3:
+            first, ifndef = directives[0]
+            second, define = directives[1]
+            last, endif = directives[-1]
+            outside = entries[:first] + entries[first+1:second] + entries[last+1:]
+            if (ifndef[:1] == ["ifndef"] and len(ifndef) == 2 and
+                define == ["define", ifndef[1]] and
+                endif[:1] == ["endif"] and
+                closes(directives, last) and
+                not any(tokens for lineno, directive, tokens in outside)):
+                self.guard = ifndef[1]
+                self.entries = entries[second+1:last]
+
+
+def closes(directives, last):
+
+    """Return True if the #endif at index *last* of the entries closes the
+    first of *directives*, with no #elif or #else of its own."""
+
+    depth = 0
+    for index, directive in directives:
+        name = directive[0] if directive else ""
+        if name in ["if", "ifdef", "ifndef"]:
+            depth += 1
+        elif name in ["elif", "else"] and depth == 1:
+            return False
+        elif name == "endif":
+            depth -= 1
+            if depth == 0:
+                return index == last
+    return False
+
+
+class IncludeCache:
+
+    """Compiled header files, keyed by absolute path"""
+
+    def __init__(self):
+        self.headers = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path):
+
+        """Return the Header for the file at *path*"""
+
+        path = os.path.abspath(path)
+        status = os.stat(path)
+        header = self.headers.get(path)
+        if header is not None:
+            if (header.mtime, header.size) == (status.st_mtime, status.st_size):
+                self.hits += 1
+                return header
+
+        text = open(path).read()
+        digest = hashlib.sha1(text).hexdigest()
+        if header is not None and header.digest == digest:
+            header.mtime, header.size = status.st_mtime, status.st_size
+            self.hits += 1
+            return header
+
+        self.misses += 1
+        header = Header(
+            path, status.st_mtime, status.st_size, digest,
+            list(compile_lines(text)))
+        self.headers[path] = header
+        return header
+
+    def report(self):
+        return "include cache: {0} hits, {1} misses".format(
+            self.hits, self.misses)
+
+
+#The include cache is shared between all translation units in the process.
+include_cache = IncludeCache()
+
+
+def splice(source):
+
+    """Generate the lines of *source*, lines ending in a backslash are joined
+    to the line that follows."""
+
+    spliced_line = ""
+    for line in scanner.source_lines(source):
+        line = line.rstrip("\r\n")
         if line.endswith("\\"):
             spliced_line += line[:-1]
         else:
-            spliced_line += line
-            new_lines.append(line)
-            spliced_line = "" 
-
-    #includes
-    lines = new_lines
-    new_lines = []
-    for line in lines:
-        if line.strip().startswith("#"):
-            directive = line.strip()
-            if directive.startswith("#include"):
-                filename = directive.split()[1]
-                included_file = open(filename[1:-1])
-                new_lines.extend(proprocess(included_file.read())
+            yield spliced_line + line
+            spliced_line = ""
+
+def compile_lines(source):
+
+    """
+
+    Generate a (line, directive, tokens) entry for each line of *source*.
+    For a directive, *directive* holds the text following the "#", and
+    *tokens* is None. Otherwise *directive* is None, and *tokens* holds the
+    scanned (kind, token, line, column) tuples of the line.
+
+    """
+
+    in_comment = False
+    lineno = 0
+    for line in splice(source):
+        lineno += 1
+        if not in_comment and line.lstrip().startswith("#"):
+            yield lineno, line.strip()[1:], None
+        else:
+            tokens, in_comment = scanner.scan_line(line, lineno, in_comment)
+            yield lineno, None, tokens
+
+def export_macros(macros, filename):
+
+    """Write the table of *macros* to *filename*, to be loaded by another
+    compilation with load_macros."""
+
+    table = {}
+    for name, macro in macros.iteritems():
+        table[name] = (macro.parameters, macro.body)
+    output_file = open(filename, "wb")
+    marshal.dump((macro_format, table), output_file)
+    output_file.close()
+
+def load_macros(filename):
+
+    """Return the table of macros written to *filename* by export_macros."""
+
+    input_file = open(filename, "rb")
+    version, table = marshal.load(input_file)
+    input_file.close()
+    if version != macro_format:
+        raise CSyntaxError("incompatible macro file: {0}".format(filename))
+    macros = {}
+    for name, (parameters, body) in table.iteritems():
+        macros[name] = Macro(name, parameters, body)
+    return macros
+
+
+class Preprocessor:
+
+    """
+
+    Preprocess a single translation unit
+
+    *include_path* is a list of directories searched for included files,
+    after the directory of the including file. *macros* is a table of
+    predefined macros, for example one returned by load_macros.
+
+    """
+
+    def __init__(self, include_path=None, cache=include_cache, macros=None):
+        self.include_path = include_path or ["."]
+        self.cache = cache
+        self.included = set() #headers included with #pragma once
+        self.headers = [] #every header read, in the order first read
+        self.macros = dict(macros or {})
+
+    def scan(self, source, filename=None):
+
+        """Generate the preprocessed (kind, token, line, column) stream of
+        *source*."""
+
+        if filename is None:
+            filename = getattr(source, "name", None)
+        directory = os.path.dirname(filename) if filename else None
+        return self.expand(self.select(compile_lines(source), directory))
+
+    def select(self, entries, directory):
+
+        """Carry out the directives in *entries*, and generate the tokens of
+        the lines selected by conditional directives."""
+
+        conditions = []
+        active = True #the current lines are selected
+        taken = False #a branch of the current conditional has been selected
+        lineno = 0
+
+        for lineno, directive, tokens in entries:
+            if directive is None:
+                if active:
+                    for token in tokens:
+                        yield token
+                continue
+
+            words = directive.split(None, 1)
+            name = words[0] if words else ""
+            rest = words[1] if len(words) > 1 else ""
+
+            if name in ["if", "ifdef", "ifndef"]:
+                conditions.append((active, taken))
+                if active:
+                    active = taken = self.condition(name, rest, lineno)
+                else:
+                    taken = True
+            elif name == "elif":
+                if not conditions:
+                    self.error("#elif without #if", lineno)
+                if taken:
+                    active = False
+                else:
+                    active = taken = self.condition("if", rest, lineno)
+            elif name == "else":
+                if not conditions:
+                    self.error("#else without #if", lineno)
+                active = not taken
+                taken = True
+            elif name == "endif":
+                if not conditions:
+                    self.error("#endif without #if", lineno)
+                active, taken = conditions.pop()
+            elif not active:
+                continue
+            elif name == "include":
+                for token in self.include(rest.strip(), directory, lineno):
+                    yield token
+            elif name == "define":
+                self.define(rest, lineno)
+            elif name == "undef":
+                self.macros.pop(rest.strip(), None)
+            elif name == "pragma" or name == "":
+                continue
+            else:
+                self.error("unknown directive: #{0}".format(directive), lineno)
+
+        if conditions:
+            self.error("unterminated conditional directive", lineno)
+
+    def error(self, message, lineno):
+        raise CSyntaxError("{0}\nat line {1}".format(message, lineno))
+
+    def include(self, name, directory, lineno):
+
+        """Generate the tokens of an included header."""
+
+        if len(name) < 2 or (name[0], name[-1]) not in [('"', '"'), ("<", ">")]:
+            self.error("bad include: {0}".format(name), lineno)
+        directories = list(self.include_path)
+        if name[0] == '"' and directory is not None:
+            directories.insert(0, directory)
+        for search in directories:
+            path = os.path.join(search, name[1:-1])
+            if os.path.isfile(path):
+                break
         else:
-            new_lines.append(line)
+            self.error("include not found: {0}".format(name), lineno)
+
+        header = self.cache.get(path)
+        if header not in self.headers:
+            self.headers.append(header)
+        if header.path in self.included or header.guard in self.macros:
+            return
+        if header.once:
+            self.included.add(header.path)
+        if header.guard is not None:
+            self.macros[header.guard] = Macro(header.guard, None, [])
+        directory = os.path.dirname(header.path)
+        for token in self.select(header.entries, directory):
+            yield token
+
+    def define(self, definition, lineno):
+
+        """Add a macro to the macro table."""
+
+        match = define_pattern.match(definition)
+        if not match:
+            self.error("bad macro definition", lineno)
+        name = match.group(1)
+        parameters = None
+        if match.group(2):
+            parameters = [
+                parameter.strip() for parameter in match.group(3).split(",")]
+            if parameters == [""]:
+                parameters = []
+        tokens, in_comment = scanner.scan_line(
+            definition[match.end():], lineno)
+        body = [(kind, token) for kind, token, line, column in tokens]
+        self.macros[name] = Macro(name, parameters, body)
+
+    def condition(self, name, expression, lineno):
+
+        """Evaluate the condition of an #if, #ifdef or #ifndef directive."""
+
+        if name == "ifdef":
+            return expression.strip() in self.macros
+        elif name == "ifndef":
+            return expression.strip() not in self.macros
+
+        #replace defined(name) with 1 or 0
+        tokens, in_comment = scanner.scan_line(expression, lineno)
+        tokens.reverse()
+        replaced = []
+        while tokens:
+            kind, token, line, column = tokens.pop()
+            if token == "defined":
+                parenthesised = tokens and tokens[-1][1] == "("
+                if parenthesised:
+                    tokens.pop()
+                if not tokens or tokens[-1][0] != IDENTIFIER:
+                    self.error("bad use of defined", lineno)
+                token = "1" if tokens.pop()[1] in self.macros else "0"
+                if parenthesised:
+                    if not tokens or tokens.pop()[1] != ")":
+                        self.error("bad use of defined", lineno)
+                kind = NUMBER
+            replaced.append((kind, token, line, column))
+
+        #identifiers remaining after expansion evaluate to 0
+        tokens = []
+        for kind, token, line, column in self.expand(replaced):
+            if kind == IDENTIFIER:
+                kind, token = NUMBER, "0"
+            tokens.append((kind, token, line, column))
+
+        #the expression is evaluated using the compiler's own parser
+        theparser = parser.Parser()
+        theparser.symbols = SymbolTable()
+        theparser.tokens = scanner.Tokenize(tokens, iter)
+        try:
+            result = value(theparser.parse_constant_expression())
+        except (CConstantError, CTypeError):
+            self.error("#if expression is not constant", lineno)
+        if theparser.tokens.peek() is not None:
+            self.error("bad #if expression", lineno)
+        return bool(result)
+
+    def expand(self, tokens):
+
+        """
+
+        Generate the (kind, token, line, column) stream *tokens*, with macros
+        expanded.
+
+        The replacement of a macro is pushed back onto the stream, so that
+        macros within it are expanded in turn. Replacement tokens carry the
+        set of macros that are not to be expanded within them, because they
+        resulted from their expansion.
+
+        """
+
+        macros = self.macros
+        pending = deque()
+        tokens = iter(tokens)
+
+        def take():
+            if pending:
+                return pending.popleft()
+            token = next(tokens, None)
+            if token is not None:
+                return token + (empty,)
+
+        while True:
+            if pending:
+                token = pending.popleft()
+            else:
+                token = next(tokens, None)
+                if token is None:
+                    return
+                if token[0] != IDENTIFIER or token[1] not in macros:
+                    yield token
+                    continue
+                token += (empty,)
+            replacement = self.replace(token, take)
+            if replacement is None:
+                yield token[:4]
+            else:
+                pending.extendleft(reversed(replacement))
+
+    def rescan(self, tokens):
+
+        """Return the list of (kind, token, line, column, hidden) *tokens*,
+        with macros expanded."""
+
+        pending = deque(tokens)
+
+        def take():
+            if pending:
+                return pending.popleft()
+
+        expanded = []
+        while pending:
+            token = pending.popleft()
+            replacement = self.replace(token, take)
+            if replacement is None:
+                expanded.append(token)
+            else:
+                pending.extendleft(reversed(replacement))
+        return expanded
+
+    def replace(self, token, take):
+
+        """
+
+        Return the replacement of a (kind, token, line, column, hidden)
+        token, or None if the token is not to be expanded. The arguments of a
+        function like macro are read using *take*.
+
+        """
+
+        kind, name, line, column, hidden = token
+        if kind != IDENTIFIER or name not in self.macros or name in hidden:
+            return None
+        macro = self.macros[name]
+        hidden = hidden | frozenset([name])
+
+        if macro.parameters is None:
+            return [(kind, text, line, column, hidden) for kind, text in macro.body]
+
+        following = take()
+        if following is None or following[1] != "(":
+            #a function like macro name, that is not called
+            if following is not None:
+                return [token[:4] + (hidden,), following]
+            return None
+        arguments = self.arguments(take, name, line)
+        if len(arguments) != len(macro.parameters):
+            self.error(
+                "wrong number of arguments to macro {0}".format(name), line)
+
+        #arguments are fully expanded before they are substituted
+        substitutions = {}
+        for parameter, argument in zip(macro.parameters, arguments):
+            substitutions[parameter] = self.rescan(argument)
+
+        replacement = []
+        for kind, text in macro.body:
+            if kind == IDENTIFIER and text in substitutions:
+                for argument in substitutions[text]:
+                    replacement.append(
+                        (argument[0], argument[1], line, column,
+                         argument[4] | hidden))
+            else:
+                replacement.append((kind, text, line, column, hidden))
+        return replacement
+
+    def arguments(self, take, name, line):
+
+        """Collect the comma separated arguments of a macro call, up to the
+        closing parenthesis."""
+
+        arguments = [[]]
+        depth = 0
+        while True:
+            token = take()
+            if token is None:
+                self.error("unterminated call to macro {0}".format(name), line)
+            text = token[1]
+            if text == "(":
+                depth += 1
+            elif text == ")":
+                if not depth:
+                    break
+                depth -= 1
+            elif text == "," and not depth:
+                arguments.append([])
+                continue
+            arguments[-1].append(token)
+        if arguments == [[]]:
+            return []
+        return arguments
+
+
+def preprocess(source, filename=None):
 
-    return new_lines
+    """Generate the preprocessed (kind, token, line, column) stream of
+    *source*."""
 
+    return Preprocessor().scan(source, filename)
@@ -1,7 +1,137 @@
+import re
+import mmap
+from array import array
+from itertools import islice
+
+from exceptions import CSyntaxError
+
 operators = [",", ".", "=", "<<", ">>", "==","!=", "<", ">", ">=", "<=", "(",
 ")", "{", "}", "+", "-", "*", "%", "/", "//", "~", "!", "&", "|", "^", ";",
 "&&", "||", "++", "--", "+=", "-=", "*=", "/=", "%=", "&=", "|=", "^=", "<<=",
-">>=", "[", "]", ":"]
+">>=", "[", "]", ":", "?"]
+
+#token kinds
+IDENTIFIER = 0
+NUMBER = 1
+STRING = 2
+CHAR = 3
+OPERATOR = 4
+
+#kinds recognised by the scanner, that never appear in the token stream
+COMMENT = 5
+OPEN_COMMENT = 6
+ERROR = 7
+
+#The scanner is driven by a single compiled master expression. Leading blank
+#space is consumed as part of each match. Alternatives are tried in order, so
+#the longest operators must come first, the trailing "error" group catches
+#anything the language does not recognise.
+token_pattern = re.compile(r"""\s*(?:
+    (?P<comment>/\*.*?\*/)
+  | (?P<open_comment>/\*)
+  | (?P<identifier>[A-Za-z_][A-Za-z0-9_]*)
+  | (?P<number>[0-9][0-9a-fA-FxX.]*)
+  | (?P<string>"(?:[^"\\]|\\.)*)"
+  | (?P<char>'(?:[^'\\]|\\.)*)'
+  | (?P<operator>{0})
+  | (?P<error>\S)
+)""".format("|".join(
+    re.escape(operator) for operator in 
+    sorted(operators, key=len, reverse=True))), re.VERBOSE)
+
+
+def source_lines(source):
+
+    """
+
+    Return an iterable over the lines of *source*. A source may be a string,
+    a memory mapped file, or any iterable of lines such as an open file.
+
+    """
+
+    if isinstance(source, basestring):
+        return source.splitlines()
+    elif isinstance(source, mmap.mmap):
+        return iter(source.readline, "")
+    else:
+        return source
+
+#the kind of token matched by each group of the master expression
+group_kinds = [None] * (token_pattern.groups + 1)
+for name, kind in [
+        ("comment", COMMENT),
+        ("open_comment", OPEN_COMMENT),
+        ("identifier", IDENTIFIER),
+        ("number", NUMBER),
+        ("string", STRING),
+        ("char", CHAR),
+        ("operator", OPERATOR),
+        ("error", ERROR)]:
+    group_kinds[token_pattern.groupindex[name]] = kind
+
+def scan_line(line, lineno, in_comment=False):
+
+    """
+
+    Return the (kind, token, line, column) tuples for a single *line*, and
+    whether the line ends within a comment. *in_comment* indicates that the
+    line starts within a comment.
+
+    The column recorded for a token is that of the character following it,
+    for strings and characters that is the closing quote, which is not part
+    of the token.
+
+    """
+
+    tokens = []
+    position = 0
+    if in_comment:
+        position = line.find("*/")
+        if position == -1:
+            return tokens, True
+        position += 2
+    for match in token_pattern.finditer(line, position):
+        group = match.lastindex
+        kind = group_kinds[group]
+        if kind < COMMENT:
+            tokens.append(
+                (kind, match.group(group), lineno, match.end(group) + 1))
+        elif kind == OPEN_COMMENT:
+            return tokens, True
+        elif kind == ERROR:
+            raise CSyntaxError(
+                "unexpected character: {0}\nat line {1}, {2}".format(
+                    match.group(group), lineno, match.start(group) + 1))
+    return tokens, False
+
+def scan_kinds(source):
+
+    """Generate the (kind, token, line, column) stream for *source*. Lines are
+    read from the source only as tokens are requested."""
+
+    in_comment = False
+    lineno = 0
+    for line in source_lines(source):
+        lineno += 1
+        tokens, in_comment = scan_line(line, lineno, in_comment)
+        for token in tokens:
+            yield token
+
+def scan(source):
+
+    """Generate the (token, line, column) stream for *source*."""
+
+    for kind, token, line, column in scan_kinds(source):
+        yield token, line, column
+
+#the kinds of token whose text is not interned
+literal_kinds = frozenset([NUMBER, STRING, CHAR])
+
+#number of consumed tokens to accumulate before they are discarded
+discard_threshold = 256
+#number of tokens to read from the source at a time
+fill_batch = 64
+
 
 class Tokenize:
     """
@@ -20,100 +150,134 @@ class Tokenize:
     The lexical scanner provides functions to consume, and expect tokens in 
     the token stream. The scanner also keeps track of line numbers and 
     characters for use in Error messages. 
+
+    Each token is classified by the scanner as one of IDENTIFIER, NUMBER,
+    STRING, CHAR or OPERATOR, the parser can dispatch on the kind of the next
+    token rather than examining its text.
+
+    The source is scanned lazily by *scan*, which generates the (kind, token,
+    line, column) stream for the source. Tokens are buffered only as far
+    ahead as the parser has looked. Consuming a token just moves a cursor
+    forward, the consumed tokens are discarded in batches. A position can be
+    marked, and later rewound to, allowing the parser to look ahead as far as
+    it needs to, tokens are retained while any mark is held.
+
+    The text of identifiers, keywords and operators is interned, so that each
+    is held once. The text of numbers, strings and characters is held only
+    while the tokens are buffered, so that memory stays proportional to the
+    lookahead rather than to the number of distinct literals.
     """
 
-    def __init__(self, string):
-        token = ""
-        tokens = []
-        lineno = 1
-        charno = 1
-
-        for line in string.splitlines():
-            for char in line + " ":
-                if not token:
-                    token = char
-
-                #comment
-                elif (token + char).startswith("/*"):
-                    if (token + char).endswith("*/"):
-                        token = ""
-                    else:
-                        token += char
-
-                #white space
-                elif token.isspace():
-                    if char.isspace():
-                        token += char
-                    else:
-                        token = char
-
-                #identifier
-                elif token[0].isalpha():
-                    if char.isalnum() or char == "_":
-                        token += char
-                    else:
-                        tokens.append((token, lineno, charno))
-                        token = char
-
-                #number
-                elif token[0].isdigit():
-                    if char.isdigit() or char in [
-                            "e", "E", "x", "X", ".", "a", "A", "b", "B", "c", "C", "d", "D", "f", "F"]:
-                        token += char
-                    else:
-                        tokens.append((token, lineno, charno))
-                        token = char
-
-                #string
-                elif token.startswith('"'):
-                    if char != '"' or (token.endswith("\\") and not token.endswith("\\\\")):
-                        token += char
-                    else:
-                        tokens.append((token, lineno, charno))
-                        token = ""
-
-                #character
-                elif token.startswith("'"):
-                    if char != "'" or (token.endswith("\\") and not token.endswith("\\\\")):
-                        token += char
-                    else:
-                        tokens.append((token, lineno, charno))
-                        token = ""
-
-                #operator
-                elif token in operators:
-                    if token + char in operators:
-                        token += char
-                    else:
-                        tokens.append((token, lineno, charno))
-                        token = char
-
-
-                charno += 1
-            lineno += 1
-            charno = 1
-
-        #for token, line, char in tokens:
-            #print token, "line", line, ",", char
-
-        self.tokens = tokens
+    def __init__(self, source, scan=scan_kinds):
+        self.stream = scan(source)
+
+        #tokens read from the stream, but not yet discarded, are held in 
+        #parallel arrays. The text of an identifier or operator is held once
+        #in self.names, and the text of a literal in self.literals, tokens
+        #refer to it by index. Literals are numbered from the start of the
+        #stream, self.literals holds those from self.literal_base onward.
+        self.kinds = array("B")
+        self.lexemes = array("I")
+        self.lines = array("I")
+        self.columns = array("I")
+        self.names = []
+        self.name_index = {}
+        self.literals = []
+        self.literal_base = 0
+
+        self.position = 0 #index of the next token in the arrays
+        self.marks = []
         self.lineno = 1
         self.charno = 1
 
+    def fill(self, lookahead):
+
+        """Read tokens from the stream until *lookahead* tokens beyond the
+        current position are buffered, or the stream is exhausted. Tokens are
+        read in batches of at least *fill_batch*."""
+
+        needed = self.position + lookahead - len(self.kinds)
+        if needed > 0 and self.stream:
+            needed = max(needed, fill_batch)
+            names = self.names
+            name_index = self.name_index
+            literals = self.literals
+            read = 0
+            for kind, token, line, column in islice(self.stream, needed):
+                if kind in literal_kinds:
+                    index = self.literal_base + len(literals)
+                    literals.append(token)
+                else:
+                    index = name_index.get(token)
+                    if index is None:
+                        index = name_index[token] = len(names)
+                        names.append(token)
+                self.kinds.append(kind)
+                self.lexemes.append(index)
+                self.lines.append(line)
+                self.columns.append(column)
+                read += 1
+            if read < needed:
+                self.stream = None
+
+    def advance(self):
+
+        """Move past the next token. Tokens behind the cursor are dropped 
+        from the buffer, unless a mark may still rewind to them."""
+
+        self.lineno = self.lines[self.position]
+        self.charno = self.columns[self.position]
+        self.position += 1
+        if self.position >= discard_threshold and not self.marks:
+            position = self.position
+            discarded = 0
+            for kind in self.kinds[:position]:
+                if kind in literal_kinds:
+                    discarded += 1
+            del self.literals[:discarded]
+            self.literal_base += discarded
+            del self.kinds[:position]
+            del self.lexemes[:position]
+            del self.lines[:position]
+            del self.columns[:position]
+            self.position = 0
+
+    def text(self, index):
+
+        """Return the text of the buffered token at *index*."""
+
+        if self.kinds[index] in literal_kinds:
+            return self.literals[self.lexemes[index] - self.literal_base]
+        return self.names[self.lexemes[index]]
+
+    def lookahead(self, distance):
+
+        """Return the index of the token *distance* tokens beyond the next,
+        or None if the stream ends first."""
+
+        index = self.position + distance
+        if index >= len(self.kinds):
+            self.fill(distance + 1)
+            if index >= len(self.kinds):
+                return None
+        return index
+
     def check(self, token):
 
         """Check whether *token* is the next token in the stream"""
 
-        if self.tokens and self.tokens[0][0] == token:
-            return True
-        else:
-            return False
+        index = self.position
+        if index < len(self.kinds) or self.lookahead(0) is not None:
+            if self.text(index) == token:
+                return True
+        return False
 
     def check_next(self, token):
 
         """Check whether *token* is the next but one token in the stream"""
 
-        if len(self.tokens) > 1 and self.tokens[1][0] == token:
+        index = self.lookahead(1)
+        if index is not None and self.text(index) == token:
             return True
         else:
             return False
@@ -123,11 +287,12 @@ class Tokenize:
         """Consumes the next oken in the stream, an Error is generated if the
         next token in the stream does not match *token*."""
 
-        if self.tokens:
-            if self.tokens[0][0] == token:
-                value, self.lineno, self.charno = self.tokens.pop(0)
+        index = self.lookahead(0)
+        if index is not None:
+            if self.text(index) == token:
+                self.advance()
             else:
-                print "Error expected:", token, "got:", self.tokens[0][0]
+                print "Error expected:", token, "got:", self.text(index)
                 print "at line", self.lineno, ",", self.charno
                 exit(0)
         else:
@@ -140,16 +305,46 @@ class Tokenize:
         """Consumes the next token in the stream. The consumed token is 
         returned."""
 
-        if self.tokens:
-            value, self.lineno, self.charno = self.tokens.pop(0)
+        index = self.lookahead(0)
+        if index is not None:
+            value = self.text(index)
+            self.advance()
             return value
 
     def peek(self):
 
         """Returns the next token in the stream without consuming it."""
 
-        if self.tokens:
-            return self.tokens[0][0]
+        index = self.position
+        if index < len(self.kinds) or self.lookahead(0) is not None:
+            return self.text(index)
+
+    def kind(self):
+
+        """Returns the kind of the next token in the stream."""
+
+        index = self.position
+        if index < len(self.kinds) or self.lookahead(0) is not None:
+            return self.kinds[index]
+
+    def mark(self):
+
+        """Remember the current position in the stream. Marks nest, each mark
+        must be matched by a call to rewind or release."""
+
+        self.marks.append((self.position, self.lineno, self.charno))
+
+    def rewind(self):
+
+        """Return the stream to the most recent mark, and discard the mark."""
+
+        self.position, self.lineno, self.charno = self.marks.pop()
+
+    def release(self):
+
+        """Discard the most recent mark, keeping the current position."""
+
+        self.marks.pop()
 
     def line(self):
 
@@ -0,0 +1,225 @@
+"""
+
+simplify
+========
+
+The simplifier rewrites integer expressions in the parse tree into cheaper,
+equivalent expressions.
+
+Each rule is given as (name, operator, rewrite) in the rules table. The
+rewrite is called with a Binary node of that operator, whose operands are
+both int. It returns the node to replace it with, or None if the rule does
+not apply. Rules are tried in order, and the rules are applied again to each
+replacement, until none applies.
+
+The tree is walked children first, so that the operands of an expression are
+simplified before the expression itself. The number of times each rule is
+applied is counted.
+
+"""
+
+from tree import *
+from common import constant_fold
+
+def constant(node, number=None):
+
+    """Return True if node is an int Constant (equal to number if given)."""
+
+    return (node.__class__ is Constant and type(node.constant) is int and
+        (number is None or node.constant == number))
+
+def pure(node):
+
+    """Return True if evaluating node has no side effects."""
+
+    for node in walk(node):
+        if node.__class__ not in [Constant, Variable, Binary, Unary]:
+            return False
+    return True
+
+def same_variable(left, right):
+    return (left.__class__ is Variable and right.__class__ is Variable and
+        left.declarator is right.declarator)
+
+def power_of_two(node):
+
+    """Return n if node is the Constant 2**n, n > 0, otherwise None."""
+
+    if constant(node) and node.constant > 1 and not node.constant & (node.constant - 1):
+        return node.constant.bit_length() - 1
+
+def swap(node):
+
+    """c op x => x op c, so that constants are found on the right."""
+
+    if constant(node.left) and not constant(node.right):
+        return Binary(node.right, node.left, node.function)
+
+def gather(node):
+
+    """(x op c) op d => x op (c op d), the inner constant is folded."""
+
+    left = node.left
+    if (constant(node.right) and left.__class__ is Binary and
+        left.function == node.function and constant(left.right)):
+        return Binary(left.left, Binary(left.right, node.right, node.function),
+            node.function)
+
+def hoist(node):
+
+    """(x op c) op y => (x op y) op c, so that constants are gathered
+    from both sides."""
+
+    left = node.left
+    if (not constant(node.right) and left.__class__ is Binary and
+        left.function == node.function and constant(left.right)):
+        return Binary(Binary(left.left, node.right, node.function),
+            left.right, node.function)
+
+def hoist_right(node):
+
+    """y op (x op c) => (y op x) op c"""
+
+    right = node.right
+    if (right.__class__ is Binary and right.function == node.function and
+        constant(right.right)):
+        return Binary(Binary(node.left, right.left, node.function),
+            right.right, node.function)
+
+def identity(number):
+
+    """x op number => x"""
+
+    def rewrite(node):
+        if constant(node.right, number):
+            return node.left
+    return rewrite
+
+def annihilator(number):
+
+    """x op number => number, if x has no side effects"""
+
+    def rewrite(node):
+        if constant(node.right, number) and pure(node.left):
+            return Constant(number)
+    return rewrite
+
+def subtract_constant(node):
+
+    """x - c => x + -c, so that the constant can be gathered"""
+
+    if constant(node.right) and node.right.constant != 0:
+        return Binary(node.left, Constant(-node.right.constant), "+")
+
+def subtract_self(node):
+
+    """x - x => 0"""
+
+    if same_variable(node.left, node.right):
+        return Constant(0)
+
+def multiply_shift(node):
+
+    """x * 2**n => x << n"""
+
+    shift = power_of_two(node.right)
+    if shift is not None:
+        return Binary(node.left, Constant(shift), "<<")
+
+def modulo_one(node):
+
+    """x % 1 => 0, if x has no side effects"""
+
+    if constant(node.right, 1) and pure(node.left):
+        return Constant(0)
+
+rules = [
+    ("c + x => x + c", "+", swap),
+    ("(x + c) + d => x + (c + d)", "+", gather),
+    ("(x + c) + y => (x + y) + c", "+", hoist),
+    ("y + (x + c) => (y + x) + c", "+", hoist_right),
+    ("x + 0 => x", "+", identity(0)),
+    ("x - 0 => x", "-", identity(0)),
+    ("x - x => 0", "-", subtract_self),
+    ("x - c => x + -c", "-", subtract_constant),
+    ("c * x => x * c", "*", swap),
+    ("(x * c) * d => x * (c * d)", "*", gather),
+    ("(x * c) * y => (x * y) * c", "*", hoist),
+    ("y * (x * c) => (y * x) * c", "*", hoist_right),
+    ("x * 1 => x", "*", identity(1)),
+    ("x * 0 => 0", "*", annihilator(0)),
+    ("x * 2**n => x << n", "*", multiply_shift),
+    ("x / 1 => x", "/", identity(1)),
+    ("x % 1 => 0", "%", modulo_one),
+    ("x << 0 => x", "<<", identity(0)),
+    ("x >> 0 => x", ">>", identity(0)),
+    ("c & x => x & c", "&", swap),
+    ("(x & c) & d => x & (c & d)", "&", gather),
+    ("x & -1 => x", "&", identity(-1)),
+    ("x & 0 => 0", "&", annihilator(0)),
+    ("c | x => x | c", "|", swap),
+    ("(x | c) | d => x | (c | d)", "|", gather),
+    ("x | 0 => x", "|", identity(0)),
+    ("c ^ x => x ^ c", "^", swap),
+    ("(x ^ c) ^ d => x ^ (c ^ d)", "^", gather),
+    ("x ^ 0 => x", "^", identity(0)),
+]
+
+
+class Simplifier:
+
+    """Apply a table of rewrite rules to the parse tree, counting how often
+    each rule is applied."""
+
+    def __init__(self, rules=rules):
+        self.names = [name for name, function, rewrite in rules]
+        self.rules = {}
+        self.operations = {}
+        for name, function, rewrite in rules:
+            self.rules.setdefault(function, []).append((name, rewrite))
+            self.operations[operation_code("int", function, "int")] = function
+        self.counts = dict((name, 0) for name in self.names)
+        self.folded = 0
+
+    def simplify(self, root):
+
+        """Simplify every expression below root, in place."""
+
+        for node in walk(root):
+            for name in node.children:
+                child = getattr(node, name, None)
+                if isinstance(child, list):
+                    child[:] = [self.rewrite(item) for item in child]
+                elif isinstance(child, Expression):
+                    setattr(node, name, self.rewrite(child))
+        return root
+
+    def rewrite(self, node):
+
+        """Return the simplest form of node, whose operands are simplified."""
+
+        while node.__class__ is Binary and node.operation in self.operations:
+
+            #operands simplified to constants may make the node constant
+            if constant(node.left) and constant(node.right):
+                folded = constant_fold(node)
+                if folded is not node:
+                    self.folded += 1
+                    return folded
+
+            for name, rewrite in self.rules[node.function]:
+                replacement = rewrite(node)
+                if replacement is not None:
+                    self.counts[name] += 1
+                    node = replacement
+                    break
+            else:
+                break
+        return node
+
+    def report(self):
+        lines = ["simplifier: {0} folded".format(self.folded)]
+        for name in self.names:
+            if self.counts[name]:
+                lines.append("  {0:30} {1}".format(name, self.counts[name]))
+        return "\n".join(lines)
@@ -0,0 +1,1156 @@
+"""
+
+ssa
+===
+
+Functions are translated into an intermediate representation in static
+single assignment form, before instructions are generated for them. Each
+value is assigned once, by a single operation, and a variable assigned in
+several places becomes several values, joined by phis where control flow
+meets.
+
+The values of a function are numbered from 0, and held in parallel tables
+indexed by number: the operation of each value, the tuple of values it
+operates on, and a constant. A value is a number, not an object of its own.
+
+    operation   operands             constant
+    "constant"  ()                   the value
+    "argument"  ()                   the index of the argument
+    "binary"    (left, right)        the operator, "+", "<" ...
+    "unary"     (operand,)           the operator, "-", "~" or "!"
+    "call"      (argument, ...)      the DeclareFunction called
+    "phi"       [value, ...]         None
+
+The operands of a phi correspond to the predecessors of its block. A value
+that has been replaced, such as a phi found to be redundant, forwards to its
+replacement in the replacements table.
+
+The other values are held in basic blocks, in the order they are evaluated.
+Constants are not held in a block, they are loaded where they are used. A
+block ends with one of the exits:
+
+    ("goto", block)
+    ("if", operator, left, right, true, false)    compare and branch
+    ("if", None, value, None, true, false)        branch if value is not 0
+    ("return", value)                             value may be None
+
+The Builder constructs SSA form directly, as the tree is translated, by the
+method of Braun et al., "Simple and Efficient Construction of Static Single
+Assignment Form". The value of each variable is recorded in each block it is
+assigned in. A variable read in a block where it was not assigned is looked
+up in the predecessors of the block, and a phi is placed where they meet. A
+block is sealed once all of its predecessors are known, until then the phis
+of variables read in it are left incomplete. A phi whose operands are all the
+same value, or itself, is replaced by that value. Variables are looked up
+without recursion, however many blocks they are looked up through.
+
+Only functions of int and pointer values, whose variables are all local and
+never have their address taken, and which use neither goto nor switch, are
+translated. Others are left to the tree code generator.
+
+Instructions are generated from the blocks in the order they were started.
+Each value is allocated a register by linear scan, over live ranges with a
+segment in each block the value is live in. The registers below
+argument_registers are left free, for the arguments of calls. Values live
+across a call are saved on the stack around it, and a call whose value is
+returned straight away is a tail call, as in the tree code generator. The
+phis of a block are copied into at the end of each of its predecessors. A
+function whose values do not fit in the registers is left to the tree code
+generator.
+
+"""
+
+import bisect
+
+import tree
+import registers
+import code_generator as cg
+
+#the operations evaluated for their side effects, kept even if unused
+effects = set(["call"])
+
+#the operators whose constant operands are folded
+folded = set(["+", "-", "*", "/", "%", "<<", ">>", "&", "|", "^"])
+
+def evaluate(operator, left, right):
+
+    """Return the value of left operator right, as the tree folds it, or None
+    if it cannot be folded."""
+
+    if (operator in ["/", "%"] and not right) or (operator in ["<<", ">>"] and right < 0):
+        return None
+    return tree.binary_functions[tree.operation_code("int", operator, "int")](left, right)
+
+
+class Unsupported(Exception):
+
+    """Raised when a function uses a construct that is not translated."""
+
+
+class Block(object):
+
+    """A basic block of a function"""
+
+    __slots__ = ("phis", "values", "predecessors", "exit", "sealed",
+        "incomplete")
+
+    def __init__(self):
+        self.phis = []
+        self.values = []
+        self.predecessors = []
+        self.exit = None
+        self.sealed = False
+        self.incomplete = {} #the incomplete phi of each variable
+
+    def successors(self):
+        if self.exit is None or self.exit[0] == "return":
+            return []
+        if self.exit[0] == "goto":
+            return [self.exit[1]]
+        return [self.exit[4], self.exit[5]]
+
+
+class Function(object):
+
+    """The values and blocks of a function in SSA form"""
+
+    def __init__(self, name):
+        self.name = name
+        self.operations = []
+        self.operands = []
+        self.constants = []
+        self.replacements = []
+        self.blocks = [] #in the order they were started
+        self.arguments = [] #the value of each argument
+
+    def value(self, operation, operands=(), constant=None):
+
+        """Return a new value."""
+
+        number = len(self.operations)
+        self.operations.append(operation)
+        self.operands.append(operands)
+        self.constants.append(constant)
+        self.replacements.append(number)
+        return number
+
+    def find(self, value):
+
+        """Return the value that value has been replaced by."""
+
+        replacements = self.replacements
+        while replacements[value] != value:
+            replacements[value] = replacements[replacements[value]]
+            value = replacements[value]
+        return value
+
+    def replace(self, value, replacement):
+        self.replacements[value] = replacement
+
+    def format(self):
+
+        """Return a listing of the blocks, for debugging."""
+
+        numbers = dict((block, index) for index, block in enumerate(self.blocks))
+        def name(value):
+            if self.operations[value] == "constant":
+                return str(self.constants[value])
+            return "v{0}".format(value)
+        lines = ["function {0}".format(self.name)]
+        for block in self.blocks:
+            lines.append("b{0}: from {1}".format(numbers[block],
+                " ".join("b{0}".format(numbers.get(p)) for p in block.predecessors)))
+            for value in block.phis + block.values:
+                constant = self.constants[value]
+                if self.operations[value] == "call":
+                    constant = getattr(constant.symbol, "name", "function")
+                lines.append("  v{0} = {1}".format(value, " ".join(
+                    [self.operations[value]] +
+                    ([] if constant is None else [str(constant)]) +
+                    [name(operand) for operand in self.operands[value]])))
+            exit = block.exit
+            if exit[0] == "goto":
+                lines.append("  goto b{0}".format(numbers.get(exit[1])))
+            elif exit[0] == "if":
+                condition = [name(exit[2])]
+                if exit[1] is not None:
+                    condition += [exit[1], name(exit[3])]
+                lines.append("  if {0} b{1} b{2}".format(" ".join(condition),
+                    numbers.get(exit[4]), numbers.get(exit[5])))
+            else:
+                lines.append("  return {0}".format(
+                    "" if exit[1] is None else name(exit[1])))
+        return "\n".join(lines)
+
+
+class Builder:
+
+    """
+
+    Construct a Function in SSA form, a block at a time.
+
+    Values are added to the current block, chosen by start. Variables may be
+    any hashable key, they are written and read with write and read.
+
+    """
+
+    def __init__(self, name):
+        self.function = Function(name)
+        self.block = None
+        self.definitions = {} #the value of each variable, by block
+        self.numbers = {} #the value of each constant
+        self.homes = {} #the block of each phi
+
+    def new_block(self):
+        return Block()
+
+    def start(self, block):
+
+        """Add values to block from now on."""
+
+        self.function.blocks.append(block)
+        self.block = block
+
+    def emit(self, operation, operands=(), constant=None):
+
+        """Add a value to the current block, and return it."""
+
+        value = self.function.value(operation, operands, constant)
+        self.block.values.append(value)
+        return value
+
+    def constant(self, number):
+        value = self.numbers.get(number)
+        if value is None:
+            value = self.numbers[number] = self.function.value(
+                "constant", (), number)
+        return value
+
+    def binary(self, operator, left, right):
+
+        """Add the value of left operator right, unless both are constants,
+        and return it."""
+
+        function = self.function
+        if (operator in folded and function.operations[left] == "constant" and
+            function.operations[right] == "constant"):
+            result = evaluate(operator, function.constants[left],
+                function.constants[right])
+            if result is not None:
+                return self.constant(result)
+        return self.emit("binary", (left, right), operator)
+
+    def end(self, exit, targets):
+        self.block.exit = exit
+        for target in targets:
+            target.predecessors.append(self.block)
+
+    def jump(self, target):
+        self.end(("goto", target), [target])
+
+    def branch(self, operator, left, right, true, false):
+        function = self.function
+        if (function.operations[left] == "constant" and
+            (right is None or function.operations[right] == "constant")):
+            if operator is None:
+                taken = function.constants[left]
+            else:
+                taken = evaluate(operator, function.constants[left],
+                    function.constants[right])
+            self.jump(true if taken else false)
+            return
+        self.end(("if", operator, left, right, true, false), [true, false])
+
+    def ret(self, value=None):
+        self.end(("return", value), [])
+
+    def write(self, variable, value, block=None):
+        self.definitions.setdefault(variable, {})[block or self.block] = value
+
+    def read(self, variable, block=None):
+
+        """Return the value of variable at the end of block, or the current
+        position in the current block."""
+
+        pending = []
+        value = self.lookup(variable, block or self.block, pending)
+        self.complete(variable, pending)
+        return self.function.find(value)
+
+    def lookup(self, variable, block, pending):
+
+        """Return the value of variable in block, following blocks with a
+        single predecessor. A phi placed where several meet is added to
+        pending, to have its operands looked up."""
+
+        definitions = self.definitions.setdefault(variable, {})
+        passed = []
+        while block not in definitions:
+            passed.append(block)
+            if not block.sealed:
+                value = self.phi(block)
+                block.incomplete[variable] = value
+                break
+            elif len(block.predecessors) == 1:
+                block = block.predecessors[0]
+            elif not block.predecessors:
+                value = self.constant(0) #undefined
+                break
+            else:
+                value = self.phi(block)
+                pending.append(value)
+                break
+        else:
+            value = definitions[block]
+        for block in passed:
+            definitions[block] = value
+        return value
+
+    def phi(self, block):
+        value = self.function.value("phi", [])
+        block.phis.append(value)
+        self.homes[value] = block
+        return value
+
+    def complete(self, variable, pending):
+
+        """Look up the operands of the phis in pending, and of any phis they
+        lead to, then remove those which turn out to be redundant."""
+
+        function = self.function
+        completed = []
+        while pending:
+            phi = pending.pop()
+            completed.append(phi)
+            for predecessor in self.homes[phi].predecessors:
+                function.operands[phi].append(
+                    self.lookup(variable, predecessor, pending))
+        for phi in reversed(completed):
+            self.remove_trivial(phi)
+
+    def seal(self, block):
+
+        """Mark all the predecessors of block as known."""
+
+        block.sealed = True
+        for variable, phi in block.incomplete.items():
+            pending = [phi]
+            self.complete(variable, pending)
+        block.incomplete = {}
+
+    def remove_trivial(self, phi):
+
+        """Replace phi by its only operand, other than itself, if it has one.
+        Return True if it was replaced."""
+
+        function = self.function
+        same = None
+        for operand in function.operands[phi]:
+            operand = function.find(operand)
+            if operand == same or operand == phi:
+                continue
+            if same is not None:
+                return False
+            same = operand
+        if same is None:
+            same = self.constant(0) #undefined
+        function.replace(phi, same)
+        self.homes[phi].phis.remove(phi)
+        return True
+
+    def finish(self):
+
+        """Remove the unreachable blocks and redundant phis, and return the
+        Function, with every operand replaced by the value it forwards to."""
+
+        function = self.function
+        reachable = set()
+        pending = [function.blocks[0]]
+        while pending:
+            block = pending.pop()
+            if block not in reachable:
+                reachable.add(block)
+                pending.extend(block.successors())
+        for block in function.blocks:
+            if block not in reachable:
+                continue
+            for index in reversed(range(len(block.predecessors))):
+                if block.predecessors[index] not in reachable:
+                    del block.predecessors[index]
+                    for phi in block.phis:
+                        del function.operands[phi][index]
+        function.blocks = [block for block in function.blocks if block in reachable]
+
+        #a phi can become redundant when another is replaced
+        changed = True
+        while changed:
+            changed = False
+            for block in function.blocks:
+                for phi in list(block.phis):
+                    if self.remove_trivial(phi):
+                        changed = True
+
+        find = function.find
+        for block in function.blocks:
+            for value in block.phis:
+                function.operands[value] = [
+                    find(operand) for operand in function.operands[value]]
+            for value in block.values:
+                function.operands[value] = tuple(
+                    find(operand) for operand in function.operands[value])
+            exit = block.exit
+            if exit[0] == "if":
+                block.exit = ("if", exit[1], find(exit[2]),
+                    None if exit[3] is None else find(exit[3]), exit[4], exit[5])
+            elif exit[0] == "return" and exit[1] is not None:
+                block.exit = ("return", find(exit[1]))
+        return function
+
+
+class TreeBuilder(Builder):
+
+    """Translate a DeclareFunction node into SSA form."""
+
+    def __init__(self, declaration):
+        Builder.__init__(self, function_name(declaration))
+        self.declaration = declaration
+        self.targets = {} #the (continue, break) blocks of each loop
+        self.locals = set() #the declarators of the variables
+
+    def build(self):
+        declaration = self.declaration
+        if not hasattr(declaration, "statement"):
+            raise Unsupported("no body")
+        if declaration._type == "float":
+            raise Unsupported("float function")
+        for node in tree.walk(declaration):
+            if node.__class__ is tree.Declarator:
+                if node._type == "float":
+                    raise Unsupported("float variable")
+                self.locals.add(node)
+
+        entry = self.new_block()
+        self.start(entry)
+        self.seal(entry)
+        for index, argument in enumerate(declaration.args):
+            value = self.emit("argument", (), index)
+            self.function.arguments.append(value)
+            self.write(argument, value)
+        self.statement(declaration.statement)
+        self.ret()
+        return self.finish()
+
+    def unreachable(self):
+
+        """Continue in a block with no predecessors, after a jump."""
+
+        block = self.new_block()
+        self.start(block)
+        self.seal(block)
+
+    def statement(self, node):
+        kind = node.__class__
+        if kind is tree.Block:
+            for declaration in node.declarations:
+                self.statement(declaration)
+            for statement in node.statements:
+                self.statement(statement)
+        elif kind is tree.Declare:
+            for declarator in node.declarators:
+                if declarator.expression is not None:
+                    self.write(declarator, self.expression(declarator.expression))
+        elif kind is tree.Discard:
+            self.expression(node.expression)
+        elif kind is tree.If:
+            true = self.new_block()
+            done = self.new_block()
+            false = self.new_block() if node.false else done
+            self.condition(node.expression, true, false)
+            self.start(true)
+            self.seal(true)
+            self.statement(node.true)
+            self.jump(done)
+            if node.false:
+                self.start(false)
+                self.seal(false)
+                self.statement(node.false)
+                self.jump(done)
+            self.start(done)
+            self.seal(done)
+        elif kind is tree.While:
+            header = self.new_block()
+            body = self.new_block()
+            done = self.new_block()
+            self.targets[node] = (header, done)
+            self.jump(header)
+            self.start(header)
+            self.condition(node.expression, body, done)
+            self.start(body)
+            self.seal(body)
+            self.statement(node.statement)
+            self.jump(header)
+            self.seal(header)
+            self.start(done)
+            self.seal(done)
+        elif kind is tree.DoWhile:
+            body = self.new_block()
+            test = self.new_block()
+            done = self.new_block()
+            self.targets[node] = (test, done)
+            self.jump(body)
+            self.start(body)
+            self.statement(node.statement)
+            self.jump(test)
+            self.start(test)
+            self.seal(test)
+            self.condition(node.expression, body, done)
+            self.seal(body)
+            self.start(done)
+            self.seal(done)
+        elif kind is tree.Return:
+            if node.expression is None:
+                self.ret()
+            else:
+                self.ret(self.expression(node.expression))
+            self.unreachable()
+        elif kind is tree.Break:
+            self.jump(self.targets[node.surrounding_statement][1])
+            self.unreachable()
+        elif kind is tree.Continue:
+            self.jump(self.targets[node.surrounding_statement][0])
+            self.unreachable()
+        else:
+            raise Unsupported(kind.__name__)
+
+    def condition(self, node, true, false):
+
+        """End the current block with a branch to true if node is not 0,
+        otherwise to false."""
+
+        kind = node.__class__
+        if kind is tree.Constant:
+            self.jump(true if node.constant else false)
+        elif kind is tree.Binary and node.function in cg.branch_if_true:
+            left = self.expression(node.left)
+            right = self.expression(node.right)
+            self.branch(node.function, left, right, true, false)
+        elif kind is tree.Unary and node.function == "!":
+            self.condition(node.expression, false, true)
+        elif kind is tree.Ternary:
+            #&& and || branch on each operand in turn
+            when_true = self.new_block()
+            when_false = self.new_block()
+            self.condition(node.expression, when_true, when_false)
+            self.start(when_true)
+            self.seal(when_true)
+            self.condition(node.true_expression, true, false)
+            self.start(when_false)
+            self.seal(when_false)
+            self.condition(node.false_expression, true, false)
+        else:
+            self.branch(None, self.expression(node), None, true, false)
+
+    def variable(self, node):
+        if node.__class__ is not tree.Variable:
+            raise Unsupported(node.__class__.__name__)
+        if node.declarator not in self.locals:
+            raise Unsupported("global variable")
+        return node.declarator
+
+    def expression(self, node):
+        kind = node.__class__
+        if node._type() == "float":
+            raise Unsupported("float expression")
+        if kind is tree.Constant:
+            return self.constant(node.constant)
+        elif kind is tree.Variable:
+            return self.read(self.variable(node))
+        elif kind is tree.Binary:
+            left = self.expression(node.left)
+            right = self.expression(node.right)
+            return self.binary(node.function, left, right)
+        elif kind is tree.Unary:
+            operand = self.expression(node.expression)
+            if node.function == "+":
+                return operand
+            return self.emit("unary", (operand,), node.function)
+        elif kind is tree.Convert:
+            if node._type_ != node.expression._type():
+                raise Unsupported("conversion")
+            return self.expression(node.expression)
+        elif kind is tree.Ternary:
+            true = self.new_block()
+            false = self.new_block()
+            done = self.new_block()
+            self.condition(node.expression, true, false)
+            self.start(true)
+            self.seal(true)
+            self.write(node, self.expression(node.true_expression))
+            self.jump(done)
+            self.start(false)
+            self.seal(false)
+            self.write(node, self.expression(node.false_expression))
+            self.jump(done)
+            self.start(done)
+            self.seal(done)
+            return self.read(node)
+        elif kind is tree.Assignment:
+            declarator = self.variable(node.left)
+            value = self.expression(node.right)
+            self.write(declarator, value)
+            return value
+        elif kind.__name__ in cg.increments:
+            declarator = self.variable(node.expression)
+            old = self.read(declarator)
+            new = self.binary("+", old, self.constant(cg.increments[kind.__name__]))
+            self.write(declarator, new)
+            if kind is tree.PostIncrement or kind is tree.PostDecrement:
+                return old
+            return new
+        elif kind is tree.CompoundExpression:
+            self.expression(node.left)
+            return self.expression(node.right)
+        elif kind is tree.FunctionCall:
+            arguments = tuple(self.expression(arg) for arg in node.args)
+            return self.emit("call", arguments, node.declaration)
+        raise Unsupported(kind.__name__)
+
+
+def function_name(declaration):
+    symbol = getattr(declaration, "symbol", None)
+    return symbol.name if symbol else "function"
+
+def build(declaration):
+
+    """Return the Function for a DeclareFunction node, raise Unsupported if
+    it cannot be translated."""
+
+    return TreeBuilder(declaration).build()
+
+def remove_dead_values(function):
+
+    """Remove the values which are never used, return how many."""
+
+    used = set()
+    pending = []
+    for block in function.blocks:
+        exit = block.exit
+        if exit[0] == "if":
+            pending.extend(value for value in exit[2:4] if value is not None)
+        elif exit[0] == "return" and exit[1] is not None:
+            pending.append(exit[1])
+        pending.extend(value for value in block.values
+            if function.operations[value] in effects)
+    while pending:
+        value = pending.pop()
+        if value not in used:
+            used.add(value)
+            pending.extend(function.operands[value])
+
+    removed = 0
+    for block in function.blocks:
+        for values in [block.phis, block.values]:
+            kept = [value for value in values if value in used or
+                function.operations[value] in effects]
+            removed += len(values) - len(kept)
+            values[:] = kept
+    return removed
+
+
+class Allocation:
+
+    """The registers allocated to the values of a function"""
+
+    def __init__(self, function):
+        self.registers = [None] * len(function.operations)
+        self.saved = {} #the registers to save around each call
+
+
+def allocate(function):
+
+    """
+
+    Return the Allocation of registers to the values of function, or None
+    if they do not all fit.
+
+    The positions of a function are numbered in even steps. A value is used
+    at the position of its operation, and defined at the position after, so
+    that it can take the register of an operand used for the last time. A
+    block starts with its phis and ends with its exit. The phis of each
+    successor are copied into at a position of its own after the end, as the
+    copies for each edge are made on separate paths.
+
+    The live range of a value is a list of (start, end) segments, one in each
+    block it is live in, and one at each edge it is live across. Values are
+    allocated in order of their start, each to
+    the first register whose values' segments do not meet its own, trying
+    first the registers of the phis it is copied into, and of its operands,
+    so that the copies can be left out.
+
+    """
+
+    operations = function.operations
+    operands = function.operands
+    constant = lambda value: operations[value] == "constant"
+
+    positions = {}
+    starts = {}
+    ends = {}
+    position = 0
+    for block in function.blocks:
+        starts[block] = position
+        for value in block.values:
+            position += 2
+            positions[value] = position
+        position += 2
+        ends[block] = position
+        position += 4
+
+    def edge(block, successor):
+
+        """Return the position at which the phis of successor are copied
+        into, at the end of block."""
+
+        if block.exit[0] == "if" and successor is block.exit[5]:
+            return ends[block] + 2
+        return ends[block] + 1
+
+    #the values each block uses before defining them, and defines
+    uses = {}
+    defines = {}
+    outgoing = {} #the phi operands each block supplies its successors
+    for block in function.blocks:
+        used = set()
+        defined = set(block.phis)
+        for value in block.values:
+            used.update(operand for operand in operands[value]
+                if operand not in defined and not constant(operand))
+            defined.add(value)
+        used.update(operand for operand in exit_operands(block)
+            if operand not in defined and not constant(operand))
+        uses[block] = used
+        defines[block] = defined
+        outgoing[block] = set()
+    users = {} #the phis each value is copied into
+    for block in function.blocks:
+        for phi in block.phis:
+            for index, predecessor in enumerate(block.predecessors):
+                operand = operands[phi][index]
+                if not constant(operand):
+                    outgoing[predecessor].add(operand)
+                    users.setdefault(operand, []).append(phi)
+
+    #the values live into and out of each block
+    live_in = dict((block, set()) for block in function.blocks)
+    live_out = dict((block, set()) for block in function.blocks)
+    changed = True
+    while changed:
+        changed = False
+        for block in reversed(function.blocks):
+            out = set(outgoing[block])
+            for successor in block.successors():
+                out |= live_in[successor]
+            incoming = uses[block] | (out - defines[block])
+            if out != live_out[block] or incoming != live_in[block]:
+                live_out[block] = out
+                live_in[block] = incoming
+                changed = True
+
+    segments = {}
+    for block in function.blocks:
+        defined = dict((phi, starts[block]) for phi in block.phis)
+        last = {}
+        for value in block.values:
+            defined[value] = positions[value] + 1
+            for operand in operands[value]:
+                if not constant(operand):
+                    last[operand] = positions[value]
+        for operand in exit_operands(block):
+            if not constant(operand):
+                last[operand] = ends[block]
+        for value in set(defined) | set(last) | live_in[block] | live_out[block]:
+            start = starts[block] if value in live_in[block] else defined[value]
+            if value in live_out[block]:
+                end = ends[block]
+            else:
+                end = last.get(value, start)
+            segments.setdefault(value, []).append((start, end))
+        #a value needed by a successor is live while the phis are copied
+        for successor in block.successors():
+            point = edge(block, successor)
+            for value in list(live_in[successor]) + successor.phis:
+                segments.setdefault(value, []).append((point, point))
+
+    #the registers below those of the values are left for the arguments of
+    #calls
+    value_registers = range(registers.maxgpr, cg.argument_registers - 1, -1)
+    allocation = Allocation(function)
+    #the segments allocated each register, sorted, as separate lists of
+    #their starts and ends
+    assigned = dict((register, ([], [])) for register in value_registers)
+    for value in sorted(segments, key=lambda value:min(segments[value])):
+        ranges = merge(segments[value])
+        hints = [allocation.registers[other] for other in
+            users.get(value, []) + list(operands[value])]
+        for register in hints + value_registers:
+            if register in assigned and not any(
+                    overlaps(assigned[register][0], assigned[register][1], start, end)
+                    for start, end in ranges):
+                break
+        else:
+            return None
+        allocation.registers[value] = register
+        starts_of, ends_of = assigned[register]
+        for start, end in ranges:
+            index = bisect.bisect(starts_of, start)
+            starts_of.insert(index, start)
+            ends_of.insert(index, end)
+
+    for value, position in positions.items():
+        if operations[value] == "call":
+            allocation.saved[value] = sorted(
+                register for register, (starts_of, ends_of) in assigned.items()
+                if contains(starts_of, ends_of, position))
+    return allocation
+
+def merge(segments):
+
+    """Return segments sorted, with those that meet joined."""
+
+    merged = []
+    for start, end in sorted(segments):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
+        else:
+            merged.append((start, end))
+    return merged
+
+def overlaps(starts, ends, start, end):
+
+    """Return True if any of the sorted, separate segments meets start to
+    end."""
+
+    index = bisect.bisect_right(starts, end) - 1
+    return index >= 0 and ends[index] >= start
+
+def contains(starts, ends, position):
+
+    """Return True if one of the segments extends either side of position."""
+
+    index = bisect.bisect_left(starts, position) - 1
+    return index >= 0 and ends[index] > position
+
+def exit_operands(block):
+    exit = block.exit
+    if exit[0] == "if":
+        return [value for value in exit[2:4] if value is not None]
+    if exit[0] == "return" and exit[1] is not None:
+        return [exit[1]]
+    return []
+
+
+class Generator:
+
+    """Generate the instructions of a Function through a CodeGenerator."""
+
+    def __init__(self, function, allocation, code_generator):
+        self.function = function
+        self.registers = allocation.registers
+        self.saved = allocation.saved
+        self.code_generator = code_generator
+        self.emitter = code_generator.emitter
+        self.emit = code_generator.emit
+        self.labels = dict(
+            (block, self.emitter.new_label()) for block in function.blocks)
+
+    def operand(self, value, scratch):
+
+        """Return the register holding value, loading a constant into
+        scratch."""
+
+        if self.function.operations[value] == "constant":
+            self.emit("literal", scratch, 0, self.function.constants[value])
+            return scratch
+        return self.registers[value]
+
+    def generate(self, declaration):
+        function = self.function
+        emit = self.emit
+        self.declaration = declaration
+        self.stubs = [] #the (label, block, target) of the copies for edges
+        self.tail_calls = set()
+        if cg.tail_calls:
+            self.tail_calls = set(block.values[-1] for block in function.blocks
+                if block.values and block.exit == ("return", block.values[-1]) and
+                function.operations[block.values[-1]] == "call")
+        calls = any(function.operations[value] == "call" and
+            value not in self.tail_calls
+            for block in function.blocks for value in block.values)
+
+        #the frame holds the arguments passed on the stack, and the return
+        #address if the function makes calls
+        stack = cg.convention(declaration) == "stack"
+        frame = len(declaration.args) if stack else 0
+        self.link = None
+        if calls:
+            self.link = frame
+            frame += 1
+
+        self.emitter.place(self.emitter.label_of(declaration))
+        if frame > (len(declaration.args) if stack else 0):
+            emit("addl", registers.end, registers.start, frame)
+        if self.link is not None:
+            emit("addl", registers.offset, registers.start, self.link)
+            emit("store", 0, registers.offset, registers.return_address)
+
+        blocks = function.blocks
+        for index, block in enumerate(blocks):
+            following = blocks[index + 1] if index + 1 < len(blocks) else None
+            self.emitter.place(self.labels[block])
+            values = block.values
+            #a call whose value is returned straight away is a tail call
+            if values and values[-1] in self.tail_calls:
+                for value in values[:-1]:
+                    self.value(value)
+                self.tail_call(function.operands[values[-1]],
+                    function.constants[values[-1]])
+                continue
+            for value in values:
+                self.value(value)
+            self.exit(block, following)
+        for label, block, target in self.stubs:
+            self.emitter.place(label)
+            self.jump(block, target, None)
+
+    def value(self, value):
+        function = self.function
+        emit = self.emit
+        operation = function.operations[value]
+        operands = function.operands[value]
+        constant = function.constants[value]
+        register = self.registers[value]
+        if operation == "argument":
+            if cg.convention(self.declaration) == "stack":
+                emit("addl", registers.offset, registers.start, constant)
+                emit("load", register, registers.offset, 0)
+            else:
+                emit("addl", register, constant, 0)
+        elif operation == "binary":
+            left, right = operands
+            constants = function.constants
+            if constant == "+" and function.operations[right] == "constant":
+                emit("addl", register, self.operand(left, registers.temp),
+                    constants[right])
+            elif constant == "+" and function.operations[left] == "constant":
+                emit("addl", register, self.registers[right], constants[left])
+            elif constant == "-" and function.operations[right] == "constant":
+                emit("addl", register, self.operand(left, registers.temp),
+                    -constants[right])
+            else:
+                emit(cg.binary_operations["int"][constant], register,
+                    self.operand(left, registers.temp),
+                    self.operand(right, registers.temp1))
+        elif operation == "unary":
+            emit(cg.unary_operations[constant], register,
+                self.operand(operands[0], registers.temp), 0)
+        elif operation == "call":
+            self.call(value, operands, constant, register)
+
+    def call(self, value, arguments, declaration, register):
+        generator = self.code_generator
+        emit = self.emit
+        saved = self.saved[value]
+        for saved_register in saved:
+            generator.push(saved_register)
+        generator.push(registers.start)
+        if cg.convention(declaration) == "registers":
+            self.arguments(arguments)
+            emit("addl", registers.start, registers.end, 0)
+        else:
+            for argument in arguments:
+                generator.push(self.operand(argument, registers.temp))
+            emit("addl", registers.start, registers.end, -len(arguments))
+        emit("jump and link", registers.return_address, 0,
+            self.emitter.label_of(declaration))
+        emit("addl", registers.end, registers.start, 0)
+        generator.pop(registers.start)
+        for saved_register in reversed(saved):
+            generator.pop(saved_register)
+        emit("addl", register, registers.return_value, 0)
+
+    def tail_call(self, arguments, declaration):
+
+        """Enter declaration with a goto, in the frame of this function, as
+        the tree code generator does."""
+
+        emit = self.emit
+        if cg.convention(declaration) == "registers":
+            self.arguments(arguments)
+            self.restore_link()
+            emit("addl", registers.end, registers.start, 0)
+        else:
+            #the arguments are all held in registers, so the frame can be
+            #overwritten
+            for index, argument in enumerate(arguments):
+                source = self.operand(argument, registers.temp)
+                emit("addl", registers.offset, registers.start, index)
+                emit("store", 0, registers.offset, source)
+            self.restore_link()
+            emit("addl", registers.end, registers.start, len(arguments))
+        emit("goto", 0, 0, self.emitter.label_of(declaration))
+
+    def arguments(self, arguments):
+
+        """Move the arguments of a call into registers 0, 1, 2..., the values
+        are never held in those registers."""
+
+        for index, argument in enumerate(arguments):
+            if self.function.operations[argument] == "constant":
+                self.emit("literal", index, 0, self.function.constants[argument])
+            else:
+                self.emit("addl", index, self.registers[argument], 0)
+
+    def restore_link(self):
+        if self.link is not None:
+            self.emit("addl", registers.offset, registers.start, self.link)
+            self.emit("load", registers.return_address, registers.offset, 0)
+
+    def exit(self, block, following):
+        emit = self.emit
+        exit = block.exit
+        if exit[0] == "return":
+            if exit[1] is not None:
+                if self.function.operations[exit[1]] == "constant":
+                    emit("literal", registers.return_value, 0,
+                        self.function.constants[exit[1]])
+                else:
+                    emit("addl", registers.return_value, self.registers[exit[1]], 0)
+            self.restore_link()
+            emit("goto register", 0, registers.return_address, 0)
+        elif exit[0] == "goto":
+            self.jump(block, exit[1], following)
+        else:
+            operator, left, right, true, false = exit[1:]
+            if (operator is not None and false is following and
+                not self.copies(block, true) and not self.copies(block, false)):
+                emit(cg.branch_if_true[operator],
+                    self.operand(left, registers.temp),
+                    self.operand(right, registers.temp1),
+                    self.labels[true])
+                return
+            #the edge to a false block with phis passes through the copies
+            #into them, placed after the function
+            copies = self.emitter.new_label() if self.copies(block, false) else None
+            if operator is None:
+                emit("jump if false", 0, self.operand(left, registers.temp),
+                    copies or self.labels[false])
+            else:
+                emit(cg.branch_if_false[operator],
+                    self.operand(left, registers.temp),
+                    self.operand(right, registers.temp1),
+                    copies or self.labels[false])
+            self.jump(block, true, following)
+            if copies:
+                self.stubs.append((copies, block, false))
+
+    def jump(self, block, target, following):
+
+        """Copy the values of the phis of target, then jump to it unless it
+        follows."""
+
+        self.copy_phis(block, target)
+        if target is not following:
+            self.emit("goto", 0, 0, self.labels[target])
+
+    def copies(self, block, target):
+
+        """Return True if any values are copied into the phis of target at
+        the end of block."""
+
+        function = self.function
+        index = target.predecessors.index(block)
+        for phi in target.phis:
+            operand = function.operands[phi][index]
+            if (function.operations[operand] == "constant" or
+                self.registers[operand] != self.registers[phi]):
+                return True
+        return False
+
+    def copy_phis(self, block, target):
+
+        """Copy the operands from block into the phis of target, as if all at
+        once. A cycle of copies is broken through the temp register."""
+
+        function = self.function
+        index = target.predecessors.index(block)
+        moves = {} #the source register of each destination register
+        literals = []
+        for phi in target.phis:
+            operand = function.operands[phi][index]
+            destination = self.registers[phi]
+            if function.operations[operand] == "constant":
+                literals.append((destination, function.constants[operand]))
+            elif self.registers[operand] != destination:
+                moves[destination] = self.registers[operand]
+        while moves:
+            sources = set(moves.values())
+            ready = [d for d in moves if d not in sources]
+            if ready:
+                for destination in ready:
+                    self.emit("addl", destination, moves.pop(destination), 0)
+            else:
+                destination = min(moves)
+                self.emit("addl", registers.temp, destination, 0)
+                for other in moves:
+                    if moves[other] == destination:
+                        moves[other] = registers.temp
+        for destination, number in literals:
+            self.emit("literal", destination, 0, number)
+
+
+class Translator:
+
+    """Translate functions into SSA form, and generate their instructions,
+    counting the functions translated, and those left to the tree code
+    generator."""
+
+    def __init__(self):
+        self.translated = {} #the (blocks, values, phis) of each function
+        self.declined = {} #the reason each function was not translated
+
+    def translate(self, declaration, code_generator):
+
+        """Generate the instructions for a DeclareFunction node, return False
+        if it is left to the tree code generator."""
+
+        name = function_name(declaration)
+        try:
+            function = build(declaration)
+        except Unsupported as error:
+            self.declined[name] = str(error)
+            return False
+        remove_dead_values(function)
+        allocation = allocate(function)
+        if allocation is None:
+            self.declined[name] = "too many values live"
+            return False
+        Generator(function, allocation, code_generator).generate(declaration)
+        self.translated[name] = (
+            len(function.blocks),
+            sum(len(block.values) for block in function.blocks),
+            sum(len(block.phis) for block in function.blocks))
+        return True
+
+    def report(self):
+        lines = ["ssa: {0} functions translated, {1} left to the tree".format(
+            len(self.translated), len(self.declined))]
+        for name in sorted(self.translated):
+            lines.append("  {0:20} {1:6} blocks {2:6} values {3:6} phis".format(
+                name, *self.translated[name]))
+        for name in sorted(self.declined):
+            lines.append("  {0:20} {1}".format(name, self.declined[name]))
+        return "\n".join(lines)
+
+
+#The translator is shared between all translation units in the process.
+translator = Translator()
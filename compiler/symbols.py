@@ -0,0 +1,85 @@
+"""
+
+symbols
+=======
+
+The symbol table maps the names visible at any point in the source to their
+declarations.
+
+Each name maps to the symbol of its innermost declaration, which links to
+the symbol it shadows. Each open scope holds the set of names declared
+within it, so that entering a scope, leaving a scope, finding a name and
+checking a name for redeclaration each take constant time (leaving a scope
+is proportional to the number of names it declared).
+
+Symbols are kept once their scope has closed, and are linked from the
+declarations they describe, so that later passes can use what is known about
+a variable without walking the tree again.
+
+"""
+
+class Symbol:
+
+    """A declared name, and what is known about it."""
+
+    def __init__(self, name, declaration, depth, shadowed):
+        self.name = name
+        self.declaration = declaration
+        self.depth = depth #0 for global declarations
+        self.shadowed = shadowed #the symbol hidden by this one, if any
+        self._type = declaration._type
+
+
+class SymbolTable:
+
+    """A chain of scopes, the innermost last."""
+
+    def __init__(self):
+        self.visible = {} #the innermost symbol of each name
+        self.scopes = [set()] #the names declared in each open scope
+        self.symbols = [] #every symbol, in order of declaration
+
+    def enter(self):
+
+        """Open a new scope within the current one."""
+
+        self.scopes.append(set())
+
+    def leave(self):
+
+        """Close the current scope, restoring any names it shadowed."""
+
+        visible = self.visible
+        for name in self.scopes.pop():
+            shadowed = visible[name].shadowed
+            if shadowed is None:
+                del visible[name]
+            else:
+                visible[name] = shadowed
+
+    def declared(self, name):
+
+        """Return True if name is already declared in the current scope."""
+
+        return name in self.scopes[-1]
+
+    def define(self, name, declaration):
+
+        """Declare name in the current scope, and return its symbol."""
+
+        scope = self.scopes[-1]
+        shadowed = self.visible.get(name)
+        if name in scope:
+            shadowed = shadowed.shadowed
+        symbol = Symbol(name, declaration, len(self.scopes) - 1, shadowed)
+        scope.add(name)
+        self.visible[name] = symbol
+        self.symbols.append(symbol)
+        declaration.symbol = symbol
+        return symbol
+
+    def find(self, name):
+
+        """Return the symbol visible for name, raise KeyError if none is."""
+
+        return self.visible[name]
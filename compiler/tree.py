@@ -4,37 +4,116 @@ from common import c_style_division, c_style_modulo, value, constant_fold
 
 import code_generator as cg
 
-class CompilationUnit:
+class Expression(object):
+
+    """
+
+    The base of the expression leaves.
+
+    The type of an expression is inferred when it is first needed, and kept.
+    The type of an invalid expression is None, the reason is given by its
+    type_error method. Type errors are reported together by check_types.
+
+    """
+
+    __slots__ = ("cached_type",)
+
+    def _type(self):
+        try:
+            return self.cached_type
+        except AttributeError:
+            self.cached_type = self.infer_type()
+            return self.cached_type
+
+    def type_error(self):
+        return "Invalid expression"
+
+class CompilationUnit(object):
 
     """C source file root"""
 
-    def __init__(self, declarations, main, start_address):
+    __slots__ = ("declarations", "main")
+    children = ("declarations",)
+
+    def __init__(self, declarations, main):
         self.declarations = declarations
         self.main = main
-	self.start_address = start_address
 
-    def generate_code(self):
-        code_generator = cg.CodeGenerator()
+    def generate_code(self, code_generator=None):
+        if code_generator is None:
+            code_generator = cg.CodeGenerator()
         return code_generator.compilation_unit_generate_code(self)
 
-class String:
+class String(Expression):
 
     """string literal leaf"""
 
-    def __init__(self, constant, reserved):
+    __slots__ = ("constant",)
+    children = ()
+
+    def __init__(self, constant):
         self.constant = constant
-	self.reserved = reserved
 
     def generate_code(self, code_generator):
         return code_generator.string_generate_code(self)
 
-    def _type(self):
+    def generate_code_reg(self, code_generator):
+        return code_generator.string_generate_code_reg(self)
+
+    def infer_type(self):
         return "int*"
 
-class Constant:
+def child_nodes(node):
+
+    """Return the nodes held in the children of node, in order."""
+
+    nodes = []
+    for name in node.children:
+        child = getattr(node, name, None)
+        if isinstance(child, list):
+            nodes.extend(child)
+        elif child is not None:
+            nodes.append(child)
+    return nodes
+
+def walk(root):
+
+    """Generate every node of the tree below root, children before their
+    parents. The tree is walked without recursion, however deep it is."""
+
+    pending = [(root, False)]
+    while pending:
+        node, expanded = pending.pop()
+        if expanded:
+            yield node
+        else:
+            pending.append((node, True))
+            pending.extend((child, False) for child in reversed(child_nodes(node)))
+
+def folded(expression):
+
+    """
+
+    Return the value of an operand that has already been folded.
+
+    Nodes fold their operands as they are constructed, replacing any that can
+    be evaluated with a Constant. So the value of a node depends only on
+    whether its immediate operands are Constant, and no subtree is evaluated
+    more than once.
+
+    """
+
+    if expression.__class__ is not Constant:
+        raise CConstantError("Expression is not a constant")
+    return expression.constant
+
+class Constant(Expression):
 
     """constant value leaf"""
 
+    __slots__ = ("constant",)
+    children = ()
+
     def __init__(self, constant):
         self.constant = constant
 
@@ -47,17 +126,23 @@ class Constant:
     def value(self):
         return self.constant
 
-    def _type(self):
+    def infer_type(self):
         if type(self.constant) is int:
             return "int"
         elif type(self.constant) is float:
             return "float"
 
+    def type_error(self):
+        return "Constant out of range: {0}".format(self.constant)
+
 
-class Variable:
+class Variable(Expression):
 
     """variable leaf """
 
+    __slots__ = ("declarator", "name")
+    children = ()
+
     def __init__(self, declarator, name):
         self.declarator = declarator
         self.name = name
@@ -74,14 +159,17 @@ class Variable:
     def generate_code_address(self, code_generator):
         return code_generator.variable_generate_code_address(self)
 
-    def _type(self):
+    def infer_type(self):
         return self.declarator._type
 
 
-class Declare:
+class Declare(object):
 
     """A variable declaration. i.e. int (declarator)*;"""
 
+    __slots__ = ("declarators",)
+    children = ("declarators",)
+
     def __init__(self, declarators):
         self.declarators = declarators
 
@@ -89,24 +177,30 @@ class Declare:
         return code_generator.declare_generate_code(self)
 
 
-class Declarator:
+class Declarator(object):
 
     """A variable declarator, has a variable and an initial value leaf"""
 
+    __slots__ = ("expression", "name", "offset", "_type", "symbol")
+    children = ("expression",)
+
     def __init__(self, size, expression, name, offset, _type):
         self.expression = constant_fold(expression)
         self.name = name
         self.offset = offset
-        self._type = _type
+        self._type = intern(_type)
 
     def generate_code(self, code_generator):
         return code_generator.declarator_generate_code(self)
 
 
-class DeclareFunction:
+class DeclareFunction(object):
 
     """A function declaration leaf"""
 
+    __slots__ = ("args", "_type", "labels", "statement", "symbol")
+    children = ("args", "statement")
+
     def __init__(self, args, _type):
         self.args = args
         self._type =_type
@@ -121,10 +215,13 @@ class DeclareFunction:
         return code_generator.declare_function_generate_code(self)
 
 
-class If:
+class If(object):
 
     """An if statement (with optional else clause) leaf"""
 
+    __slots__ = ("expression", "true", "false")
+    children = ("expression", "true", "false")
+
     def __init__(self, expression, true, false):
         self.expression = constant_fold(expression)
         self.true = true
@@ -146,10 +243,13 @@ class If:
             self.false.set_surrounding_function(s)
 
 
-class Switch:
+class Switch(object):
 
     """switch statement leaf"""
 
+    __slots__ = ("expression", "statement", "cases", "default")
+    children = ("expression", "statement")
+
     def __init__(self, expression, statement):
         self.expression = constant_fold(expression)
         self.statement = statement
@@ -161,10 +261,13 @@ class Switch:
         return code_generator.switch_generate_code(self)
 
 
-class Case:
+class Case(object):
 
     """case statement leaf"""
 
+    __slots__ = ("expression",)
+    children = ()
+
     def __init__(self, expression):
         self.expression = value(expression)
 
@@ -175,10 +278,13 @@ class Case:
         statement.cases[self.expression] = self
 
 
-class Default:
+class Default(object):
 
     """default statement leaf"""
 
+    __slots__ = ()
+    children = ()
+
     def generate_code(self, code_generator):
         return code_generator.default_generate_code(self)
 
@@ -186,10 +292,13 @@ class Default:
         statement.default = self
 
 
-class Label:
+class Label(object):
 
     """label statement leaf"""
 
+    __slots__ = ("label",)
+    children = ()
+
     def __init__(self, label):
         self.label = label
 
@@ -197,13 +306,16 @@ class Label:
         return code_generator.label_generate_code(self)
 
     def set_surrounding_function(self, function):
-        function.labels[self.label] =  str(id(self))
+        function.labels[self.label] = self
 
 
-class Goto:
+class Goto(object):
 
     """goto statement leaf"""
 
+    __slots__ = ("label", "function")
+    children = ()
+
     def __init__(self, label):
         self.label = label
 
@@ -214,10 +326,13 @@ class Goto:
         self.function = function
 
 
-class While:
+class While(object):
 
     """while statement leaf"""
 
+    __slots__ = ("expression", "statement")
+    children = ("expression", "statement")
+
     def __init__(self, expression, statement):
         self.expression = constant_fold(expression)
         self.statement = statement
@@ -228,10 +343,13 @@ class While:
         return code_generator.while_generate_code(self)
 
 
-class DoWhile:
+class DoWhile(object):
 
     """do while statement leaf"""
 
+    __slots__ = ("expression", "statement")
+    children = ("expression", "statement")
+
     def __init__(self, expression, statement):
         self.expression = constant_fold(expression)
         self.statement = statement
@@ -247,20 +365,23 @@ def For(initialise, expression, iterate, statement):
     """for statement is syntactic sugar for a while statement"""
 
     if iterate:
-        statement = Block([], [statement, iterate])
+        statement = Block([], [statement, Discard(iterate)])
     if expression:
         loop = While(expression, statement)
     else:
         loop = While(Constant(-1), statement)
     if initialise:
-        loop = Block([], [initialise, loop])
+        loop = Block([], [Discard(initialise), loop])
     return loop
 
 
-class Return:
+class Return(object):
 
     """return statement leaf"""
 
+    __slots__ = ("expression",)
+    children = ("expression",)
+
     def __init__(self, expression):
         self.expression = constant_fold(expression)
 
@@ -268,10 +389,13 @@ class Return:
         return code_generator.return_generate_code(self)
 
 
-class FunctionCall:
+class FunctionCall(Expression):
 
     """function call expression leaf"""
 
+    __slots__ = ("args", "declaration")
+    children = ("args",)
+
     def __init__(self, args, declaration):
         self.args = [constant_fold(arg) for arg in args]
         self.declaration = declaration
@@ -279,14 +403,17 @@ class FunctionCall:
     def generate_code(self, code_generator):
         return code_generator.function_call_generate_code(self)
 
-    def _type(self):
+    def infer_type(self):
         return self.declaration._type
 
 
-class Convert:
+class Convert(Expression):
 
     """type conversion"""
 
+    __slots__ = ("expression", "_type_")
+    children = ("expression",)
+
     def __init__(self, expression, _type):
         self.expression = expression
         self._type_ = _type
@@ -297,7 +424,7 @@ class Convert:
     def generate_code_reg(self, code_generator):
         return code_generator.convert_generate_code_reg(self)
 
-    def _type(self):
+    def infer_type(self):
         return self._type_
 
 
@@ -331,10 +458,13 @@ def And(left, right):
     )
 
 
-class Ternary:
+class Ternary(Expression):
 
     """conditional expression leaf"""
 
+    __slots__ = ("expression", "true_expression", "false_expression")
+    children = ("expression", "true_expression", "false_expression")
+
     def __init__(self, expression, true_expression, false_expression):
         self.expression = constant_fold(expression)
         self.true_expression = constant_fold(true_expression)
@@ -344,10 +474,22 @@ class Ternary:
         return code_generator.ternary_generate_code(self)
 
     def value(self):
-        if value(self.expression):
-            return value(self.true_expression)
+        if self._type() is None:
+            raise CConstantError(self.type_error())
+        if folded(self.expression):
+            return folded(self.true_expression)
         else:
-            return value(self.false_expression)
+            return folded(self.false_expression)
+
+    def infer_type(self):
+        if self.expression._type() is None:
+            return None
+        if self.true_expression._type() == self.false_expression._type():
+            return self.true_expression._type()
+
+    def type_error(self):
+        return "Incompatible types in conditional expression: {0}, {1}".format(
+            self.true_expression._type(), self.false_expression._type())
 
 def promote(left, right):
     if left._type() == "float" and right._type() == "int":
@@ -357,21 +499,155 @@ def promote(left, right):
     else:
 	return left, right
 
-class Binary:
+#Binary operations are identified by small integer codes, interned from the
+#operand types and operator, so that each node holds a shared code rather
+#than a formatted string of its own.
+
+operation_codes = {}
+operation_names = []
+
+def operation_code(left_type, function, right_type):
+
+    """Return the code of an operation, allocating one if it is new."""
+
+    key = (left_type, function, right_type)
+    try:
+        return operation_codes[key]
+    except KeyError:
+        code = operation_codes[key] = len(operation_names)
+        operation_names.append("{0} {1} {2}".format(*key))
+        return code
+
+def operation_table(table):
+
+    """Key a table of "type operator type" strings by operation code."""
+
+    return dict(
+        (operation_code(*name.split()), entry) for name, entry in table.items()
+    )
+
+binary_functions = operation_table({
+    "int + int"  : lambda x, y:x+y,
+    "int - int"  : lambda x, y:x-y,
+    "int * int"  : lambda x, y:x*y,
+    "int / int"  : c_style_division,
+    "int % int"  : c_style_modulo,
+    "int << int" : lambda x, y:x<<y,
+    "int >> int" : lambda x, y:x>>y,
+    "int & int"  : lambda x, y:x&y,
+    "int | int"  : lambda x, y:x|y,
+    "int ^ int"  : lambda x, y:x^y,
+    "int == int" : lambda x, y:int(x==y),
+    "int != int" : lambda x, y:int(x!=y),
+    "int <= int" : lambda x, y:int(x<=y),
+    "int >= int" : lambda x, y:int(x>=y),
+    "int < int"  : lambda x, y:int(x<y),
+    "int > int"  : lambda x, y:int(x>y),
+
+    "int* + int" : lambda x, y:x+y,
+    "int + int*" : lambda x, y:x+y,
+    "int* - int" : lambda x, y:x-y,
+    "int* - int*" : lambda x, y:x-y,
+    "int* == int*" : lambda x, y:int(x==y),
+    "int* != int*" : lambda x, y:int(x!=y),
+    "int* <= int*" : lambda x, y:int(x<=y),
+    "int* >= int*" : lambda x, y:int(x>=y),
+    "int* < int*"  : lambda x, y:int(x<y),
+    "int* > int*"  : lambda x, y:int(x>y),
+
+    "float + float"  : lambda x, y:x+y,
+    "float - float"  : lambda x, y:x-y,
+    "float * float"  : lambda x, y:x*y,
+    "float / float"  : lambda x, y:x/y,
+    "float == float" : lambda x, y:int(x==y),
+    "float != float" : lambda x, y:int(x!=y),
+    "float <= float" : lambda x, y:int(x<=y),
+    "float >= float" : lambda x, y:int(x>=y),
+    "float < float"  : lambda x, y:int(x<y),
+    "float > float"  : lambda x, y:int(x>y),
+
+    "float* + int" : lambda x, y:x+y,
+    "int + float*" : lambda x, y:x+y,
+    "float* - int" : lambda x, y:x-y,
+    "float* - float*" : lambda x, y:x-y,
+    "float* == float*" : lambda x, y:int(x==y),
+    "float* != float*" : lambda x, y:int(x!=y),
+    "float* <= float*" : lambda x, y:int(x<=y),
+    "float* >= float*" : lambda x, y:int(x>=y),
+    "float* < float*"  : lambda x, y:int(x<y),
+    "float* > float*"  : lambda x, y:int(x>y),
+})
+
+binary_result_types = operation_table({
+    "int + int"  : "int",
+    "int - int"  : "int",
+    "int * int"  : "int",
+    "int / int"  : "int",
+    "int % int"  : "int",
+    "int << int" : "int",
+    "int >> int" : "int",
+    "int & int"  : "int",
+    "int | int"  : "int",
+    "int ^ int"  : "int",
+    "int && int" : "int",
+    "int || int" : "int",
+    "int == int" : "int",
+    "int != int" : "int",
+    "int <= int" : "int",
+    "int >= int" : "int",
+    "int < int"  : "int",
+    "int > int"  : "int",
+
+    "int* + int" : "int*",
+    "int + int*" : "int*",
+    "int* - int" : "int*",
+    "int* - int*" : "int",
+    "int* == int*" : "int",
+    "int* != int*" : "int",
+    "int* <= int*" : "int",
+    "int* >= int*" : "int",
+    "int* < int*"  : "int",
+    "int* > int*"  : "int",
+
+    "float + float"  : "float",
+    "float - float"  : "float",
+    "float * float"  : "float",
+    "float / float"  : "float",
+    "float == float" : "int",
+    "float != float" : "int",
+    "float <= float" : "int",
+    "float >= float" : "int",
+    "float < float"  : "int",
+    "float > float"  : "int",
+
+    "float* + int" : "float*",
+    "int + float*" : "float*",
+    "float* - int" : "float*",
+    "float* - float*" : "int",
+    "float* == float*" : "int",
+    "float* != float*" : "int",
+    "float* <= float*" : "int",
+    "float* >= float*" : "int",
+    "float* < float*"  : "int",
+    "float* > float*"  : "int",
+})
+
+class Binary(Expression):
 
     """binary expression leaf"""
 
+    __slots__ = ("left", "right", "function", "operation")
+    children = ("left", "right")
+
     def __init__(self, left, right, function):
         self.left = constant_fold(left)
         self.right = constant_fold(right)
         self.function = function
-	self.left, self.right = promote(self.left, self.right)
-	self.operation_type_string = (
-            "{0} {1} {2}".format(
-                self.left._type(), 
-                self.function, 
-                self.right._type()
-            )
+        self.left, self.right = promote(self.left, self.right)
+        self.operation = operation_code(
+            self.left._type(), 
+            self.function, 
+            self.right._type()
         )
 
         #if self.left._type() != self.right._type():
@@ -384,208 +660,128 @@ class Binary:
         return code_generator.binary_generate_code(self)
 
     def value(self):
-	functions = {
-            "int + int"  : lambda x, y:x+y, 
-            "int - int"  : lambda x, y:x-y, 
-            "int * int"  : lambda x, y:x*y,
-            "int / int"  : c_style_division, 
-            "int % int"  : c_style_modulo, 
-            "int << int" : lambda x, y:x<<y,
-            "int >> int" : lambda x, y:x>>y, 
-            "int & int"  : lambda x, y:x&y, 
-            "int | int"  : lambda x, y:x|y,
-            "int ^ int"  : lambda x, y:x^y, 
-            "int == int" : lambda x, y:x==y, 
-            "int != int" : lambda x, y:x!=y, 
-            "int <= int" : lambda x, y:x<=y,
-            "int >= int" : lambda x, y:x>=y, 
-            "int < int"  : lambda x, y:x<y, 
-            "int > int"  : lambda x, y:x>y,
-
-            "int* + int" : lambda x, y:x+y, 
-            "int + int*" : lambda x, y:x+y, 
-            "int* - int" : lambda x, y:x-y, 
-            "int* - int*" : lambda x, y:x-y, 
-            "int* == int*" : lambda x, y:x==y, 
-            "int* != int*" : lambda x, y:x!=y, 
-            "int* <= int*" : lambda x, y:x<=y, 
-            "int* >= int*" : lambda x, y:x>=y, 
-            "int* < int*"  : lambda x, y:x<y, 
-            "int* > int*"  : lambda x, y:x>y,
-
-            "float + float"  : lambda x, y:x+y, 
-            "float - float"  : lambda x, y:x-y, 
-            "float * float"  : lambda x, y:x*y,
-            "float / float"  : lambda x, y:x/y, 
-            "float == float" : lambda x, y:x==y, 
-            "float != float" : lambda x, y:x!=y,
-            "float <= float" : lambda x, y:x<=y, 
-            "float >= float" : lambda x, y:x>=y, 
-            "float < float"  : lambda x, y:x<y,
-            "float > float"  : lambda x, y:x>y,
-
-            "float* + int" : lambda x, y:x+y, 
-            "int + float*" : lambda x, y:x+y, 
-            "float* - int" : lambda x, y:x-y, 
-            "float* - float*" : lambda x, y:x-y, 
-            "float* == float*" : lambda x, y:x==y, 
-            "float* != float*" : lambda x, y:x!=y, 
-            "float* <= float*" : lambda x, y:x<=y, 
-            "float* >= float*" : lambda x, y:x>=y, 
-            "float* < float*"  : lambda x, y:x<y, 
-            "float* > float*"  : lambda x, y:x>y,
-        }
-	if self.operation_type_string not in functions:
-	    raise CTypeError("Invalid operation: {0}".format(self.operation_type_string))
-        return functions[self.operation_type_string](
-            value(self.left), value(self.right)
+        if self.operation not in binary_functions:
+            raise CConstantError(self.type_error())
+        return binary_functions[self.operation](
+            folded(self.left), folded(self.right)
         )
 
-    def _type(self):
-	result_types = {
-            "int + int"  : "int", 
-            "int - int"  : "int", 
-            "int * int"  : "int", 
-            "int / int"  : "int", 
-            "int % int"  : "int", 
-            "int << int" : "int", 
-            "int >> int" : "int", 
-            "int & int"  : "int", 
-            "int | int"  : "int", 
-            "int ^ int"  : "int", 
-            "int && int" : "int",
-            "int || int" : "int", 
-            "int == int" : "int", 
-            "int != int" : "int", 
-            "int <= int" : "int", 
-            "int >= int" : "int", 
-            "int < int"  : "int", 
-            "int > int"  : "int",
-
-            "int* + int" : "int*", 
-            "int + int*" : "int*", 
-            "int* - int" : "int*", 
-            "int* - int*" : "int", 
-            "int* == int*" : "int", 
-            "int* != int*" : "int", 
-            "int* <= int*" : "int", 
-            "int* >= int*" : "int", 
-            "int* < int*"  : "int", 
-            "int* > int*"  : "int",
-
-            "float + float"  : "float", 
-            "float - float"  : "float", 
-            "float * float"  : "float", 
-            "float / float"  : "float", 
-            "float == float" : "int",
-            "float != float" : "int",
-            "float <= float" : "int", 
-            "float >= float" : "int", 
-            "float < float"  : "int", 
-            "float > float"  : "int",
-
-            "float* + int" : "float*", 
-            "int + float*" : "float*", 
-            "float* - int" : "float*", 
-            "float* - float*" : "int", 
-            "float* == float*" : "int", 
-            "float* != float*" : "int", 
-            "float* <= float*" : "int", 
-            "float* >= float*" : "int", 
-            "float* < float*"  : "int", 
-            "float* > float*"  : "int",
-        }
-	if self.operation_type_string not in result_types:
-	    raise CTypeError("Invalid operation: {0}".format(self.operation_type_string))
-        return result_types[self.operation_type_string]
-
-
-class Unary:
+    def infer_type(self):
+        return binary_result_types.get(self.operation)
+
+    def type_error(self):
+        return "Invalid operation: {0}".format(operation_names[self.operation])
+
+
+unary_functions = {
+    "!" : lambda x:1 if x == 0 else 0,
+    "~" : lambda x:~x,
+    "-" : lambda x:-x,
+    "+" : lambda x:+x,
+}
+
+class Unary(Expression):
 
     """unary expression leaf"""
 
+    __slots__ = ("expression", "function")
+    children = ("expression",)
+
     def __init__(self, expression, function):
         self.expression = constant_fold(expression)
         self.function = function
-        if self.expression._type() != "int":
-            raise CTypeError("only integer operands are supported")
 
     def generate_code(self, code_generator):
         return code_generator.unary_generate_code(self)
 
     def value(self):
-        functions = {
-            "!" : lambda x:1 if x == 0 else 0,
-            "~" : lambda x:~x,
-            "-" : lambda x:-x,
-            "+" : lambda x:+x,
-        }
-        return functions[self.function](value(self.expression))
-
-    def _type():
-        return self.expression._type()
+        if self._type() is None:
+            raise CConstantError(self.type_error())
+        return unary_functions[self.function](folded(self.expression))
+
+    def infer_type(self):
+        if self.expression._type() == "int":
+            return "int"
+
+    def type_error(self):
+        return "only integer operands are supported"
 
 
-class PostIncrement:
+class PostIncrement(Expression):
 
     """post increment expression leaf"""
 
+    __slots__ = ("expression",)
+    children = ("expression",)
+
     def __init__(self, expression):
         self.expression = expression
 
     def generate_code(self, code_generator):
         return code_generator.post_increment_generate_code(self)
 
-    def _type(self):
+    def infer_type(self):
         return self.expression._type()
 
 
-class PostDecrement:
+class PostDecrement(Expression):
 
     """post decrement expression leaf"""
 
+    __slots__ = ("expression",)
+    children = ("expression",)
+
     def __init__(self, expression):
         self.expression = expression
 
     def generate_code(self, code_generator):
         return code_generator.post_decrement_generate_code(self)
 
-    def _type(self):
+    def infer_type(self):
         return self.expression._type()
 
 
-class PreIncrement:
+class PreIncrement(Expression):
 
     """pre increment expression leaf"""
 
+    __slots__ = ("expression",)
+    children = ("expression",)
+
     def __init__(self, expression):
         self.expression = expression
 
     def generate_code(self, code_generator):
         return code_generator.pre_increment_generate_code(self)
 
-    def _type(self):
+    def infer_type(self):
         return self.expression._type()
 
 
-class PreDecrement:
+class PreDecrement(Expression):
 
     """pre decrement expression leaf"""
 
+    __slots__ = ("expression",)
+    children = ("expression",)
+
     def __init__(self, expression):
         self.expression = expression
 
     def generate_code(self, code_generator):
         return code_generator.pre_decrement_generate_code(self)
 
-    def _type(self):
+    def infer_type(self):
         return self.expression._type()
 
 
-class Block:
+class Block(object):
 
     """block {} statement leaf"""
 
+    __slots__ = ("declarations", "statements")
+    children = ("declarations", "statements")
+
     def __init__(self, declarations, statements):
         self.declarations = declarations
         self.statements = statements
@@ -604,10 +800,13 @@ class Block:
                 statement.set_surrounding_function(s)
 
 
-class Break:
+class Break(object):
 
     """break statement leaf"""
 
+    __slots__ = ("surrounding_statement",)
+    children = ()
+
     def generate_code(self, code_generator):
         return code_generator.break_generate_code(self)
 
@@ -615,10 +814,13 @@ class Break:
         self.surrounding_statement = statement
 
 
-class Continue:
+class Continue(object):
 
     """continue statement leaf"""
 
+    __slots__ = ("surrounding_statement",)
+    children = ()
+
     def generate_code(self, code_generator):
         return code_generator.continue_generate_code(self)
 
@@ -626,10 +828,13 @@ class Continue:
         self.surrounding_statement = statement
 
 
-class Discard:
+class Discard(object):
 
     """discard expression"""
 
+    __slots__ = ("expression",)
+    children = ("expression",)
+
     def __init__(self, expression):
         self.expression = expression
 
@@ -637,10 +842,13 @@ class Discard:
         return code_generator.discard_generate_code(self)
 
 
-class CompoundExpression:
+class CompoundExpression(Expression):
 
     """compound expression list leaf"""
 
+    __slots__ = ("left", "right")
+    children = ("left", "right")
+
     def __init__(self, left, right):
         self.left = left
         self.right = right
@@ -648,14 +856,17 @@ class CompoundExpression:
     def generate_code(self, code_generator):
         return code_generator.compound_expression_generate_code(self)
 
-    def _type(self):
-        return self.left._type()
+    def infer_type(self):
+        return self.right._type()
 
 
-class Assignment:
+class Assignment(Expression):
 
     """assignment expression leaf"""
 
+    __slots__ = ("left", "right")
+    children = ("left", "right")
+
     def __init__(self, left, right):
         self.left = left
         self.right = constant_fold(right)
@@ -663,21 +874,25 @@ class Assignment:
         if self.left._type() in ["int", "float"]:
             self.right = Convert(self.right, self.left._type())
 
-        if self.left._type() != self.right._type():
-            raise CTypeError("Cannot assign " + self.right._type() + 
-            " to " + self.left._type())
-
     def generate_code(self, code_generator):
         return code_generator.assignment_generate_code(self)
 
-    def _type(self):
-        return self.left._type()
+    def infer_type(self):
+        if self.left._type() == self.right._type():
+            return self.left._type()
+
+    def type_error(self):
+        return "Cannot assign {0} to {1}".format(
+            self.right._type(), self.left._type())
 
 
-class SizeOf:
+class SizeOf(Expression):
 
     """sizeof expression leaf"""
 
+    __slots__ = ("expression",)
+    children = ()
+
     def __init__(self, expression):
         self.expression = Constant(size(self))
 
@@ -687,7 +902,7 @@ class SizeOf:
     def value(self):
         return size(self)
 
-    def _type(self):
+    def infer_type(self):
         return "int"
 
 
@@ -698,24 +913,31 @@ def SizeOfType(_type):
     return Constant(sizes[_type])
 
 
-class Address:
+class Address(Expression):
 
     """address & expression leaf"""
 
+    __slots__ = ("expression",)
+    children = ("expression",)
+
     def __init__(self, expression):
         self.expression = expression
 
     def generate_code(self, code_generator):
         return code_generator.address_generate_code(self)
 
-    def _type(self):
-        return self.expression._type() + "*"
+    def infer_type(self):
+        if self.expression._type() is not None:
+            return self.expression._type() + "*"
 
 
-class Dereference:
+class Dereference(Expression):
 
     """dereference * expression leaf"""
 
+    __slots__ = ("expression",)
+    children = ("expression",)
+
     def __init__(self, expression):
         self.expression = expression
 
@@ -728,8 +950,11 @@ class Dereference:
     def generate_code_address(self, code_generator):
         return code_generator.dereference_generate_code_address(self)
 
-    def _type(self):
-        if not self.expression._type().endswith("*"):
-            raise CTypeError("Expression is not a pointer")
-        return self.expression._type()[:-1]
+    def infer_type(self):
+        _type = self.expression._type()
+        if _type is not None and _type.endswith("*"):
+            return _type[:-1]
+
+    def type_error(self):
+        return "Expression is not a pointer"
 
@@ -0,0 +1,36 @@
+"""
+
+typecheck
+=========
+
+The type checker infers the type of each expression in the parse tree, and
+reports every type error found together.
+
+The tree is walked children first, so that the type of each expression is
+inferred from the types already held by its operands, and each type is
+inferred once. Code generation then reads the types held by the tree.
+
+An expression with no valid type is reported only if its operands are valid,
+so that one error is not reported again by every enclosing expression.
+
+"""
+
+from tree import Expression, child_nodes, walk
+from exceptions import CTypeError
+
+def check_types(root):
+
+    """Infer the type of every expression below *root*. Raise a CTypeError
+    listing all type errors, if there are any."""
+
+    errors = []
+    for node in walk(root):
+        if isinstance(node, Expression) and node._type() is None:
+            operands = [
+                child for child in child_nodes(node)
+                if isinstance(child, Expression)
+            ]
+            if all(operand._type() is not None for operand in operands):
+                errors.append(node.type_error())
+    if errors:
+        raise CTypeError("\n".join(errors))
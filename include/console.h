@@ -0,0 +1,28 @@
+#ifndef CONSOLE_H
+#define CONSOLE_H
+
+/*Assumes 0xffffffff is address mapped to cout*/
+#define CONSOLE 0xffffffff
+
+/*write a character, where console points to CONSOLE*/
+#define put_char(c) (*console = (c))
+
+int print_string(int * index){
+	int *console = CONSOLE;
+	while(*index){put_char(*(index++));}
+	return 1;
+}
+
+int print_int(int i){
+	int decade;
+	int digit;
+	int *console = CONSOLE;
+
+	for(decade = 1000000000; decade; decade /= 10){
+		for(digit=0; i >= decade; i-=decade) digit++;
+		put_char(digit + '0');
+	}
+	return 1;
+}
+
+#endif
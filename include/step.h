@@ -0,0 +1,7 @@
+/* not an include guard: the last #endif closes the #ifdef */
+#ifndef STEP_H
+#define STEP_H
+#endif
+#ifdef STEP
++ STEP
+#endif
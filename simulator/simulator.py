@@ -12,6 +12,13 @@ class Simulator:
         self.registers = {}
         self.program_counter = 0
         self.memory = {}
+        #the data segment is loaded before the program starts
+        for operation, dest, srca, srcb in instructions:
+            if operation == "word":
+                self.memory[dest] = srcb
+            elif operation == "zero":
+                for address in range(dest, dest + srcb):
+                    self.memory[address] = 0
 
     def execute(self):
         instruction = self.instructions[self.program_counter]
@@ -86,6 +93,20 @@ class Simulator:
             else:
                 self.program_counter  += 1
 
+        elif operation in ["beq", "bne", "blt", "bgt", "ble", "bge"]:
+            functions = {
+              "beq" : lambda x, y:x==y,
+              "bne" : lambda x, y:x!=y,
+              "blt" : lambda x, y:x<y,
+              "bgt" : lambda x, y:x>y,
+              "ble" : lambda x, y:x<=y,
+              "bge" : lambda x, y:x>=y,
+            }
+            if functions[operation](self.registers[dest], self.registers[srca]):
+                self.program_counter = srcb
+            else:
+                self.program_counter  += 1
+
         elif operation == "goto register":
             self.program_counter = self.registers[srca]
 